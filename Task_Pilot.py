@@ -1,8 +1,29 @@
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 import datetime
 import asyncio
 import os # You need to import os
+import time
+import sqlite3
+import threading
+import heapq
+import typing
+import bisect
+from array import array
+import logging
+import logging.handlers
+import queue
+import contextvars
+import re
+import json
+import tempfile
+import gzip
+import hashlib
+import base64
+from collections import Counter, OrderedDict, defaultdict, deque
+
+import aiohttp
+from aiohttp import web
 
 # --- Configuration (EDIT THESE) ---
 
@@ -11,56 +32,1948 @@ ALLOWED_SERVERS = {1439561356960464979}
 DISCORD_BOT_TOKEN = os.environ.get("DISCORD_BOT_TOKEN")
 # 2. ROLE RESTRICTION: Define the names of the roles allowed to use MODERATION commands.
 # Only users with one of these roles can use commands like !kick, !ban, !purge, !timeout.
+# Entries may also be role IDs (ints), which keep working if the role is renamed.
 MODERATION_ROLES = ["Admin", "Moderator"] 
+# 3. PURGE LIMITS: Upper bound for a single !purge run and how many old (14+ day)
+# messages may be deleted one-by-one in parallel.
+PURGE_MAX_AMOUNT = 10000
+PURGE_SINGLE_DELETE_CONCURRENCY = 4
+# 4. TARGETPURGE SCAN: How far back !targetpurge looks by default (a duration like
+# `1d` can be passed to override it) and a hard cap on scanned messages.
+TARGETPURGE_DEFAULT_WINDOW = "1d"
+TARGETPURGE_MAX_SCAN = 25000
+# 4b. MASS ACTIONS: Maximum targets per !massban/!masskick/!masstimeout and how many
+# API calls they run in parallel (discord.py still queues calls per rate-limit bucket).
+MASS_ACTION_MAX_TARGETS = 200
+MASS_ACTION_CONCURRENCY = 5
+# 4c. LOCKDOWN: Channel permission edits !lockdown/!unlockdown run in parallel (each
+# channel has its own rate-limit bucket, so this can be higher than the above).
+LOCKDOWN_CONCURRENCY = 10
+# 4d. RAIDSWEEP: Maximum accounts a single !raidsweep may ban or kick (narrow the time
+# window if a raid is larger) and how long the preview waits for `confirm`.
+RAIDSWEEP_MAX_TARGETS = 1000
+RAIDSWEEP_CONFIRM_TIMEOUT = 60
+# 5. BAN INDEX: How often the in-memory ban index is re-synced with Discord's ban list.
+BAN_INDEX_RECONCILE_HOURS = 6
+# 6. STATS HISTORY: Hourly snapshots of member/channel/role counts kept for !stats.
+STATS_HISTORY_HOURS = 24 * 7
+# 7. STORAGE: Local directory for the bot's SQLite database (moderation log etc.).
+DATA_DIR = os.environ.get("TASK_PILOT_DATA_DIR", "data")
+DATABASE_PATH = os.path.join(DATA_DIR, "task_pilot.db")
+# 8. ANTI-SPAM: A member is timed out and their recent messages purged when they send
+# SPAM_MAX_MESSAGES messages within SPAM_WINDOW_SECONDS, repeat the same text
+# SPAM_MAX_DUPLICATES times within SPAM_DUPLICATE_WINDOW_SECONDS, or mention more than
+# SPAM_MAX_MENTIONS users/roles within SPAM_WINDOW_SECONDS. Moderators are exempt.
+SPAM_MAX_MESSAGES = 7
+SPAM_WINDOW_SECONDS = 5.0
+SPAM_MAX_DUPLICATES = 4
+SPAM_DUPLICATE_WINDOW_SECONDS = 30.0
+SPAM_MAX_MENTIONS = 10
+SPAM_TIMEOUT = "10m"
+# 9. METRICS: Port of the Prometheus-format metrics endpoint (bound to localhost only).
+# Set TASK_PILOT_METRICS_PORT=0 to disable it.
+METRICS_PORT = int(os.environ.get("TASK_PILOT_METRICS_PORT", "9102"))
+# 10. LAZY MEMBERS: Opt-in startup mode for very large guilds. Set TASK_PILOT_LAZY_MEMBERS=1
+# to skip downloading every member at startup and resolve members on demand through a
+# bounded LRU cache instead. The trade-offs: the human/bot counts become estimates from
+# the gateway's member count (bots counted by their managed roles, so bots without one
+# count as humans) and !raidsweep only knows joins since startup. By default the full
+# member list is cached and chunked before on_ready, as before.
+LAZY_MEMBERS = os.environ.get("TASK_PILOT_LAZY_MEMBERS", "0") != "0"
+MEMBER_CACHE_SIZE = 10000
+MEMBER_CACHE_TTL = 300 # Seconds before a cached member is fetched again
+# 11. RECENT MESSAGES: Every guild message seen is remembered in a compact per-channel
+# buffer (IDs and a few flags, ~20 bytes each, no content) so purges can find their
+# targets without paging through history. Limits per channel and across all channels;
+# the least recently active channels are dropped first.
+RECENT_MESSAGES_PER_CHANNEL = 5000
+RECENT_MESSAGES_MAX_TOTAL = 500000
+# 12. GUILD CONFIG FILE: Optional JSON file that overrides ALLOWED_SERVERS and, per guild,
+# the role, purge, mass-action and anti-spam settings above (which remain the defaults).
+# It is checked for changes every CONFIG_POLL_SECONDS, or reloaded with !reloadconfig.
+# Example: {"allowed_servers": [123], "defaults": {"spam_max_messages": 8},
+#           "guilds": {"123": {"moderation_roles": ["Mods", 456], "purge_max_amount": 500}}}
+CONFIG_PATH = os.environ.get("TASK_PILOT_CONFIG", os.path.join(DATA_DIR, "config.json"))
+CONFIG_POLL_SECONDS = 5
+# 13. OUTBOUND SCHEDULER: All REST calls pass one priority queue (enforcement, then
+# deletions, then informational replies) admitted at Discord's global rate. Replies of
+# informational commands that wait longer than OUTBOUND_STALE_SECONDS are dropped.
+# Set TASK_PILOT_OUTBOUND_SCHEDULER=0 to call Discord directly.
+OUTBOUND_SCHEDULER = os.environ.get("TASK_PILOT_OUTBOUND_SCHEDULER", "1") != "0"
+OUTBOUND_RATE_LIMIT = 50 # Requests per second (Discord's global limit per bot)
+OUTBOUND_STALE_SECONDS = 10.0
+OUTBOUND_BUCKET_INFLIGHT = 5 # Requests in flight per bucket until Discord reports its quota
+# 14. ARCHIVES: Where !archive and `--archive` purges write channel history (gzip JSONL
+# plus a sparse index), messages per compressed block, the most messages one !archive
+# run reads, and the largest extract !archiveuser uploads instead of leaving on disk
+# (extracts left on disk are deleted after ARCHIVE_EXTRACT_TTL_HOURS).
+ARCHIVE_DIR = os.path.join(DATA_DIR, "archives")
+ARCHIVE_BLOCK_MESSAGES = 1000
+ARCHIVE_MAX_MESSAGES = 100000
+ARCHIVE_UPLOAD_LIMIT = 8 * 1024 * 1024
+ARCHIVE_EXTRACT_TTL_HOURS = 24
 
 # --- Bot Setup and Intents ---
 
 # Intents are correctly defined.
 intents = discord.Intents.default()
-# Required for moderation/member lookup:
+# Required for moderation/member lookup (and member join/leave events):
 intents.members = True 
 # Required for command processing:
 intents.message_content = True 
+# Per-request HTTP hooks for the metrics below (callbacks are attached in Instrumentation)
+http_trace = aiohttp.TraceConfig()
 # Set the command prefix
-bot = commands.Bot(command_prefix='!', intents=intents)
+# In lazy mode the library keeps no member cache (only the bot itself) and does not chunk
+# guilds before on_ready; members are resolved through `member_cache` below.
+bot = commands.Bot(
+    command_prefix='!',
+    intents=intents,
+    http_trace=http_trace,
+    chunk_guilds_at_startup=not LAZY_MEMBERS,
+    member_cache_flags=discord.MemberCacheFlags.none() if LAZY_MEMBERS else discord.MemberCacheFlags.from_intents(intents),
+)
+
+# --- Logging ---
+# Handlers that write to the console/disk run on a listener thread; the event loop only
+# appends records to a queue, so logging never blocks a coroutine.
+
+log = logging.getLogger("task_pilot")
+
+
+def setup_logging():
+    """Routes all log records (ours and discord.py's) through a queue. Returns the started listener."""
+    log_queue = queue.SimpleQueue()
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)-8s %(name)s: %(message)s"))
+    listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+    root = logging.getLogger()
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(logging.INFO)
+    listener.start()
+    return listener
+
+# --- Instrumentation ---
+# Command latency histograms (before/after invoke hooks), command errors by type, HTTP
+# requests and 429s per route (aiohttp trace hooks, so retries are counted too) and
+# event-loop lag. Exposed as Prometheus text on localhost and through !perf.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+LOOP_LAG_INTERVAL = 0.5 # Seconds between event-loop lag probes
+
+
+class Histogram:
+    """Fixed-bucket latency histogram (Prometheus-compatible, cumulative on export)."""
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1) # Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Estimates the q-quantile by interpolating inside the matching bucket."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for upper, count in zip(LATENCY_BUCKETS, self.counts):
+            if count and seen + count >= rank:
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+            lower = upper
+        return LATENCY_BUCKETS[-1]
+
+
+class Metrics:
+    def __init__(self):
+        self.command_latency = defaultdict(Histogram) # command -> Histogram
+        self.command_errors = Counter() # (command, error type) -> count
+        self.http_requests = Counter() # (method, route, status) -> count
+        self.http_rate_limited = Counter() # (method, route) -> count
+        self.loop_lag = Histogram()
+        self.loop_lag_last = 0.0
+        self.outbound_wait = defaultdict(Histogram) # priority class -> queueing delay
+        self.outbound_coalesced = 0
+        self.outbound_dropped = 0
+
+    def render_prometheus(self):
+        lines = []
+
+        def histogram(name, labels, hist):
+            cumulative = 0
+            for upper, count in zip(LATENCY_BUCKETS + ("+Inf",), hist.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{labels}le="{upper}"}} {cumulative}')
+            label_set = "{" + labels.rstrip(",") + "}" if labels else ""
+            lines.append(f"{name}_sum{label_set} {hist.sum}")
+            lines.append(f"{name}_count{label_set} {hist.count}")
+
+        lines.append("# TYPE taskpilot_command_latency_seconds histogram")
+        for command, hist in sorted(self.command_latency.items()):
+            histogram("taskpilot_command_latency_seconds", f'command="{command}",', hist)
+        lines.append("# TYPE taskpilot_command_errors_total counter")
+        for (command, error), count in sorted(self.command_errors.items()):
+            lines.append(f'taskpilot_command_errors_total{{command="{command}",error="{error}"}} {count}')
+        lines.append("# TYPE taskpilot_http_requests_total counter")
+        for (method, route, status), count in sorted(self.http_requests.items()):
+            lines.append(f'taskpilot_http_requests_total{{method="{method}",route="{route}",status="{status}"}} {count}')
+        lines.append("# TYPE taskpilot_http_rate_limited_total counter")
+        for (method, route), count in sorted(self.http_rate_limited.items()):
+            lines.append(f'taskpilot_http_rate_limited_total{{method="{method}",route="{route}"}} {count}')
+        lines.append("# TYPE taskpilot_event_loop_lag_seconds histogram")
+        histogram("taskpilot_event_loop_lag_seconds", "", self.loop_lag)
+        lines.append("# TYPE taskpilot_outbound_wait_seconds histogram")
+        for priority, hist in sorted(self.outbound_wait.items()):
+            histogram("taskpilot_outbound_wait_seconds", f'priority="{priority}",', hist)
+        lines.append("# TYPE taskpilot_outbound_coalesced_total counter")
+        lines.append(f"taskpilot_outbound_coalesced_total {self.outbound_coalesced}")
+        lines.append("# TYPE taskpilot_outbound_dropped_total counter")
+        lines.append(f"taskpilot_outbound_dropped_total {self.outbound_dropped}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+SNOWFLAKE_IN_PATH = re.compile(r"/\d{15,21}")
+API_PREFIX = re.compile(r"^/api/v\d+")
+
+
+def route_of(url):
+    """Collapses a request URL into its route template, e.g. `/channels/{id}/messages`."""
+    return SNOWFLAKE_IN_PATH.sub("/{id}", API_PREFIX.sub("", url.path))
+
+
+async def on_http_request_end(session, trace_config_ctx, params):
+    route = route_of(params.url)
+    status = params.response.status
+    metrics.http_requests[(params.method, route, status)] += 1
+    if status == 429:
+        metrics.http_rate_limited[(params.method, route)] += 1
+    outbound.observe(params.method, params.url.path, status, params.response.headers)
+
+http_trace.on_request_end.append(on_http_request_end)
+
+
+@bot.before_invoke
+async def start_command_timer(ctx):
+    ctx.started_at = time.perf_counter()
+
+
+@bot.after_invoke
+async def record_command_latency(ctx):
+    started_at = getattr(ctx, "started_at", None)
+    if started_at is not None:
+        metrics.command_latency[ctx.command.qualified_name].observe(time.perf_counter() - started_at)
+
+
+async def monitor_loop_lag():
+    """Measures how late a fixed sleep wakes up, i.e. how long the event loop was blocked."""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        lag = max(0.0, loop.time() - started - LOOP_LAG_INTERVAL)
+        metrics.loop_lag_last = lag
+        metrics.loop_lag.observe(lag)
+
+
+async def handle_metrics(request):
+    return web.Response(text=metrics.render_prometheus(), content_type="text/plain", charset="utf-8")
+
+
+async def start_metrics_server():
+    """Serves GET /metrics on 127.0.0.1:METRICS_PORT. Raises OSError if the port cannot be bound."""
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, "127.0.0.1", METRICS_PORT).start()
+    except OSError:
+        await runner.cleanup()
+        raise
+    log.info("Metrics endpoint listening on http://127.0.0.1:%d/metrics", METRICS_PORT)
+    return runner
+
+background_tasks = set() # Strong references to long-running helper tasks
+
+# --- Outbound Scheduler ---
+# discord.py sends each REST call as soon as its own bucket allows, so during a raid a
+# flood of whois/serverinfo replies competes with bans for the same global budget. The
+# scheduler wraps HTTPClient.request: calls are admitted at OUTBOUND_RATE_LIMIT per
+# second from three FIFO queues, highest priority first. Each bucket only gets as many
+# requests in flight as Discord says it has quota left (rate-limit headers, seen by the
+# trace hook), so the rest wait here in priority order instead of in discord.py's FIFO
+# per-bucket lock, and a queue entry for a full bucket does not block the entries
+# behind it. A pending edit of a message absorbs later edits of the same
+# message, and replies of informational commands that went stale while the queue was
+# backed up are dropped. With nothing queued a call goes straight through.
+
+PRIORITY_ENFORCEMENT = 0
+PRIORITY_DELETION = 1
+PRIORITY_INFO = 2
+PRIORITY_NAMES = ("enforcement", "deletion", "info")
+
+# Priority of calls made outside commands (events, timers, background tasks) by route
+ROUTE_PRIORITIES = {
+    ("PUT", "/guilds/{guild_id}/bans/{user_id}"): PRIORITY_ENFORCEMENT,
+    ("DELETE", "/guilds/{guild_id}/bans/{user_id}"): PRIORITY_ENFORCEMENT,
+    ("POST", "/guilds/{guild_id}/bulk-ban"): PRIORITY_ENFORCEMENT,
+    ("GET", "/guilds/{guild_id}/bans"): PRIORITY_ENFORCEMENT,
+    ("GET", "/guilds/{guild_id}/members/{member_id}"): PRIORITY_ENFORCEMENT,
+    ("PATCH", "/guilds/{guild_id}/members/{user_id}"): PRIORITY_ENFORCEMENT,
+    ("DELETE", "/guilds/{guild_id}/members/{user_id}"): PRIORITY_ENFORCEMENT,
+    ("PUT", "/channels/{channel_id}/permissions/{target}"): PRIORITY_ENFORCEMENT,
+    ("DELETE", "/channels/{channel_id}/permissions/{target}"): PRIORITY_ENFORCEMENT,
+    ("GET", "/channels/{channel_id}/messages"): PRIORITY_DELETION,
+    ("DELETE", "/channels/{channel_id}/messages/{message_id}"): PRIORITY_DELETION,
+    ("POST", "/channels/{channel_id}/messages/bulk-delete"): PRIORITY_DELETION,
+}
+# Priority of everything a command does, replies included; other commands are PRIORITY_INFO
+COMMAND_PRIORITIES = {
+    **dict.fromkeys(("kick", "ban", "tempban", "unban", "timeout", "untimeout", "massban", "masskick",
+                     "masstimeout", "raidsweep", "lock", "unlock", "lockdown", "unlockdown"), PRIORITY_ENFORCEMENT),
+    **dict.fromkeys(("purge", "targetpurge", "archive", "archiveuser"), PRIORITY_DELETION),
+}
+EDIT_MESSAGE = ("PATCH", "/channels/{channel_id}/messages/{message_id}")
+# Only replies may be dropped when stale; any other call an informational command makes
+# (e.g. !reloadconfig leaving a guild) has effects beyond the reply and always goes out
+REPLY_ROUTES = {("POST", "/channels/{channel_id}/messages"), EDIT_MESSAGE}
+MAJOR_IN_PATH = re.compile(r"/(?:channels|guilds|webhooks)/(\d+)")
+
+# Set by on_message for the whole command invocation; None means "by route"
+outbound_priority = contextvars.ContextVar("outbound_priority", default=None)
+
+
+def command_priority(command):
+    """Outbound priority of a command's REST calls; None (no command) falls back to routes."""
+    if command is None:
+        return None
+    return COMMAND_PRIORITIES.get(command.qualified_name, PRIORITY_INFO)
+
+
+class OutboundDropped(discord.DiscordException):
+    """A low-priority REST call was dropped because it went stale in the outbound queue."""
+
+
+def bucket_key(method, path):
+    """(method, route template, major ID) of a request path; equal keys share a rate-limit bucket."""
+    major = MAJOR_IN_PATH.search(path)
+    return method, SNOWFLAKE_IN_PATH.sub("/{id}", API_PREFIX.sub("", path)), major.group(1) if major else None
+
+
+class BucketState:
+    __slots__ = ("remaining", "reset_at", "inflight")
+
+    def __init__(self):
+        self.remaining = None # Quota left as of the last response; None = unknown or reset
+        self.reset_at = 0.0
+        self.inflight = 0
+
+
+class OutboundRequest:
+    __slots__ = ("route", "kwargs", "priority", "key", "droppable", "queued_at", "admitted", "followers")
+
+    def __init__(self, route, kwargs, priority, key, droppable):
+        self.route = route
+        self.kwargs = kwargs
+        self.priority = priority
+        self.key = key
+        self.droppable = droppable
+        self.queued_at = time.monotonic()
+        self.admitted = asyncio.get_running_loop().create_future()
+        self.followers = [] # Futures of coalesced edits waiting for this request's result
+
+
+class OutboundScheduler:
+    """Priority admission in front of HTTPClient.request (see the section comment)."""
+
+    def __init__(self, rate=OUTBOUND_RATE_LIMIT, stale_after=OUTBOUND_STALE_SECONDS):
+        self.rate = rate
+        self.stale_after = stale_after
+        self.tokens = float(rate)
+        self.refilled = time.monotonic()
+        # Per priority: bucket key -> FIFO of requests for that bucket, buckets in the
+        # order they were last served, so a full bucket is skipped in one step and
+        # entries are only ever popped from the front.
+        self.queues = (OrderedDict(), OrderedDict(), OrderedDict())
+        self.size = 0
+        self.edits = {} # URL -> queued OutboundRequest editing that message
+        self.buckets = {} # bucket key -> BucketState, for buckets seen recently
+        self.paused_until = 0.0 # Global 429
+        self.wakeup = asyncio.Event()
+        self.runner = None
+        self.send = None # The wrapped HTTPClient.request
+
+    def install(self, http):
+        if self.send is None:
+            self.send = http.request
+            http.request = self.request
+        if self.runner is None or self.runner.done():
+            self.runner = asyncio.create_task(self._run())
+
+    def queued(self):
+        return self.size
+
+    def observe(self, method, path, status, headers):
+        """Learns a bucket's quota (and global pauses) from a response's rate-limit headers."""
+        now = time.monotonic()
+        if status == 429 and headers.get("X-RateLimit-Global"):
+            self.paused_until = now + float(headers.get("Retry-After", 1))
+        remaining = headers.get("X-RateLimit-Remaining")
+        if remaining is not None:
+            key = bucket_key(method, path)
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = BucketState()
+            bucket.remaining = int(remaining)
+            bucket.reset_at = now + float(headers.get("X-RateLimit-Reset-After", 1))
+        self.wakeup.set()
+
+    def _refill(self, now):
+        self.tokens = min(self.rate, self.tokens + (now - self.refilled) * self.rate)
+        self.refilled = now
+
+    def _ready(self, key, now):
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            return True
+        if bucket.reset_at <= now:
+            bucket.remaining = None
+        limit = OUTBOUND_BUCKET_INFLIGHT if bucket.remaining is None else bucket.remaining
+        return bucket.inflight < limit
+
+    def _prune(self, now):
+        idle = [key for key, bucket in self.buckets.items() if not bucket.inflight and bucket.reset_at <= now]
+        for key in idle:
+            del self.buckets[key]
+
+    async def _send(self, route, key, kwargs):
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = BucketState()
+        bucket.inflight += 1
+        try:
+            return await self.send(route, **kwargs)
+        finally:
+            bucket.inflight -= 1
+            if self.queued():
+                self.wakeup.set()
+
+    async def request(self, route, **kwargs):
+        priority = outbound_priority.get()
+        droppable = priority == PRIORITY_INFO and (route.method, route.path) in REPLY_ROUTES
+        if priority is None:
+            priority = ROUTE_PRIORITIES.get((route.method, route.path), PRIORITY_INFO)
+        key = bucket_key(route.method, route.url[len(route.BASE):])
+        if self.runner is None or self.runner.done():
+            return await self.send(route, **kwargs) # Not running (startup, shutdown): no admission
+        now = time.monotonic()
+        self._refill(now)
+        if not self.size and self.tokens >= 1 and now >= self.paused_until and self._ready(key, now):
+            self.tokens -= 1
+            return await self._send(route, key, kwargs)
+
+        coalesce = (route.method, route.path) == EDIT_MESSAGE and not kwargs.get("files")
+        if coalesce:
+            pending = self.edits.get(route.url)
+            if pending is not None:
+                # The queued edit has not been sent yet: send this content instead
+                pending.kwargs = kwargs
+                result = asyncio.get_running_loop().create_future()
+                pending.followers.append(result)
+                metrics.outbound_coalesced += 1
+                return await result
+
+        entry = OutboundRequest(route, kwargs, priority, key, droppable)
+        waiting = self.queues[priority].get(key)
+        if waiting is None:
+            waiting = self.queues[priority][key] = deque()
+        waiting.append(entry)
+        self.size += 1
+        if coalesce:
+            self.edits[route.url] = entry
+        self.wakeup.set()
+        try:
+            await entry.admitted
+        except BaseException as e:
+            for follower in entry.followers:
+                if not follower.done():
+                    follower.set_exception(e if isinstance(e, OutboundDropped) else OutboundDropped("superseded edit was cancelled"))
+            raise
+        finally:
+            if coalesce and self.edits.get(route.url) is entry:
+                del self.edits[route.url]
+        metrics.outbound_wait[PRIORITY_NAMES[priority]].observe(time.monotonic() - entry.queued_at)
+        if not entry.followers:
+            return await self._send(route, key, entry.kwargs)
+        try:
+            result = await self._send(route, key, entry.kwargs)
+        except BaseException as e:
+            for follower in entry.followers:
+                if not follower.done():
+                    follower.set_exception(e)
+            raise
+        for follower in entry.followers:
+            if not follower.done():
+                follower.set_result(result)
+        return result
+
+    def _next(self, now):
+        """Pops the next admissible request, dropping cancelled and stale droppable ones on the way."""
+        for queue in self.queues:
+            for key in list(queue):
+                waiting = queue[key]
+                # A bucket's FIFO is in arrival order, so gone and stale entries are at its front
+                while waiting:
+                    entry = waiting[0]
+                    if entry.admitted.done(): # Caller gave up (cancelled)
+                        pass
+                    elif entry.droppable and now - entry.queued_at > self.stale_after:
+                        metrics.outbound_dropped += 1
+                        entry.admitted.set_exception(OutboundDropped(f"{entry.route.method} {entry.route.path} dropped after {now - entry.queued_at:.1f}s"))
+                    else:
+                        break
+                    waiting.popleft()
+                    self.size -= 1
+                if not waiting:
+                    del queue[key]
+                    continue
+                if self._ready(key, now):
+                    self.size -= 1
+                    entry = waiting.popleft()
+                    if waiting:
+                        queue.move_to_end(key) # Round-robin between buckets of one priority
+                    else:
+                        del queue[key]
+                    return entry
+        return None
+
+    async def _run(self):
+        # A bug in admission must not leave every REST call waiting forever: log and go on
+        while True:
+            try:
+                await self._admit()
+            except Exception:
+                log.exception("Outbound scheduler failed; restarting it")
+                await asyncio.sleep(0.1)
+
+    async def _admit(self):
+        while True:
+            now = time.monotonic()
+            if not self.size:
+                self._prune(now)
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+            self._refill(now)
+            delay = None
+            if now < self.paused_until:
+                delay = self.paused_until - now
+            elif self.tokens < 1:
+                delay = (1 - self.tokens) / self.rate
+            else:
+                entry = self._next(now)
+                if entry is not None:
+                    self.tokens -= 1
+                    entry.admitted.set_result(None)
+                    await asyncio.sleep(0) # Let the admitted caller start its request
+                    continue
+                # Everything queued waits on a full bucket: a response or a reset frees it
+                resets = [bucket.reset_at for bucket in self.buckets.values() if bucket.reset_at > now]
+                delay = min(resets) - now if resets else 0.05
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+
+outbound = OutboundScheduler()
+
+# --- Guild Configuration ---
+# Settings are read from an immutable snapshot: a frozenset of allowed guilds plus one
+# GuildSettings tuple per configured guild. A reload builds and validates a complete new
+# snapshot and then swaps a single reference, so readers never see a half-applied file
+# and a lookup on the hot path is one dict get.
+
+
+class GuildSettings(typing.NamedTuple):
+    moderation_roles: tuple
+    purge_max_amount: int
+    targetpurge_default_window: str
+    targetpurge_max_scan: int
+    mass_action_max_targets: int
+    spam_max_messages: int
+    spam_window_seconds: float
+    spam_max_duplicates: int
+    spam_duplicate_window_seconds: float
+    spam_max_mentions: int
+    spam_timeout: str
+
+
+class ConfigSnapshot(typing.NamedTuple):
+    allowed_servers: frozenset
+    defaults: GuildSettings
+    guilds: dict # guild_id -> GuildSettings; never mutated once built
+
+
+DEFAULT_GUILD_SETTINGS = GuildSettings(
+    moderation_roles=tuple(MODERATION_ROLES),
+    purge_max_amount=PURGE_MAX_AMOUNT,
+    targetpurge_default_window=TARGETPURGE_DEFAULT_WINDOW,
+    targetpurge_max_scan=TARGETPURGE_MAX_SCAN,
+    mass_action_max_targets=MASS_ACTION_MAX_TARGETS,
+    spam_max_messages=SPAM_MAX_MESSAGES,
+    spam_window_seconds=SPAM_WINDOW_SECONDS,
+    spam_max_duplicates=SPAM_MAX_DUPLICATES,
+    spam_duplicate_window_seconds=SPAM_DUPLICATE_WINDOW_SECONDS,
+    spam_max_mentions=SPAM_MAX_MENTIONS,
+    spam_timeout=SPAM_TIMEOUT,
+)
+
+
+def parse_guild_settings(data, base, where):
+    """Applies the overrides in `data` on top of `base`. Raises ValueError naming the bad key."""
+    if not isinstance(data, dict):
+        raise ValueError(f"{where}: expected an object")
+    values = {}
+    for key, value in data.items():
+        if key not in GuildSettings._fields:
+            raise ValueError(f"{where}: unknown setting '{key}'")
+        default = getattr(base, key)
+        if isinstance(default, tuple):
+            if not isinstance(value, list) or not all(isinstance(item, (int, str)) and not isinstance(item, bool) for item in value):
+                raise ValueError(f"{where}.{key}: expected a list of role names or IDs")
+            value = tuple(value)
+        elif isinstance(default, str):
+            if not isinstance(value, str):
+                raise ValueError(f"{where}.{key}: expected a duration like '10m'")
+            try:
+                parse_duration(value)
+            except ValueError as e:
+                raise ValueError(f"{where}.{key}: {e}")
+        elif isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0:
+            raise ValueError(f"{where}.{key}: expected a positive number")
+        elif isinstance(default, int):
+            if value != int(value):
+                raise ValueError(f"{where}.{key}: expected a whole number")
+            value = int(value)
+        else:
+            value = float(value)
+        values[key] = value
+    return base._replace(**values)
+
+
+class GuildConfig:
+    """Holds the current ConfigSnapshot and rebuilds it from CONFIG_PATH on demand."""
+
+    def __init__(self, path):
+        self.path = path
+        self.snapshot = ConfigSnapshot(frozenset(ALLOWED_SERVERS), DEFAULT_GUILD_SETTINGS, {})
+        self.mtime = None # Modification time of the file version last loaded (or rejected)
+
+    def get(self, guild_id):
+        """The effective settings for a guild."""
+        snapshot = self.snapshot
+        return snapshot.guilds.get(guild_id, snapshot.defaults)
+
+    def is_allowed(self, guild_id):
+        return guild_id in self.snapshot.allowed_servers
+
+    def _file_mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def changed(self):
+        return self._file_mtime() != self.mtime
+
+    def load(self):
+        """
+        Builds a new snapshot from the file (or the built-in constants if there is none)
+        and swaps it in. Raises ValueError and keeps the current snapshot if the file is invalid.
+        """
+        mtime = self.mtime = self._file_mtime()
+        if mtime is None:
+            snapshot = ConfigSnapshot(frozenset(ALLOWED_SERVERS), DEFAULT_GUILD_SETTINGS, {})
+        else:
+            try:
+                with open(self.path, encoding="utf-8") as f:
+                    data = json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                raise ValueError(f"{self.path}: {e}")
+            if not isinstance(data, dict):
+                raise ValueError(f"{self.path}: expected a JSON object")
+            unknown = set(data) - {"allowed_servers", "defaults", "guilds"}
+            if unknown:
+                raise ValueError(f"{self.path}: unknown section(s) {', '.join(sorted(unknown))}")
+            allowed = data.get("allowed_servers", sorted(ALLOWED_SERVERS))
+            if not isinstance(allowed, list) or not allowed or not all(isinstance(guild_id, int) for guild_id in allowed):
+                raise ValueError(f"{self.path}: allowed_servers must be a non-empty list of guild IDs")
+            defaults = parse_guild_settings(data.get("defaults", {}), DEFAULT_GUILD_SETTINGS, "defaults")
+            guilds = data.get("guilds", {})
+            if not isinstance(guilds, dict) or not all(key.isdigit() for key in guilds):
+                raise ValueError(f"{self.path}: guilds must map guild IDs to settings")
+            snapshot = ConfigSnapshot(
+                frozenset(allowed),
+                defaults,
+                {int(key): parse_guild_settings(value, defaults, f"guilds.{key}") for key, value in guilds.items()},
+            )
+        self.snapshot = snapshot
+        return snapshot
+
+
+guild_config = GuildConfig(CONFIG_PATH)
+
+
+async def reload_guild_config():
+    """Reloads the config file and applies it. Raises ValueError (nothing changes) if it is invalid."""
+    snapshot = await asyncio.to_thread(guild_config.load)
+    # Drop state derived from the previous settings; both rebuild lazily
+    moderator_role_ids.clear()
+    spam_filter.reset()
+    for guild in bot.guilds:
+        if guild.id not in snapshot.allowed_servers:
+            log.warning("CONFIG: Leaving guild '%s' (ID: %s), no longer in allowed_servers", guild.name, guild.id)
+            await guild.leave()
+    return snapshot
+
+
+@tasks.loop(seconds=CONFIG_POLL_SECONDS)
+async def watch_guild_config():
+    if not guild_config.changed():
+        return
+    try:
+        await reload_guild_config()
+        log.info("Reloaded guild configuration from %s", guild_config.path)
+    except ValueError as e:
+        log.error("Ignoring invalid guild configuration: %s", e)
 
 # --- Custom Role Checker Function ---
 
+# The guild's moderation_roles setting resolved to role IDs. Rebuilt lazily after role
+# changes and config reloads.
+moderator_role_ids = {} # guild_id -> frozenset of role IDs
+
+def get_moderator_role_ids(guild):
+    """Returns the IDs of the guild's roles listed in its moderation_roles setting (by name or ID)."""
+    role_ids = moderator_role_ids.get(guild.id)
+    if role_ids is None:
+        moderation_roles = guild_config.get(guild.id).moderation_roles
+        role_ids = frozenset(role.id for role in guild.roles if role.name in moderation_roles or role.id in moderation_roles)
+        moderator_role_ids[guild.id] = role_ids
+    return role_ids
+
+def has_moderator_role(member):
+    """True if the member holds any moderator role."""
+    # Intersect from the small side: Member.get_role binary-searches the member's sorted
+    # role IDs, so no list of Role objects or names is built for members with many roles.
+    return any(member.get_role(role_id) is not None for role_id in get_moderator_role_ids(member.guild))
+
 def is_moderator():
-    """Custom check function to see if the user has any role listed in MODERATION_ROLES."""
+    """Custom check function to see if the user has any of the guild's moderation roles."""
     async def predicate(ctx):
         # Check if the command is in a guild (server) context
         if not ctx.guild:
             return False
             
-        # Check if the user has a role matching any name in MODERATION_ROLES
-        role_names = [role.name for role in ctx.author.roles]
-        
-        # Check if any required role name is in the user's role list
-        if any(role_name in role_names for role_name in MODERATION_ROLES):
+        if has_moderator_role(ctx.author):
             return True
         
         # If no matching role is found, raise the custom exception
-        raise commands.CheckFailure(f"You must have one of the following roles to use this command: {', '.join(MODERATION_ROLES)}")
+        raise commands.CheckFailure(f"You must have one of the following roles to use this command: {', '.join(map(str, guild_config.get(ctx.guild.id).moderation_roles))}")
         
     return commands.check(predicate)
 
+# --- Duration Parsing ---
+
+def parse_duration(duration):
+    """Parses durations like `30s`, `10m`, `1h` or `7d` into a timedelta. Raises ValueError with a user-facing message."""
+    try:
+        unit = duration[-1].lower()
+        time_value = int(duration[:-1])
+    except (ValueError, IndexError):
+        raise ValueError("Invalid duration format. Use formats like `1h`, `30m`, or `7d`.")
+
+    if unit == 's':
+        return datetime.timedelta(seconds=time_value)
+    elif unit == 'm':
+        return datetime.timedelta(minutes=time_value)
+    elif unit == 'h':
+        return datetime.timedelta(hours=time_value)
+    elif unit == 'd':
+        return datetime.timedelta(days=time_value)
+    raise ValueError("Invalid duration unit. Use `s`, `m`, `h`, or `d`.")
+
+# --- Member Cache ---
+# Bounded LRU of members resolved on demand. Misses are fetched over REST, and
+# concurrent lookups of the same member share one in-flight request. The library's own
+# cache is still checked first, so this also works with the full member cache enabled.
+
+class MemberCache:
+    """LRU of (guild_id, user_id) -> Member with fetch-on-miss and request coalescing."""
+
+    def __init__(self, capacity, ttl):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.entries = OrderedDict() # (guild_id, user_id) -> (member, fetched_at)
+        self.inflight = {} # (guild_id, user_id) -> Task
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, guild, user_id):
+        """Returns the member. Raises discord.NotFound if the user is not in the guild."""
+        member = guild.get_member(user_id)
+        if member is not None:
+            return member
+
+        key = (guild.id, user_id)
+        entry = self.entries.get(key)
+        if entry is not None and time.monotonic() - entry[1] < self.ttl:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+        self.misses += 1
+        task = self.inflight.get(key)
+        if task is None:
+            # Run in a fresh context: the fetch is shared, so it must not inherit the
+            # first caller's outbound priority (a droppable whois would fail a ban
+            # that joins it). Without one, the request is classed by route.
+            task = self.inflight[key] = asyncio.create_task(self._fetch(guild, user_id, key), context=contextvars.Context())
+        # Shielded so one cancelled caller does not cancel the lookup for the others
+        return await asyncio.shield(task)
+
+    async def get_or_none(self, guild, user_id):
+        try:
+            return await self.get(guild, user_id)
+        except discord.NotFound:
+            return None
+
+    async def _fetch(self, guild, user_id, key):
+        try:
+            member = await guild.fetch_member(user_id)
+        finally:
+            self.inflight.pop(key, None)
+        self.put(member)
+        return member
+
+    def put(self, member):
+        key = (member.guild.id, member.id)
+        self.entries[key] = (member, time.monotonic())
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def evict(self, guild_id, user_id):
+        self.entries.pop((guild_id, user_id), None)
+
+    def evict_guild(self, guild_id):
+        for key in [key for key in self.entries if key[0] == guild_id]:
+            del self.entries[key]
+
+
+member_cache = MemberCache(MEMBER_CACHE_SIZE, MEMBER_CACHE_TTL)
+
+
+async def edit_member(member, *, reason=None, **fields):
+    """Member.edit that keeps member_cache in step, so later checks never see the old state."""
+    updated = await member.edit(reason=reason, **fields)
+    if updated is not None:
+        member_cache.put(updated)
+    else:
+        member_cache.evict(member.guild.id, member.id)
+    return updated
+
+
+def install_member_update_hook(state):
+    """
+    Dispatches `raw_member_update` (the GUILD_MEMBER_UPDATE payload) for every member
+    update. discord.py drops updates of members it does not cache, which in lazy member
+    mode is nearly all of them, so member_cache would keep serving the old roles and
+    timeout until its TTL ran out. Wraps ConnectionState.parsers, which is internal to
+    discord.py; if it is missing the hook is skipped and only the TTL applies.
+    """
+    parsers = getattr(state, "parsers", None)
+    parse = parsers.get("GUILD_MEMBER_UPDATE") if parsers is not None else None
+    if parse is None:
+        log.warning("Cannot hook GUILD_MEMBER_UPDATE; cached members refresh only after %ss", MEMBER_CACHE_TTL)
+        return
+
+    def parse_member_update(data):
+        state.dispatch("raw_member_update", data)
+        parse(data)
+
+    parsers["GUILD_MEMBER_UPDATE"] = parse_member_update
+
+
+class CachedMember(commands.MemberConverter):
+    """Member converter that resolves IDs and mentions through member_cache (names use the default lookup)."""
+
+    async def convert(self, ctx, argument):
+        match = self._get_id_match(argument) or re.match(r'<@!?([0-9]{15,20})>$', argument)
+        if match is None or ctx.guild is None:
+            return await super().convert(ctx, argument)
+        try:
+            return await member_cache.get(ctx.guild, int(match.group(1)))
+        except discord.NotFound:
+            raise commands.MemberNotFound(argument)
+
+# --- Ban Index ---
+# Fetching the ban list is a paginated REST walk (1000 bans per page), which takes
+# seconds on guilds with tens of thousands of bans. Each guild's list is loaded once,
+# kept in sync by the ban/unban gateway events and periodically reconciled, so `unban`
+# resolves users from memory.
+
+def normalize_name(name):
+    return name.casefold().strip()
+
+
+class BanIndex:
+    """In-memory ban list of one guild, keyed by user ID and by normalized name/global_name."""
+
+    def __init__(self):
+        self.by_id = {}
+        self.by_name = {}
+        self.loaded = False
+        self.lock = asyncio.Lock()
+        self.changes = None # user_id -> User (banned) or None (unbanned), recorded while the list is re-fetched
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def _names(self, user):
+        names = {normalize_name(user.name)}
+        if user.global_name:
+            names.add(normalize_name(user.global_name))
+        return names
+
+    def add(self, user):
+        self.remove(user.id)
+        self.by_id[user.id] = user
+        for name in self._names(user):
+            self.by_name.setdefault(name, set()).add(user.id)
+        if self.changes is not None:
+            self.changes[user.id] = user
+
+    def remove(self, user_id):
+        if self.changes is not None:
+            self.changes[user_id] = None
+        user = self.by_id.pop(user_id, None)
+        if user is None:
+            return
+        for name in self._names(user):
+            ids = self.by_name.get(name)
+            if ids is not None:
+                ids.discard(user_id)
+                if not ids:
+                    del self.by_name[name]
+
+    def find(self, text):
+        """Returns the banned user matching an ID, mention or exact (case-insensitive) name, if unambiguous."""
+        text = text.strip()
+        user_id = text.strip("<@!>")
+        if user_id.isdigit():
+            return self.by_id.get(int(user_id))
+        ids = self.by_name.get(normalize_name(text))
+        if ids and len(ids) == 1:
+            return self.by_id[next(iter(ids))]
+        return None
+
+    def suggest(self, text, limit=5):
+        """Returns up to `limit` banned users whose name or global name contains `text`."""
+        needle = normalize_name(text)
+        found = []
+        for name, ids in self.by_name.items():
+            if needle in name:
+                found.extend(self.by_id[user_id] for user_id in ids if self.by_id[user_id] not in found)
+                if len(found) >= limit:
+                    break
+        return found[:limit]
+
+
+ban_indexes = {} # guild_id -> BanIndex
+
+
+async def fetch_ban_index(guild):
+    """Builds a fresh BanIndex from the full ban list (one paginated walk)."""
+    index = BanIndex()
+    async for entry in guild.bans(limit=None):
+        index.add(entry.user)
+    index.loaded = True
+    return index
+
+
+async def refresh_ban_index(guild, index):
+    """Replaces `index`'s contents with the full ban list. Call with `index.lock` held."""
+    # The walk pages by ascending user ID and can take a minute, so a ban or unban during
+    # it may land behind the cursor; those are recorded and replayed onto the new list.
+    index.changes = {}
+    try:
+        fresh = await fetch_ban_index(guild)
+    finally:
+        changes, index.changes = index.changes, None
+    for user_id, user in changes.items():
+        if user is None:
+            fresh.remove(user_id)
+        else:
+            fresh.add(user)
+    index.by_id, index.by_name, index.loaded = fresh.by_id, fresh.by_name, True
+
+
+async def get_ban_index(guild):
+    """Returns the guild's ban index, loading it on first use. Raises discord.Forbidden without Ban Members."""
+    index = ban_indexes.setdefault(guild.id, BanIndex())
+    if index.loaded:
+        return index
+    async with index.lock:
+        if not index.loaded:
+            await refresh_ban_index(guild, index)
+    return index
+
+
+@tasks.loop(hours=BAN_INDEX_RECONCILE_HOURS)
+async def reconcile_ban_indexes():
+    """Re-syncs every loaded ban index in case a gateway event was missed."""
+    for guild_id, index in list(ban_indexes.items()):
+        guild = bot.get_guild(guild_id)
+        if guild is None:
+            ban_indexes.pop(guild_id, None)
+            continue
+        if not index.loaded:
+            continue
+        try:
+            async with index.lock:
+                await refresh_ban_index(guild, index)
+        except discord.HTTPException as e:
+            log.warning("Ban index reconcile failed for '%s': HTTP %s", guild.name, e.status)
+
+# --- Guild Statistics ---
+# Counting bots means walking the whole member cache, which is expensive on large
+# guilds. Counters are seeded once per guild and then maintained from gateway events,
+# so `serverinfo` and `!stats` never iterate members, channels or roles. In eager mode
+# the cached member list also seeds the join index used by !raidsweep.
+
+class GuildStats:
+    """Incrementally maintained member/channel/role counts of one guild."""
+
+    def __init__(self, guild):
+        # With the member list cached the counts are exact. Otherwise (lazy mode) they
+        # start from the gateway's member count, and every bot added with permissions
+        # has a managed role, which is as close as we get without downloading members.
+        self.exact = guild.chunked
+        if self.exact:
+            self.bots = sum(1 for member in guild.members if member.bot)
+        else:
+            self.bots = sum(1 for role in guild.roles if role.tags is not None and role.tags.is_bot_managed())
+        self.humans = (guild.member_count or len(guild.members)) - self.bots
+        self.text_channels = len(guild.text_channels)
+        self.voice_channels = len(guild.voice_channels)
+        self.categories = len(guild.categories)
+        self.roles = len(guild.roles)
+        self.history = deque(maxlen=STATS_HISTORY_HOURS) # (timestamp, humans, bots)
+
+    def member_changed(self, member, delta):
+        if member.bot:
+            self.bots += delta
+        else:
+            self.humans += delta
+
+    def channel_changed(self, channel, delta):
+        if isinstance(channel, discord.TextChannel):
+            self.text_channels += delta
+        elif isinstance(channel, discord.VoiceChannel):
+            self.voice_channels += delta
+        elif isinstance(channel, discord.CategoryChannel):
+            self.categories += delta
+
+    def snapshot(self):
+        self.history.append((discord.utils.utcnow(), self.humans, self.bots))
+
+
+guild_stats = {} # guild_id -> GuildStats
+
+
+def get_guild_stats(guild):
+    """Returns the guild's counters, seeding them on first use."""
+    stats = guild_stats.get(guild.id)
+    if stats is None:
+        stats = guild_stats[guild.id] = GuildStats(guild)
+    return stats
+
+
+def seed_guild_stats(guild):
+    """
+    Seeds the member counters of a guild, and its join index if the member list is
+    cached (eager mode). Nothing is downloaded: in lazy mode the counters start from the
+    gateway's member count and the join index from the joins seen since startup.
+    """
+    stats = GuildStats(guild)
+    previous = guild_stats.get(guild.id)
+    if previous is not None:
+        stats.history = previous.history
+    guild_stats[guild.id] = stats
+    index = get_join_index(guild.id)
+    if guild.chunked and not index.seeded:
+        index.seed(guild.members)
+
+
+@tasks.loop(hours=1)
+async def record_guild_stats():
+    for stats in guild_stats.values():
+        stats.snapshot()
+
+# --- Join Index ---
+# Members of each guild ordered by join time, so "everyone who joined in the last 10
+# minutes" is a bisect instead of a walk over the member list. Entries are two parallel
+# arrays (timestamps, IDs); leaving only drops the member from `joined`, and the stale
+# array entries are skipped by queries and compacted away in bulk. Account age needs
+# no storage: it is encoded in the member ID.
+
+
+class JoinIndex:
+    """Join timestamps of one guild's members, ascending, with range queries."""
+
+    def __init__(self):
+        self.times = array("d")
+        self.ids = array("Q")
+        self.joined = {} # member_id -> join timestamp of the member's live entry
+        self.bots = set()
+        self.seeded = False
+        self.covered_since = time.time() # Before seeding, only joins after this are known
+
+    def __len__(self):
+        return len(self.joined)
+
+    def add(self, member_id, joined_at, bot=False):
+        timestamp = joined_at.timestamp()
+        self.joined[member_id] = timestamp
+        if bot:
+            self.bots.add(member_id)
+        if not self.times or timestamp >= self.times[-1]:
+            self.times.append(timestamp)
+            self.ids.append(member_id)
+        else:
+            index = bisect.bisect_right(self.times, timestamp)
+            self.times.insert(index, timestamp)
+            self.ids.insert(index, member_id)
+
+    def remove(self, member_id):
+        if self.joined.pop(member_id, None) is None:
+            return
+        self.bots.discard(member_id)
+        if len(self.ids) > 2 * len(self.joined) + 1024:
+            self._rebuild()
+
+    def _rebuild(self):
+        entries = sorted((timestamp, member_id) for member_id, timestamp in self.joined.items())
+        self.times = array("d", [timestamp for timestamp, _ in entries])
+        self.ids = array("Q", [member_id for _, member_id in entries])
+
+    def seed(self, members):
+        """Merges a full member list; joins recorded since the index was created take precedence."""
+        joined = self.joined
+        for member in members:
+            if member.joined_at is not None and member.id not in joined:
+                joined[member.id] = member.joined_at.timestamp()
+                if member.bot:
+                    self.bots.add(member.id)
+        self._rebuild()
+        self.seeded = True
+
+    def since(self, timestamp):
+        """(member_id, join timestamp) of current members who joined at or after `timestamp`, oldest first."""
+        start = bisect.bisect_left(self.times, timestamp)
+        joined = self.joined
+        return [(member_id, joined_at) for joined_at, member_id in zip(self.times[start:], self.ids[start:])
+                if joined.get(member_id) == joined_at]
+
+
+join_indexes = {} # guild_id -> JoinIndex
+
+
+def get_join_index(guild_id):
+    index = join_indexes.get(guild_id)
+    if index is None:
+        index = join_indexes[guild_id] = JoinIndex()
+    return index
+
+# --- Storage ---
+
+def open_database(path):
+    """Opens a connection to the bot's SQLite database (WAL mode, shareable with worker threads)."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+# --- Moderation Log ---
+# Append-only record of moderation actions in a local SQLite database (WAL mode).
+# Commands only enqueue events; a background writer batches them into one transaction
+# per burst on a worker thread, so logging never blocks a command coroutine.
+
+MODLOG_BATCH_SIZE = 500
+MODLOG_FLUSH_DELAY = 0.5 # Seconds to let a burst of events accumulate before writing
+MODLOG_PAGE_SIZE = 10
+
+
+class ModerationLog:
+    """SQLite-backed moderation log with a write-behind queue and keyset-paginated queries."""
+
+    def __init__(self, path):
+        self.path = path
+        self.queue = asyncio.Queue()
+        self.conn = None
+        self.lock = threading.Lock() # The connection is shared by the writer and readers' threads
+        self.writer = None
+
+    def open(self):
+        self.conn = open_database(self.path)
+        with self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS modlog (
+                    id INTEGER PRIMARY KEY,
+                    guild_id INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    action TEXT NOT NULL,
+                    moderator_id INTEGER,
+                    target_id INTEGER,
+                    reason TEXT,
+                    details TEXT
+                )""")
+            # Every SQLite index implicitly ends with the rowid (`id`), so these also
+            # serve "newest first" keyset pages without a sort. The unfiltered listing
+            # needs its own (guild_id, id) index, or SQLite sorts in a temp B-tree.
+            self.conn.execute("CREATE INDEX IF NOT EXISTS modlog_guild_id ON modlog (guild_id, id)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS modlog_guild_target ON modlog (guild_id, target_id)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS modlog_guild_moderator ON modlog (guild_id, moderator_id)")
+            # Nothing queries by time alone; databases from earlier versions still have this index
+            self.conn.execute("DROP INDEX IF EXISTS modlog_created_at")
+
+    def start(self):
+        """Opens the database and starts the background writer (idempotent)."""
+        if self.conn is None:
+            self.open()
+        if self.writer is None or self.writer.done():
+            self.writer = asyncio.create_task(self._write_loop())
+
+    def record(self, guild_id, action, moderator_id=None, target_id=None, reason=None, details=None):
+        """Enqueues one event. Never blocks and never touches the database directly."""
+        self.queue.put_nowait((guild_id, time.time(), action, moderator_id, target_id, reason, details))
+
+    def _insert(self, rows):
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT INTO modlog (guild_id, created_at, action, moderator_id, target_id, reason, details) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+
+    def _drain(self, rows):
+        while len(rows) < MODLOG_BATCH_SIZE:
+            try:
+                rows.append(self.queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+        return rows
+
+    async def _write_loop(self):
+        while True:
+            rows = [await self.queue.get()]
+            try:
+                await asyncio.sleep(MODLOG_FLUSH_DELAY)
+            except asyncio.CancelledError:
+                # Shutting down: don't lose the events already taken off the queue
+                self._insert(self._drain(rows))
+                raise
+            self._drain(rows)
+            try:
+                await asyncio.to_thread(self._insert, rows)
+            except sqlite3.Error as e:
+                log.error("Moderation log write failed (%d events dropped): %s", len(rows), e)
+
+    def flush_pending(self):
+        """Synchronously writes whatever is still queued (used on shutdown)."""
+        if self.conn is None:
+            return
+        while not self.queue.empty():
+            self._insert(self._drain([]))
+
+    def _query(self, guild_id, target_id, moderator_id, before_id, limit):
+        sql = "SELECT id, created_at, action, moderator_id, target_id, reason, details FROM modlog WHERE guild_id = ?"
+        params = [guild_id]
+        if target_id is not None:
+            sql += " AND target_id = ?"
+            params.append(target_id)
+        if moderator_id is not None:
+            sql += " AND moderator_id = ?"
+            params.append(moderator_id)
+        # Keyset pagination: continue below the last seen ID instead of using OFFSET,
+        # so page N costs the same as page 1 on a large history.
+        if before_id is not None:
+            sql += " AND id < ?"
+            params.append(before_id)
+        sql += " ORDER BY id DESC LIMIT ?"
+        params.append(limit)
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    async def query(self, guild_id, *, target_id=None, moderator_id=None, before_id=None, limit=MODLOG_PAGE_SIZE):
+        """Returns up to `limit` events, newest first, as (id, created_at, action, moderator_id, target_id, reason, details)."""
+        return await asyncio.to_thread(self._query, guild_id, target_id, moderator_id, before_id, limit)
+
+
+modlog = ModerationLog(DATABASE_PATH)
+
+
+def log_action(ctx, action, target_id=None, reason=None, details=None):
+    """Records a moderation action performed through a command."""
+    modlog.record(ctx.guild.id, action, ctx.author.id, target_id, reason, details)
+
+# --- Delayed Deletion ---
+# Temporary bot replies (purge confirmations etc.) are handed to one background task
+# instead of each command sleeping and issuing its own DELETE. Messages that come due
+# together are grouped per channel and removed with a single bulk delete.
+
+CONFIRMATION_TTL = 5 # Seconds temporary replies stay visible
+DELETION_GROUP_SLACK = 1.0 # Messages due within this many seconds are deleted together
+
+
+class DeletionQueue:
+    """Time-ordered queue of messages to delete, drained by a single task."""
+
+    def __init__(self):
+        self.heap = [] # (due, sequence, channel, message_id)
+        self.sequence = 0
+        self.wakeup = asyncio.Event()
+        self.runner = None
+
+    def start(self):
+        if self.runner is None or self.runner.done():
+            self.runner = asyncio.create_task(self._run())
+
+    def schedule(self, message, delay=CONFIRMATION_TTL):
+        """Deletes `message` after `delay` seconds. Returns immediately."""
+        self.sequence += 1
+        entry = (time.monotonic() + delay, self.sequence, message.channel, message.id)
+        heapq.heappush(self.heap, entry)
+        if self.heap[0] is entry:
+            self.wakeup.set()
+
+    async def _run(self):
+        while True:
+            if not self.heap:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+
+            delay = self.heap[0][0] - time.monotonic()
+            if delay > 0:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            # Take everything due now (plus a little slack) and group it by channel
+            horizon = time.monotonic() + DELETION_GROUP_SLACK
+            by_channel = defaultdict(list)
+            while self.heap and self.heap[0][0] <= horizon:
+                due, sequence, channel, message_id = heapq.heappop(self.heap)
+                by_channel[channel].append(discord.Object(id=message_id))
+
+            for channel, messages in by_channel.items():
+                for start in range(0, len(messages), BULK_DELETE_BATCH_SIZE):
+                    await self._delete(channel, messages[start:start + BULK_DELETE_BATCH_SIZE])
+
+    async def _delete(self, channel, messages):
+        try:
+            # One message is a plain DELETE, two or more a single bulk delete
+            await channel.delete_messages(messages)
+        except discord.NotFound:
+            pass # Already deleted by someone else
+        except discord.HTTPException as e:
+            log.warning("Delayed deletion of %d message(s) in #%s failed: HTTP %s", len(messages), channel, e.status)
+
+
+deletion_queue = DeletionQueue()
+
+
+async def send_temporary(destination, content=None, *, delay=CONFIRMATION_TTL, **kwargs):
+    """Sends to a context or channel; the message is removed after `delay` seconds by the deletion queue."""
+    message = await destination.send(content, **kwargs)
+    deletion_queue.schedule(message, delay)
+    return message
+
+# --- Timer Scheduler ---
+# Durable delayed actions (temporary bans, timed channel locks). Pending timers live in
+# SQLite and, while the bot runs, in a single min-heap of small tuples. One task sleeps
+# until the earliest due time, so tens of thousands of timers cost no tasks and no polling.
+
+TIMER_RETRY_DELAY = 60 # Seconds before retrying a timer that failed with a server error
+
+
+class TimerScheduler:
+    """Min-heap timer queue persisted to SQLite. Handlers are registered per timer kind."""
+
+    def __init__(self, path):
+        self.path = path
+        self.heap = [] # (due_timestamp, timer_id, kind, guild_id, target_id)
+        self.cancelled = set() # Timer IDs still in the heap but deleted from storage
+        self.handlers = {}
+        self.conn = None
+        self.lock = threading.Lock()
+        self.wakeup = asyncio.Event()
+        self.runner = None
+
+    def handler(self, kind):
+        """Decorator registering `async def fn(guild_id, target_id)` for timers of `kind`."""
+        def decorator(func):
+            self.handlers[kind] = func
+            return func
+        return decorator
+
+    def open(self):
+        self.conn = open_database(self.path)
+        with self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS timers (
+                    id INTEGER PRIMARY KEY,
+                    due REAL NOT NULL,
+                    kind TEXT NOT NULL,
+                    guild_id INTEGER NOT NULL,
+                    target_id INTEGER NOT NULL
+                )""")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS timers_target ON timers (kind, guild_id, target_id)")
+        # Reload everything still pending; overdue timers simply fire first.
+        self.heap = [tuple(row) for row in self.conn.execute("SELECT due, id, kind, guild_id, target_id FROM timers")]
+        heapq.heapify(self.heap)
+
+    def start(self):
+        """Starts the runner, loading pending timers first if open() has not (idempotent)."""
+        if self.conn is None:
+            self.open()
+        if self.runner is None or self.runner.done():
+            self.runner = asyncio.create_task(self._run())
+
+    def __len__(self):
+        return len(self.heap) - len(self.cancelled)
+
+    def _insert(self, due, kind, guild_id, target_id):
+        with self.lock, self.conn:
+            return self.conn.execute(
+                "INSERT INTO timers (due, kind, guild_id, target_id) VALUES (?, ?, ?, ?)",
+                (due, kind, guild_id, target_id),
+            ).lastrowid
+
+    def _delete_matching(self, kind, guild_id, target_id):
+        with self.lock, self.conn:
+            return [row[0] for row in self.conn.execute(
+                "DELETE FROM timers WHERE kind = ? AND guild_id = ? AND target_id = ? RETURNING id",
+                (kind, guild_id, target_id),
+            )]
+
+    def _delete(self, timer_id):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM timers WHERE id = ?", (timer_id,))
+
+    async def schedule(self, when, kind, guild_id, target_id):
+        """Schedules a `kind` timer at datetime `when`, replacing any pending one for the same target."""
+        await self.cancel(kind, guild_id, target_id)
+        due = when.timestamp()
+        timer_id = await asyncio.to_thread(self._insert, due, kind, guild_id, target_id)
+        entry = (due, timer_id, kind, guild_id, target_id)
+        heapq.heappush(self.heap, entry)
+        if self.heap[0] is entry:
+            self.wakeup.set() # New earliest timer: the runner must shorten its sleep
+
+    async def cancel(self, kind, guild_id, target_id):
+        """Cancels pending `kind` timers for a target. Returns True if any were pending."""
+        timer_ids = await asyncio.to_thread(self._delete_matching, kind, guild_id, target_id)
+        # Heap entries are removed lazily when they reach the top.
+        self.cancelled.update(timer_ids)
+        return bool(timer_ids)
+
+    async def _run(self):
+        while True:
+            if not self.heap:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+
+            delay = self.heap[0][0] - time.time()
+            if delay > 0:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            due, timer_id, kind, guild_id, target_id = heapq.heappop(self.heap)
+            if timer_id in self.cancelled:
+                self.cancelled.discard(timer_id)
+                continue
+
+            handler = self.handlers.get(kind)
+            try:
+                if handler is not None:
+                    await handler(guild_id, target_id)
+            except discord.HTTPException as e:
+                if e.status >= 500:
+                    # Discord hiccup: keep the timer and try again shortly
+                    heapq.heappush(self.heap, (time.time() + TIMER_RETRY_DELAY, timer_id, kind, guild_id, target_id))
+                    continue
+                log.warning("Timer '%s' for %s failed: HTTP %s", kind, target_id, e.status)
+            except Exception:
+                log.exception("Timer '%s' for %s failed", kind, target_id)
+            await asyncio.to_thread(self._delete, timer_id)
+            self.cancelled.discard(timer_id) # In case it was cancelled while its handler ran
+
+
+scheduler = TimerScheduler(DATABASE_PATH)
+
+
+@scheduler.handler("unban")
+async def expire_tempban(guild_id, user_id):
+    guild = bot.get_guild(guild_id)
+    if guild is None:
+        return
+    try:
+        await guild.unban(discord.Object(id=user_id), reason="Temporary ban expired")
+    except discord.NotFound:
+        return # Already unbanned
+    index = ban_indexes.get(guild_id)
+    if index is not None:
+        index.remove(user_id)
+    modlog.record(guild_id, "unban", bot.user.id, user_id, "Temporary ban expired")
+
+
+@scheduler.handler("unlock")
+async def expire_lock(guild_id, channel_id):
+    guild = bot.get_guild(guild_id)
+    channel = guild.get_channel(channel_id) if guild else None
+    if channel is None:
+        return
+    overwrite = channel.overwrites_for(guild.default_role)
+    if overwrite.send_messages is not False:
+        return # Unlocked manually in the meantime
+    overwrite.send_messages = None
+    await channel.set_permissions(guild.default_role, overwrite=overwrite, reason="Timed lock expired")
+    modlog.record(guild_id, "unlock", bot.user.id, channel_id, "Timed lock expired")
+
+# --- Lockdown Snapshots ---
+# Before !lockdown touches a channel, the @everyone overwrite it had (raw allow/deny bits,
+# or the fact that there was none) is saved here, so !unlockdown can put back exactly
+# what was there instead of guessing. A row exists only while its channel is locked down.
+
+
+class LockdownStore:
+    """@everyone overwrite snapshots of locked-down channels, persisted to SQLite."""
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = None
+        self.lock = threading.Lock()
+
+    def _open(self):
+        if self.conn is None:
+            self.conn = open_database(self.path)
+            with self.conn:
+                self.conn.execute("""
+                    CREATE TABLE IF NOT EXISTS lockdown_snapshots (
+                        guild_id INTEGER NOT NULL,
+                        channel_id INTEGER NOT NULL,
+                        allow INTEGER NOT NULL,
+                        deny INTEGER NOT NULL,
+                        had_overwrite INTEGER NOT NULL,
+                        PRIMARY KEY (guild_id, channel_id)
+                    )""")
+        return self.conn
+
+    def _save(self, guild_id, rows):
+        with self.lock:
+            conn = self._open()
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO lockdown_snapshots (guild_id, channel_id, allow, deny, had_overwrite) VALUES (?, ?, ?, ?, ?)",
+                    [(guild_id, *row) for row in rows],
+                )
+
+    def _load(self, guild_id):
+        with self.lock:
+            return {
+                channel_id: (allow, deny, bool(had_overwrite))
+                for channel_id, allow, deny, had_overwrite in self._open().execute(
+                    "SELECT channel_id, allow, deny, had_overwrite FROM lockdown_snapshots WHERE guild_id = ?", (guild_id,))
+            }
+
+    def _delete(self, guild_id, channel_ids):
+        with self.lock:
+            conn = self._open()
+            with conn:
+                conn.executemany(
+                    "DELETE FROM lockdown_snapshots WHERE guild_id = ? AND channel_id = ?",
+                    [(guild_id, channel_id) for channel_id in channel_ids],
+                )
+
+    async def save(self, guild_id, rows):
+        """Stores (channel_id, allow, deny, had_overwrite) rows in one transaction."""
+        await asyncio.to_thread(self._save, guild_id, rows)
+
+    async def load(self, guild_id):
+        """Returns {channel_id: (allow, deny, had_overwrite)} for the guild's locked-down channels."""
+        return await asyncio.to_thread(self._load, guild_id)
+
+    async def delete(self, guild_id, channel_ids):
+        if channel_ids:
+            await asyncio.to_thread(self._delete, guild_id, channel_ids)
+
+
+lockdown_store = LockdownStore(DATABASE_PATH)
+
+# --- Recent Messages ---
+# Mirror of the newest messages of each active channel, fed by on_message and kept in
+# sync by the edit/delete events. Entries hold the message ID (which also encodes the
+# timestamp), author ID, flag bits and mention count in parallel arrays. `covered_from`
+# is the oldest ID from which the buffer is known to be complete; purges serve that
+# range locally and only page history for anything older.
+
+MESSAGE_BOT = 1
+MESSAGE_ATTACHMENT = 2
+MESSAGE_LINK = 4
+MESSAGE_DELETED = 128
+LINK_PATTERN = re.compile(r"https?://\S")
+
+
+def message_flags(message):
+    """Flag bits and (capped) mention count of a message, as stored in the buffer."""
+    flags = MESSAGE_BOT if message.author.bot else 0
+    if message.attachments:
+        flags |= MESSAGE_ATTACHMENT
+    content = message.content
+    if "http" in content and LINK_PATTERN.search(content):
+        flags |= MESSAGE_LINK
+    return flags, min(len(message.raw_mentions) + len(message.raw_role_mentions), 255)
+
+
+class ChannelMessages:
+    """Ascending message IDs of one channel with their author, flags and mention count."""
+
+    __slots__ = ("ids", "authors", "flags", "mentions", "covered_from")
+
+    def __init__(self, covered_from):
+        self.ids = array("Q")
+        self.authors = array("Q")
+        self.flags = array("B")
+        self.mentions = array("B")
+        self.covered_from = covered_from
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, message_id, author_id, flags, mentions):
+        ids = self.ids
+        if not ids or message_id > ids[-1]:
+            index = len(ids)
+        else:
+            index = bisect.bisect_left(ids, message_id) # Out-of-order delivery (rare)
+            if index < len(ids) and ids[index] == message_id:
+                return
+        ids.insert(index, message_id)
+        self.authors.insert(index, author_id)
+        self.flags.insert(index, flags)
+        self.mentions.insert(index, mentions)
+
+    def find(self, message_id):
+        index = bisect.bisect_left(self.ids, message_id)
+        return index if index < len(self.ids) and self.ids[index] == message_id else -1
+
+    def trim(self, count):
+        """Drops the oldest `count` entries; the buffer is then complete from the new oldest ID."""
+        del self.ids[:count]
+        del self.authors[:count]
+        del self.flags[:count]
+        del self.mentions[:count]
+        self.covered_from = self.ids[0] if self.ids else 2**64 - 1
+
+    def newest_first(self, before_id, after_id):
+        """Live entries with after_id < ID < before_id as (id, author_id, flags, mentions), newest first."""
+        ids = self.ids
+        start = bisect.bisect_right(ids, after_id) if after_id else 0
+        index = bisect.bisect_left(ids, before_id) if before_id else len(ids)
+        entries = []
+        while index > start:
+            index -= 1
+            if not self.flags[index] & MESSAGE_DELETED:
+                entries.append((ids[index], self.authors[index], self.flags[index], self.mentions[index]))
+        return entries
+
+
+class RecentMessages:
+    """Per-channel message buffers under one global entry budget, evicting the coldest channels."""
+
+    def __init__(self, per_channel=RECENT_MESSAGES_PER_CHANNEL, max_total=RECENT_MESSAGES_MAX_TOTAL):
+        self.per_channel = per_channel
+        self.max_total = max_total
+        self.channels = OrderedDict() # channel_id -> ChannelMessages, least recently active first
+        self.total = 0
+
+    def get(self, channel_id):
+        return self.channels.get(channel_id)
+
+    def track(self, channel_id, covered_from=0):
+        """Starts an empty buffer that is complete from `covered_from` (0 for a channel created just now)."""
+        if channel_id not in self.channels:
+            self.channels[channel_id] = ChannelMessages(covered_from)
+
+    def record(self, message):
+        channel_id = message.channel.id
+        buffer = self.channels.get(channel_id)
+        if buffer is None:
+            # Nothing older than this message has been seen
+            buffer = self.channels[channel_id] = ChannelMessages(message.id)
+        else:
+            self.channels.move_to_end(channel_id)
+        flags, mentions = message_flags(message)
+        size = len(buffer)
+        buffer.add(message.id, message.author.id, flags, mentions)
+        self.total += len(buffer) - size
+        if len(buffer) > self.per_channel:
+            # Trim a quarter at once so the array shift is amortised over many messages
+            count = len(buffer) - self.per_channel * 3 // 4
+            buffer.trim(count)
+            self.total -= count
+        while self.total > self.max_total and len(self.channels) > 1:
+            _, evicted = self.channels.popitem(last=False)
+            self.total -= len(evicted)
+
+    def edited(self, message):
+        buffer = self.channels.get(message.channel.id)
+        index = buffer.find(message.id) if buffer is not None else -1
+        if index >= 0:
+            flags, mentions = message_flags(message)
+            buffer.flags[index] = flags | (buffer.flags[index] & MESSAGE_DELETED)
+            buffer.mentions[index] = mentions
+
+    def deleted(self, channel_id, message_ids):
+        buffer = self.channels.get(channel_id)
+        if buffer is None:
+            return
+        for message_id in message_ids:
+            index = buffer.find(message_id)
+            if index >= 0:
+                buffer.flags[index] |= MESSAGE_DELETED
+
+    def drop(self, channel_ids):
+        for channel_id in channel_ids:
+            buffer = self.channels.pop(channel_id, None)
+            if buffer is not None:
+                self.total -= len(buffer)
+
+    def clear(self):
+        self.channels.clear()
+        self.total = 0
+
+
+recent_messages = RecentMessages()
+
+# --- Anti-Spam Filter ---
+# Runs on every guild message before command dispatch, so the per-message cost has to
+# stay in the low microseconds. Each active member gets a tracker with fixed-size ring
+# buffers (message times, mention counts, content hashes); trackers idle for
+# SPAM_IDLE_SECONDS are evicted, which bounds memory to recently active members.
+
+SPAM_IDLE_SECONDS = 300
+SPAM_PURGE_WINDOW = datetime.timedelta(minutes=2) # How far back the spammer's messages are purged
+
+
+class SpamTracker:
+    """Ring-buffer state for one member. Each check is O(ring size), with no allocations."""
+    __slots__ = ("times", "mentions", "hashes", "hash_times", "pos", "hash_pos", "last_seen", "punished_until")
+
+    def __init__(self, max_messages, max_duplicates):
+        self.times = [-1e9] * max_messages
+        self.mentions = [0] * max_messages
+        self.hashes = [0] * max_duplicates
+        self.hash_times = [-1e9] * max_duplicates
+        self.pos = 0
+        self.hash_pos = 0
+        self.last_seen = 0.0
+        self.punished_until = 0.0
+
+
+class SpamFilter:
+    """
+    Sliding-window rate, duplicate-content and mention-flood detection per (guild, member),
+    with each guild's thresholds. Ring sizes follow the settings a tracker was created
+    with, so trackers are dropped (`reset`) whenever the configuration is reloaded.
+    """
+
+    def __init__(self):
+        self.trackers = {} # (guild_id, user_id) -> SpamTracker
+
+    def check(self, guild_id, user_id, content, mention_count, now):
+        """Records one message. Returns a violation reason, or None if the message is fine."""
+        settings = guild_config.get(guild_id)
+        key = (guild_id, user_id)
+        tracker = self.trackers.get(key)
+        if tracker is None:
+            tracker = self.trackers[key] = SpamTracker(settings.spam_max_messages, settings.spam_max_duplicates)
+        tracker.last_seen = now
+        if now < tracker.punished_until:
+            return None # Already being handled
+
+        # Message rate: once this message is stored, the next slot holds the oldest of the
+        # last N messages, so it falls inside the window exactly when N were sent in it.
+        pos = tracker.pos
+        window_start = now - settings.spam_window_seconds
+        tracker.times[pos] = now
+        tracker.mentions[pos] = mention_count
+        tracker.pos = (pos + 1) % settings.spam_max_messages
+        if tracker.times[tracker.pos] > window_start:
+            return f"sent {settings.spam_max_messages} messages in {settings.spam_window_seconds:g}s"
+
+        # Mention flood across the same window
+        if mention_count:
+            total = 0
+            for sent_at, count in zip(tracker.times, tracker.mentions):
+                if sent_at > window_start:
+                    total += count
+            if total > settings.spam_max_mentions:
+                return f"mentioned {total} users/roles in {settings.spam_window_seconds:g}s"
+
+        # Duplicate content: hash of the case/whitespace-normalized text
+        if content:
+            digest = hash(" ".join(content.casefold().split()))
+            hash_pos = tracker.hash_pos
+            tracker.hashes[hash_pos] = digest
+            tracker.hash_times[hash_pos] = now
+            tracker.hash_pos = (hash_pos + 1) % settings.spam_max_duplicates
+            duplicate_start = now - settings.spam_duplicate_window_seconds
+            for seen, sent_at in zip(tracker.hashes, tracker.hash_times):
+                if seen != digest or sent_at <= duplicate_start:
+                    return None
+            return f"repeated the same message {settings.spam_max_duplicates} times"
+        return None
+
+    def punished(self, guild_id, user_id, until):
+        """Suppresses further reports for the member until `until` (monotonic seconds)."""
+        tracker = self.trackers.get((guild_id, user_id))
+        if tracker is not None:
+            tracker.punished_until = until
+
+    def reset(self):
+        self.trackers.clear()
+
+    def evict_idle(self, now):
+        """Drops trackers of members that have been quiet for SPAM_IDLE_SECONDS."""
+        cutoff = now - SPAM_IDLE_SECONDS
+        idle = [key for key, tracker in self.trackers.items() if tracker.last_seen < cutoff and tracker.punished_until < now]
+        for key in idle:
+            del self.trackers[key]
+        return len(idle)
+
+
+spam_filter = SpamFilter()
+spam_tasks = set() # Strong references to running punish_spammer() tasks
+
+
+@tasks.loop(seconds=60)
+async def evict_spam_trackers():
+    spam_filter.evict_idle(time.monotonic())
+
+
+async def punish_spammer(message, reason):
+    """Times out the author (same rules as !timeout) and purges their recent messages in the channel."""
+    member = message.author
+    guild = message.guild
+    settings = guild_config.get(guild.id)
+    delta = parse_duration(settings.spam_timeout)
+    spam_filter.punished(guild.id, member.id, time.monotonic() + delta.total_seconds())
+    timeout_until = discord.utils.utcnow() + delta
+    try:
+        await edit_member(member, timed_out_until=timeout_until, reason=f"Anti-spam: {reason}")
+        modlog.record(guild.id, "timeout", bot.user.id, member.id, f"Anti-spam: {reason}", details=f"until {timeout_until.isoformat()}")
+    except discord.HTTPException as e:
+        log.warning("Anti-spam timeout of %s failed: HTTP %s", member, e.status)
+
+    try:
+        progress = await stream_purge(
+            message.channel, settings.purge_max_amount,
+            check=PurgeFilter(user_id=member.id),
+            after=discord.utils.utcnow() - SPAM_PURGE_WINDOW,
+        )
+        modlog.record(guild.id, "targetpurge", bot.user.id, member.id, "Anti-spam", details=f"#{message.channel.name}: {progress.deleted} deleted")
+    except discord.HTTPException as e:
+        log.warning("Anti-spam purge in #%s failed: HTTP %s", message.channel, e.status)
+
+    await send_temporary(message.channel, f"🛑 **{member.display_name}** has been timed out for spam ({reason}).", delay=30)
+
 # --- Events ---
 
+@bot.event
+async def setup_hook():
+    """Runs once before connecting: start background services that need the event loop."""
+    # An invalid config file stops startup here rather than running with the wrong guild list
+    guild_config.load()
+    watch_guild_config.start()
+    install_member_update_hook(bot._connection)
+    if OUTBOUND_SCHEDULER:
+        outbound.install(bot.http)
+    modlog.start()
+    # Opened now so unban events before on_ready can cancel timers; the runner waits for the guild cache
+    scheduler.open()
+    deletion_queue.start()
+    background_tasks.add(asyncio.create_task(monitor_loop_lag()))
+    if METRICS_PORT:
+        try:
+            await start_metrics_server()
+        except OSError as e:
+            # E.g. the port is taken by another instance: metrics are optional, moderation is not
+            log.error("Metrics endpoint disabled: cannot listen on port %d: %s", METRICS_PORT, e)
+
+
 @bot.event
 async def on_ready():
     """Confirms the bot is running and connected to Discord."""
-    print(f'Logged in as {bot.user} (ID: {bot.user.id})')
-    print('------')
+    log.info("Logged in as %s (ID: %s)", bot.user, bot.user.id)
+    # A new session may have missed messages and deletes; start the buffers afresh
+    recent_messages.clear()
 
     unauthorized_guilds = []
     for guild in bot.guilds:
-        if guild.id not in ALLOWED_SERVERS:
+        if not guild_config.is_allowed(guild.id):
             unauthorized_guilds.append(guild.name)
             await guild.leave()
             
     if unauthorized_guilds:
-        print(f"🚫 CLEANUP: Left the following unauthorized guilds on startup: {', '.join(unauthorized_guilds)}")
+        log.warning("CLEANUP: Left the following unauthorized guilds on startup: %s", ', '.join(unauthorized_guilds))
+
+    # Reseeded on every ready: counts may have drifted while disconnected
+    for guild in bot.guilds:
+        seed_guild_stats(guild)
+
+    if not reconcile_ban_indexes.is_running():
+        reconcile_ban_indexes.start()
+    if not record_guild_stats.is_running():
+        record_guild_stats.start()
+    if not evict_spam_trackers.is_running():
+        evict_spam_trackers.start()
+    if not prune_archive_extracts.is_running():
+        prune_archive_extracts.start()
+    # Started once the guild cache is ready, so overdue timers can run right away
+    scheduler.start()
 
     await bot.change_presence(activity=discord.Game(name="Ready for instructions"))
 
@@ -68,17 +1981,166 @@ async def on_ready():
 @bot.event
 async def on_guild_join(guild):
     """3. 🛡️ CHECK ON NEW INVITE"""
-    if guild.id not in ALLOWED_SERVERS:
-        print(f"❌ UNAUTHORIZED JOIN: Leaving Guild '{guild.name}' (ID: {guild.id})")
+    if not guild_config.is_allowed(guild.id):
+        log.warning("UNAUTHORIZED JOIN: Leaving Guild '%s' (ID: %s)", guild.name, guild.id)
         # Optional: Add a polite message here before leaving
         await guild.leave()
     else:
-        print(f"✅ ALLOWED JOIN: Staying in Guild '{guild.name}' (ID: {guild.id})")
+        log.info("ALLOWED JOIN: Staying in Guild '%s' (ID: %s)", guild.name, guild.id)
+        seed_guild_stats(guild)
+
+
+@bot.event
+async def on_guild_remove(guild):
+    """Drops per-guild caches once the bot is no longer in the guild."""
+    guild_stats.pop(guild.id, None)
+    ban_indexes.pop(guild.id, None)
+    moderator_role_ids.pop(guild.id, None)
+    join_indexes.pop(guild.id, None)
+    member_cache.evict_guild(guild.id)
+    recent_messages.drop(channel.id for channel in guild.channels)
+
+
+@bot.event
+async def on_member_join(member):
+    stats = guild_stats.get(member.guild.id)
+    if stats is not None:
+        stats.member_changed(member, 1)
+    if member.joined_at is not None:
+        get_join_index(member.guild.id).add(member.id, member.joined_at, member.bot)
+    # Fresh joiners are the likeliest targets of the next moderation command (!raidsweep)
+    member_cache.put(member)
+
+
+@bot.event
+async def on_raw_member_update(data):
+    """Dispatched by install_member_update_hook for cached and uncached members alike."""
+    member_cache.evict(int(data["guild_id"]), int(data["user"]["id"]))
+
+
+@bot.event
+async def on_raw_member_remove(payload):
+    """Raw variant: fires even when the member was never cached (lazy member mode)."""
+    member_cache.evict(payload.guild_id, payload.user.id)
+    index = join_indexes.get(payload.guild_id)
+    if index is not None:
+        index.remove(payload.user.id)
+    stats = guild_stats.get(payload.guild_id)
+    if stats is not None:
+        stats.member_changed(payload.user, -1)
+
+
+@bot.event
+async def on_guild_channel_create(channel):
+    stats = guild_stats.get(channel.guild.id)
+    if stats is not None:
+        stats.channel_changed(channel, 1)
+    recent_messages.track(channel.id) # Every message it will ever have passes on_message
+
+
+@bot.event
+async def on_guild_channel_delete(channel):
+    stats = guild_stats.get(channel.guild.id)
+    if stats is not None:
+        stats.channel_changed(channel, -1)
+    recent_messages.drop((channel.id,))
+
+
+@bot.event
+async def on_member_ban(guild, user):
+    """Keeps the ban index in sync with bans made by anyone (not just this bot)."""
+    index = ban_indexes.get(guild.id)
+    if index is not None:
+        index.add(user)
+
+
+@bot.event
+async def on_member_unban(guild, user):
+    index = ban_indexes.get(guild.id)
+    if index is not None:
+        index.remove(user.id)
+    # An unban from anywhere makes a pending temp-ban expiry pointless
+    await scheduler.cancel("unban", guild.id, user.id)
+
+
+@bot.event
+async def on_guild_role_create(role):
+    """A new role may carry a moderator name, so drop the cached moderator role IDs."""
+    moderator_role_ids.pop(role.guild.id, None)
+    stats = guild_stats.get(role.guild.id)
+    if stats is not None:
+        stats.roles += 1
+
+
+@bot.event
+async def on_guild_role_update(before, after):
+    # Only a rename can change which roles match the moderation_roles setting.
+    if before.name != after.name:
+        moderator_role_ids.pop(after.guild.id, None)
+
+
+@bot.event
+async def on_guild_role_delete(role):
+    moderator_role_ids.pop(role.guild.id, None)
+    stats = guild_stats.get(role.guild.id)
+    if stats is not None:
+        stats.roles -= 1
+
+
+@bot.event
+async def on_message(message):
+    """Records the message, runs the anti-spam stage, then normal prefix command processing."""
+    author = message.author
+    if message.guild is not None:
+        recent_messages.record(message)
+    if message.guild is not None and not author.bot and isinstance(author, discord.Member) and not has_moderator_role(author):
+        mention_count = len(message.raw_mentions) + len(message.raw_role_mentions)
+        reason = spam_filter.check(message.guild.id, author.id, message.content, mention_count, time.monotonic())
+        if reason is not None:
+            # Punish in the background so the event handler returns immediately
+            task = asyncio.create_task(punish_spammer(message, reason))
+            spam_tasks.add(task)
+            task.add_done_callback(spam_tasks.discard)
+            return
+
+    if author.bot:
+        return
+    ctx = await bot.get_context(message)
+    # Set before invoking so argument converters (member fetches) already run at the
+    # command's outbound priority, not just the command body
+    token = outbound_priority.set(command_priority(ctx.command))
+    try:
+        await bot.invoke(ctx)
+    finally:
+        outbound_priority.reset(token)
+
+
+@bot.event
+async def on_raw_message_edit(payload):
+    if payload.guild_id is not None:
+        recent_messages.edited(payload.message)
+
+
+@bot.event
+async def on_raw_message_delete(payload):
+    recent_messages.deleted(payload.channel_id, (payload.message_id,))
+
+
+@bot.event
+async def on_raw_bulk_message_delete(payload):
+    recent_messages.deleted(payload.channel_id, payload.message_ids)
 
 
 @bot.event
 async def on_command_error(ctx, error):
     """Handles all command errors, including custom role check failures."""
+    command_name = ctx.command.qualified_name if ctx.command else "unknown"
+    if isinstance(getattr(error, "original", None), OutboundDropped):
+        # The reply went stale behind higher-priority work (counted in the outbound metrics)
+        log.debug("Command %s: %s", command_name, error.original)
+        return
+    metrics.command_errors[(command_name, type(error).__name__)] += 1
+
     if isinstance(error, commands.CheckFailure):
         # Handle the custom role restriction error
         await ctx.send(f"❌ **Permission Denied:** {error}", ephemeral=True)
@@ -96,96 +2158,720 @@ async def on_command_error(ctx, error):
         # Prevents error handlers from running twice
         if hasattr(ctx.command, 'on_error'):
             return
-        # print(f"Ignoring exception in command {ctx.command}:", file=sys.stderr)
-        # traceback.print_exception(type(error), error, error.__traceback__, file=sys.stderr)
+        # Counted in the metrics above; log the traceback instead of swallowing it
         # Uncomment the line below for general error debugging if needed
         # await ctx.send(f"An unexpected error occurred: {type(error).__name__}", ephemeral=True)
-        pass 
+        log.error("Ignoring exception in command %s", command_name, exc_info=(type(error), error, error.__traceback__))
+
+# --- Channel Archives ---
+# !archive and `--archive` on the purge commands stream channel history to disk so
+# purged messages can still be looked at for appeals. An archive is three files under
+# ARCHIVE_DIR/<guild id>/, named <channel id>-<UTC time>[-<n> if that name was taken]:
+#   .jsonl.gz              one JSON object per message, written in blocks of
+#                          ARCHIVE_BLOCK_MESSAGES; every block is its own gzip member,
+#                          so the file is valid gzip as a whole and any block can also
+#                          be decompressed alone from its offset.
+#   .index.jsonl           a header line, then one line per block: byte offset and
+#                          length, message ID and timestamp range and a Bloom filter of
+#                          the block's authors (ARCHIVE_AUTHOR_FILTER_BITS bits, so the
+#                          index stays a small fraction of the archive however many
+#                          members talk; a false positive only costs one extra block).
+#   .attachments.jsonl.gz  attachment metadata, once per distinct file (same filename,
+#                          size and type); messages only carry the attachment keys.
+# Only the current block is held in memory. It is compressed and appended from a worker
+# thread once full, so an archive of any size costs about one block of RAM, and pulling
+# one member's messages back out only decompresses the blocks whose filter matches.
+
+ARCHIVE_NAME = re.compile(r"^\d{15,21}-\d{8}T\d{6}(?:-\d+)?$")
+ARCHIVE_AUTHOR_FILTER_BITS = 8192 # About 0.2% false positives at 500 authors per block
+ARCHIVE_AUTHOR_FILTER_HASHES = 4
+
+
+active_archives = set() # Paths (archive_path) of archives still being written
+
+
+def archive_path(guild_id, name):
+    """Common path prefix of an archive's files."""
+    return os.path.join(ARCHIVE_DIR, str(guild_id), name)
+
+
+def extracts_dir(guild_id):
+    return os.path.join(ARCHIVE_DIR, str(guild_id), "extracts")
+
+
+def read_archive_header(base):
+    """The header line of an archive's index (guild, channel and creation time)."""
+    with open(base + ".index.jsonl", encoding="utf-8") as index:
+        return json.loads(next(index))
+
+
+def can_read_history(member, channel):
+    """True if `member` may read `channel`'s history, i.e. may see anything archived from it."""
+    return channel.permissions_for(member).read_message_history
+
+
+def author_filter_bits(author_id):
+    """Bit positions of an author in a block's Bloom filter (double hashing)."""
+    digest = hashlib.blake2b(author_id.to_bytes(8, "little"), digest_size=8).digest()
+    first, step = int.from_bytes(digest[:4], "little"), int.from_bytes(digest[4:], "little") | 1
+    return [(first + i * step) % ARCHIVE_AUTHOR_FILTER_BITS for i in range(ARCHIVE_AUTHOR_FILTER_HASHES)]
+
+
+def author_filter(author_ids):
+    bits = bytearray(ARCHIVE_AUTHOR_FILTER_BITS // 8)
+    for author_id in author_ids:
+        for bit in author_filter_bits(author_id):
+            bits[bit >> 3] |= 1 << (bit & 7)
+    return base64.b64encode(bits).decode()
+
+
+def attachment_key(attachment):
+    """Deduplication key of an attachment: a re-upload of the same file gets the same key."""
+    identity = f"{attachment.filename}\0{attachment.size}\0{attachment.content_type}"
+    return hashlib.blake2b(identity.encode(), digest_size=8).hexdigest()
+
+
+class ArchiveWriter:
+    """Streams messages into a block-gzipped JSONL archive with a sparse index (see the section comment)."""
+
+    def __init__(self, channel, *, block_messages=ARCHIVE_BLOCK_MESSAGES):
+        created = datetime.datetime.now(datetime.timezone.utc)
+        self.name = f"{channel.id}-{created:%Y%m%dT%H%M%S}"
+        self.base = archive_path(channel.guild.id, self.name)
+        self.header = {"version": 1, "guild_id": channel.guild.id, "channel_id": channel.id,
+                       "channel": channel.name, "created_at": created.isoformat()}
+        self.block_messages = block_messages
+        self.files = None # (data, index, attachments), opened on the first message
+        self.lines = []
+        self.authors = set()
+        self.min_id = self.max_id = None
+        self.attachment_keys = set()
+        self.new_attachments = []
+        self.count = 0
+        self.size = 0 # Compressed bytes written so far
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.base), exist_ok=True)
+        # Names have one-second resolution: a second run in the same second gets a suffix
+        name, attempt = self.name, 1
+        while True:
+            try:
+                data = open(self.base + ".jsonl.gz", "xb")
+                break
+            except FileExistsError:
+                attempt += 1
+                self.name = f"{name}-{attempt}"
+                self.base = os.path.join(os.path.dirname(self.base), self.name)
+        active_archives.add(self.base)
+        index = open(self.base + ".index.jsonl", "x", encoding="utf-8")
+        attachments = gzip.open(self.base + ".attachments.jsonl.gz", "xt", encoding="utf-8")
+        index.write(json.dumps(self.header) + "\n")
+        self.files = (data, index, attachments)
+
+    def _record(self, message):
+        keys = []
+        for attachment in message.attachments:
+            key = attachment_key(attachment)
+            keys.append(key)
+            if key not in self.attachment_keys:
+                self.attachment_keys.add(key)
+                self.new_attachments.append({
+                    "key": key, "filename": attachment.filename, "size": attachment.size,
+                    "content_type": attachment.content_type, "url": attachment.url, "first_message_id": message.id,
+                })
+        record = {
+            "id": message.id,
+            "ts": message.created_at.timestamp(),
+            "author_id": message.author.id,
+            "author": message.author.name,
+            "bot": message.author.bot,
+            "content": message.content,
+        }
+        if message.edited_at is not None:
+            record["edited_ts"] = message.edited_at.timestamp()
+        if message.reference is not None and message.reference.message_id is not None:
+            record["reply_to"] = message.reference.message_id
+        if keys:
+            record["attachments"] = keys
+        if message.embeds:
+            record["embeds"] = len(message.embeds)
+        return record
+
+    async def write(self, message):
+        """
+        Adds one message; a full block is compressed and appended before this returns.
+        Returns True if it did, i.e. every message written so far is now on disk.
+        """
+        if self.files is None:
+            await asyncio.to_thread(self._open)
+        self.lines.append(json.dumps(self._record(message), ensure_ascii=False, separators=(",", ":")))
+        self.authors.add(message.author.id)
+        if self.min_id is None or message.id < self.min_id:
+            self.min_id = message.id
+        if self.max_id is None or message.id > self.max_id:
+            self.max_id = message.id
+        self.count += 1
+        if len(self.lines) >= self.block_messages:
+            await self.flush()
+            return True
+        return False
+
+    async def flush(self):
+        """
+        Writes the current block, if any, as a new gzip member and index line. If that
+        fails the block is kept in memory (and nothing of it left on disk), so nothing
+        is lost and a later flush may retry.
+        """
+        if not self.lines:
+            return
+        index_entry = {
+            "count": len(self.lines),
+            "min_id": self.min_id, "max_id": self.max_id,
+            "min_ts": discord.utils.snowflake_time(self.min_id).timestamp(),
+            "max_ts": discord.utils.snowflake_time(self.max_id).timestamp(),
+            "author_filter": author_filter(self.authors),
+        }
+        await asyncio.to_thread(self._write_block, self.lines, index_entry, self.new_attachments)
+        self.lines, self.new_attachments = [], []
+        self.authors = set()
+        self.min_id = self.max_id = None
+
+    def _write_block(self, lines, index_entry, attachments):
+        data, index, attachment_file = self.files
+        chunk = gzip.compress(("\n".join(lines) + "\n").encode(), compresslevel=6)
+        offset = data.tell()
+        try:
+            data.write(chunk)
+            data.flush()
+            os.fsync(data.fileno())
+        except OSError:
+            # Leave no half block behind: the retry appends at the same offset
+            data.seek(offset)
+            data.truncate()
+            raise
+        self.size = offset + len(chunk)
+        # The block is on disk before the index points at it
+        index.write(json.dumps({"offset": offset, "length": len(chunk), **index_entry}) + "\n")
+        index.flush()
+        for attachment in attachments:
+            attachment_file.write(json.dumps(attachment, ensure_ascii=False) + "\n")
+        attachment_file.flush()
+
+    async def close(self):
+        """Flushes the last block and closes the files."""
+        try:
+            await self.flush()
+        finally:
+            if self.files is not None:
+                files, self.files = self.files, None
+                try:
+                    await asyncio.to_thread(lambda: [f.close() for f in files])
+                finally:
+                    active_archives.discard(self.base)
+
+
+def read_archive(base, *, author_id=None, after_id=None, before_id=None, stats=None):
+    """
+    Yields the message records of an archive (blocks in write order) by `author_id`,
+    with after_id < id < before_id, decompressing only the blocks whose index entry
+    can match. `stats`, if given, is a dict that receives `blocks` and `blocks_read`.
+    Blocking; run it in a thread.
+    """
+    blocks = blocks_read = 0
+    wanted = author_filter_bits(author_id) if author_id is not None else ()
+    with open(base + ".index.jsonl", encoding="utf-8") as index, open(base + ".jsonl.gz", "rb") as data:
+        next(index) # Header
+        for line in index:
+            block = json.loads(line)
+            blocks += 1
+            if after_id is not None and block["max_id"] <= after_id:
+                continue
+            if before_id is not None and block["min_id"] >= before_id:
+                continue
+            if wanted:
+                authors = base64.b64decode(block["author_filter"])
+                if not all(authors[bit >> 3] & (1 << (bit & 7)) for bit in wanted):
+                    continue
+            blocks_read += 1
+            data.seek(block["offset"])
+            for raw in gzip.decompress(data.read(block["length"])).splitlines():
+                record = json.loads(raw)
+                if author_id is not None and record["author_id"] != author_id:
+                    continue
+                if (after_id is not None and record["id"] <= after_id) or (before_id is not None and record["id"] >= before_id):
+                    continue
+                yield record
+    if stats is not None:
+        stats.update(blocks=blocks, blocks_read=blocks_read)
+
+
+def extract_archive(base, author_id, out_path):
+    """
+    Writes one author's archived messages to a gzip JSONL file, followed by the
+    metadata of the attachments they reference. Returns (messages, blocks read, blocks).
+    """
+    stats = {}
+    keys = set()
+    count = 0
+    with gzip.open(out_path, "wt", encoding="utf-8") as out:
+        for record in read_archive(base, author_id=author_id, stats=stats):
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            keys.update(record.get("attachments", ()))
+            count += 1
+        if keys:
+            with gzip.open(base + ".attachments.jsonl.gz", "rt", encoding="utf-8") as attachments:
+                try:
+                    for line in attachments:
+                        if json.loads(line)["key"] in keys:
+                            out.write(line)
+                except EOFError:
+                    pass # Never closed (the bot stopped mid-archive); every flushed line was read
+    return count, stats.get("blocks_read", 0), stats.get("blocks", 0)
+
+# --- Purge Engine ---
+# Discord only bulk-deletes up to 100 messages per call, and only messages younger
+# than 14 days. The engine below takes candidates from the recent-message buffer first
+# and streams channel history page by page only for the range the buffer does not
+# cover. Young matches are packed into 100-message bulk batches and old ones go to a
+# bounded single-delete lane, so a purge never fails as a whole because one message
+# was too old.
+
+BULK_DELETE_BATCH_SIZE = 100
+BULK_DELETE_MAX_AGE = datetime.timedelta(days=14)
+PURGE_PROGRESS_INTERVAL = 3.0 # Seconds between progress callbacks
+PURGE_PIPELINE_DEPTH = 2 # Full batches the scan may run ahead of the bulk deletes
+
+
+PURGE_KINDS = {
+    "bots": lambda flags, mentions: flags & MESSAGE_BOT,
+    "humans": lambda flags, mentions: not flags & MESSAGE_BOT,
+    "attachments": lambda flags, mentions: flags & MESSAGE_ATTACHMENT,
+    "links": lambda flags, mentions: flags & MESSAGE_LINK,
+    "mentions": lambda flags, mentions: mentions,
+}
+
+
+class PurgeFilter:
+    """Which messages a purge deletes. Everything but `regex` is answered from buffer entries alone."""
+
+    def __init__(self, *, user_id=None, kind=None, regex=None):
+        self.user_id = user_id
+        self.kind = PURGE_KINDS[kind] if kind else None
+        self.regex = regex
+
+    @property
+    def local(self):
+        """Whether buffer entries (which hold no content) are enough to decide a match."""
+        return self.regex is None
+
+    def matches_entry(self, author_id, flags, mentions):
+        if self.user_id is not None and author_id != self.user_id:
+            return False
+        return self.kind is None or bool(self.kind(flags, mentions))
+
+    def __call__(self, message):
+        if not self.matches_entry(message.author.id, *message_flags(message)):
+            return False
+        return self.regex is None or self.regex.search(message.content) is not None
+
+
+class PurgeProgress:
+    """Running counters for a streaming purge, including throughput."""
+
+    def __init__(self):
+        self.scanned = 0
+        self.matched = 0
+        self.bulk_deleted = 0
+        self.single_deleted = 0
+        self.failed = 0
+        self.started = time.monotonic()
+
+    @property
+    def deleted(self):
+        return self.bulk_deleted + self.single_deleted
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    @property
+    def rate(self):
+        """Deleted messages per second since the purge started."""
+        elapsed = self.elapsed
+        return self.deleted / elapsed if elapsed > 0 else 0.0
+
+    def summary(self):
+        text = (f"Deleted **{self.deleted}** messages ({self.bulk_deleted} bulk, {self.single_deleted} single) "
+                f"in {self.elapsed:.1f}s — {self.rate:.1f} msg/s")
+        if self.failed:
+            text += f", {self.failed} failed"
+        return text
+
+
+def snowflake_bound(value):
+    """Message ID for a history bound given as a datetime or anything with an `id`."""
+    if value is None:
+        return None
+    if isinstance(value, datetime.datetime):
+        return discord.utils.time_snowflake(value)
+    return value.id
+
+
+def bulk_delete_cutoff():
+    """Lowest message ID a bulk delete sent now accepts, with a minute's margin for the request itself."""
+    return discord.utils.time_snowflake(discord.utils.utcnow() - BULK_DELETE_MAX_AGE + datetime.timedelta(minutes=1))
+
+
+async def stream_purge(channel, amount, *, check=None, before=None, after=None, scan_limit=None, on_progress=None, archive=None):
+    """
+    Deletes up to `amount` messages from `channel` (newest first) that pass `check`
+    (a PurgeFilter, or None for every message).
+
+    The scan is the producer: it streams young matches into 100-message batches on a
+    queue, and a consumer task bulk-deletes each batch while the scan keeps going.
+    Messages older than 14 days go to a concurrency-bounded single-delete lane. The
+    scan reads the recent-message buffer first and pages history only below the range
+    the buffer covers (or throughout, for regex filters). It stops once `amount`
+    matches are found, after `scan_limit` messages, or when it reaches `after` (a
+    datetime cutoff). `on_progress` (an async callable taking a PurgeProgress) is
+    awaited every PURGE_PROGRESS_INTERVAL seconds. With an `archive` (ArchiveWriter)
+    matches are held back until the archive block holding them is on disk, and only
+    then handed to the delete lanes, so nothing is deleted unarchived (use a block
+    size of BULK_DELETE_BATCH_SIZE to keep the lanes busy). The buffer holds no message
+    content, so archiving purges page the whole range from history.
+    """
+    progress = PurgeProgress()
+    single_lane = asyncio.Semaphore(PURGE_SINGLE_DELETE_CONCURRENCY)
+    single_tasks = set()
+    # A short queue keeps the scan at most a couple of batches ahead of the deletes.
+    batches = asyncio.Queue(maxsize=PURGE_PIPELINE_DEPTH)
+    failure = None
+
+    async def bulk_consumer():
+        nonlocal failure
+        while True:
+            batch = await batches.get()
+            if batch is None:
+                return
+            if failure is not None:
+                continue # Keep draining so the producer never blocks on a dead consumer
+            # A long purge can take minutes to reach a queued batch: whatever crossed the
+            # 14-day line in the meantime moves to the single-delete lane.
+            cutoff = bulk_delete_cutoff()
+            aged = [message for message in batch if message.id < cutoff]
+            if aged:
+                batch = [message for message in batch if message.id >= cutoff]
+                for message in aged:
+                    await delete_single_later(message)
+            try:
+                await channel.delete_messages(batch)
+                progress.bulk_deleted += len(batch)
+            except discord.Forbidden as e:
+                failure = e
+            except discord.HTTPException as e:
+                if e.status != 400:
+                    progress.failed += len(batch)
+                    continue
+                # Rejected as a whole (e.g. a message aged out mid-request); one by one, the rest still go
+                for message in batch:
+                    await delete_single_later(message)
+
+    async def take(message):
+        """Sends one match to its delete lane. Returns True once `amount` matches are found."""
+        nonlocal last_report
+        progress.matched += 1
+        if archive is None:
+            await dispatch(message)
+        else:
+            held.append(message)
+            if await archive.write(message):
+                await release_held()
+
+        if on_progress is not None and time.monotonic() - last_report >= PURGE_PROGRESS_INTERVAL:
+            last_report = time.monotonic()
+            await on_progress(progress)
+        return progress.matched >= amount
+
+    async def release_held():
+        """Dispatches the matches held for the archive; their block has been written."""
+        for message in held:
+            await dispatch(message)
+        held.clear()
+
+    async def dispatch(message):
+        nonlocal batch
+        if message.id < bulk_delete_cutoff():
+            await delete_single_later(message)
+        else:
+            batch.append(message)
+            if len(batch) >= BULK_DELETE_BATCH_SIZE:
+                await batches.put(batch)
+                batch = []
+
+    async def delete_single_later(message):
+        # Acquire before spawning so old messages apply back-pressure to the scan
+        # instead of piling up thousands of pending tasks.
+        await single_lane.acquire()
+        task = asyncio.create_task(delete_single(message))
+        single_tasks.add(task)
+        task.add_done_callback(single_tasks.discard)
+
+    async def delete_single(message):
+        try:
+            await message.delete()
+            progress.single_deleted += 1
+        except discord.NotFound:
+            pass # Already gone, nothing to do
+        except discord.HTTPException:
+            progress.failed += 1
+        finally:
+            single_lane.release()
+
+    consumer = asyncio.create_task(bulk_consumer())
+    batch = []
+    held = [] # Matches waiting for their archive block to reach disk
+    last_report = progress.started
+    done = False
+    try:
+        buffered = recent_messages.get(channel.id) if archive is None and (check is None or check.local) else None
+        after_id = snowflake_bound(after) or 0
+        if buffered is not None:
+            # Candidates are copied out up front; the buffer keeps changing while we await.
+            covered_from = buffered.covered_from
+            entries = buffered.newest_first(snowflake_bound(before), max(after_id, covered_from - 1))
+            for message_id, author_id, flags, mentions in entries:
+                if failure is not None or (scan_limit and progress.scanned >= scan_limit):
+                    break
+                progress.scanned += 1
+                if check is not None and not check.matches_entry(author_id, flags, mentions):
+                    continue
+                if await take(channel.get_partial_message(message_id)):
+                    done = True
+                    break
+            if after_id >= covered_from:
+                done = True # The buffer covered the whole range
+            elif before is None or snowflake_bound(before) > covered_from:
+                before = discord.Object(id=covered_from)
+
+        remaining_scan = scan_limit - progress.scanned if scan_limit else None
+        if not done and failure is None and remaining_scan != 0:
+            # Without a check every scanned message is a match, so the history can be capped.
+            remaining = amount - progress.matched
+            history_limit = remaining_scan if check is not None else min(remaining, remaining_scan or remaining)
+            async for message in channel.history(limit=history_limit, before=before, after=after, oldest_first=False):
+                if failure is not None:
+                    break
+                progress.scanned += 1
+                if check is not None and not check(message):
+                    continue
+                if await take(message):
+                    break
+        if held and failure is None:
+            # The last, partial block; if writing it fails its messages are not deleted
+            await archive.flush()
+            await release_held()
+    finally:
+        if batch:
+            await batches.put(batch)
+        await batches.put(None)
+        await consumer
+        if single_tasks:
+            await asyncio.gather(*single_tasks)
+
+    if failure is not None:
+        raise failure
+    return progress
+
 
 # --- Moderation Commands ---
 
-@bot.command(name='purge', help='Deletes a specified number of messages in the channel.')
+class ArchiveFlags(commands.FlagConverter, prefix='--', delimiter=' '):
+    archive: bool = False
+
+    @classmethod
+    async def convert(cls, ctx, argument):
+        # Allow a bare `--archive` (flags otherwise always take a value)
+        return await super().convert(ctx, re.sub(r"--archive(?=\s+--|\s*$)", "--archive yes", argument))
+
+
+class TargetPurgeFlags(ArchiveFlags):
+    # `!targetpurge @user 500 6h --archive` and `--within 6h` both set the window
+    within: str = commands.flag(positional=True, default=None)
+
+
+class PurgeFlags(ArchiveFlags):
+    user: discord.Object = None
+    only: typing.Literal['bots', 'humans', 'attachments', 'links', 'mentions'] = None
+    regex: str = None
+    since: str = None
+
+
+def archive_summary(archive):
+    if archive is None:
+        return ""
+    if not archive.count:
+        return " Nothing to archive."
+    return f" Archived {archive.count} messages as `{archive.name}` ({archive.size / 1024:.0f} KiB)."
+
+
+@bot.command(name='purge', help='Deletes a specified number of messages in the channel. Filters: `--user`, `--only bots|humans|attachments|links|mentions`, `--regex <pattern>`, `--since <duration>`. `--archive` saves the deleted messages first (see !archive).')
 # COMBINED CHECK: User must have a MODERATION_ROLE AND the Manage Messages permission.
 @is_moderator()
 @commands.has_permissions(manage_messages=True)
-async def purge(ctx, amount: int):
-    # ... (Command logic is largely unchanged, it was already correct) ...
+async def purge(ctx, amount: int, *, flags: PurgeFlags):
     if amount < 1:
         await ctx.send("Please specify a positive number of messages to delete.", ephemeral=True)
         return
         
-    if amount > 100:
-        await ctx.send("Cannot purge more than 100 messages at once.", ephemeral=True)
+    settings = guild_config.get(ctx.guild.id)
+    if amount > settings.purge_max_amount:
+        await ctx.send(f"Cannot purge more than {settings.purge_max_amount} messages at once.", ephemeral=True)
         return
 
-    # Delete the messages. +1 to include the command message itself.
-    # ADDED ERROR HANDLING for messages too old for bulk delete (more than 14 days)
+    after = None
+    if flags.since is not None:
+        try:
+            after = discord.utils.utcnow() - parse_duration(flags.since)
+        except ValueError as e:
+            await ctx.send(str(e), ephemeral=True)
+            return
+
+    check = None
+    if flags.user is not None or flags.only is not None or flags.regex is not None:
+        try:
+            regex = re.compile(flags.regex, re.IGNORECASE) if flags.regex is not None else None
+        except re.error as e:
+            await ctx.send(f"Invalid regex: {e}", ephemeral=True)
+            return
+        check = PurgeFilter(user_id=flags.user.id if flags.user else None, kind=flags.only, regex=regex)
+
+    # The streaming engine serves recent messages from the local buffer, pages through
+    # older history in 100-message bulk batches and deletes messages older than 14 days
+    # one by one instead of failing the whole call. Filtered purges scan at most
+    # targetpurge_max_scan messages.
+    # Blocks of one bulk batch: a batch is deleted as soon as its block is on disk
+    archive = ArchiveWriter(ctx.channel, block_messages=BULK_DELETE_BATCH_SIZE) if flags.archive else None
     try:
-        deleted = await ctx.channel.purge(limit=amount + 1)
-        confirmation = await ctx.send(f'🧹 Successfully deleted **{len(deleted) - 1}** messages.')
-        await asyncio.sleep(5)
-        await confirmation.delete()
+        await ctx.message.delete()
+        recent_messages.deleted(ctx.channel.id, (ctx.message.id,))
+        status = await ctx.send(f"🧹 Purging up to **{amount}** messages...")
+
+        async def report(progress):
+            await status.edit(content=f"🧹 Purging... {progress.summary()}")
+
+        try:
+            progress = await stream_purge(
+                ctx.channel, amount,
+                check=check,
+                before=status,
+                after=after,
+                scan_limit=settings.targetpurge_max_scan if check is not None else None,
+                on_progress=report,
+                archive=archive,
+            )
+        finally:
+            if archive is not None:
+                await archive.close()
+        filters = " ".join(f"--{name} {value.id if name == 'user' else value}" for name, value in flags if value is not None and name != "archive")
+        if archive is not None and archive.count:
+            filters += f" archive={archive.name}"
+        log_action(ctx, "purge", flags.user.id if flags.user else None, details=f"#{ctx.channel.name}: {progress.deleted} deleted {filters}".rstrip())
+        await status.edit(content=f"🧹 Purge complete. {progress.summary()}{archive_summary(archive)}")
+        deletion_queue.schedule(status)
     except discord.Forbidden:
         await ctx.send("❌ I don't have permission to manage messages here (Manage Messages).")
     except discord.HTTPException as e:
-        if e.status == 400:
-            await ctx.send("❌ Cannot bulk delete messages older than 14 days. Please choose a smaller range.")
-        else:
-            await ctx.send(f"❌ An error occurred during purge: HTTP {e.status}")
+        await ctx.send(f"❌ An error occurred during purge: HTTP {e.status}")
+    except OSError as e:
+        if archive is None or isinstance(e, aiohttp.ClientError):
+            raise # A network error, not the archive
+        # Messages are archived before they are deleted, so the purge stopped here
+        log.error("Archive %s failed: %s", archive.name, e)
+        await ctx.send(f"❌ Could not write the archive, purge stopped: {e.strerror or e}")
 
 
 # --- KICK, BAN, TIMEOUT, UNTIMEOUT ---
 # All moderation commands now use the @is_moderator() decorator
 # along with the standard permission check.
 
+def check_moderation_target(ctx, member, action, owner_bypass=False):
+    """Returns why ctx.author may not `action` the member (self, bot and role hierarchy checks), or None."""
+    if member == ctx.author:
+        return f"You cannot {action} yourself!"
+    if member == bot.user:
+        return f"I cannot {action} myself!"
+    # Prevent acting on members with higher/equal roles (hierarchy check)
+    if ctx.author.top_role <= member.top_role and not (owner_bypass and ctx.guild.owner_id == ctx.author.id):
+        return f"You cannot {action} **{member.display_name}** because their role is higher than or equal to yours."
+    return None
+
+
 @bot.command(name='kick', help='Kicks a member from the server.')
 @is_moderator()
 @commands.has_permissions(kick_members=True)
-async def kick(ctx, member: discord.Member, *, reason=None):
-    # ADDED CHECK: Prevent mods from kicking themselves or the bot
-    if member == ctx.author:
-        await ctx.send("❌ You cannot kick yourself!", ephemeral=True)
-        return
-    if member == bot.user:
-        await ctx.send("❌ I cannot kick myself!", ephemeral=True)
+async def kick(ctx, member: CachedMember, *, reason=None):
+    # Prevent mods from kicking themselves, the bot, or members above them
+    error = check_moderation_target(ctx, member, "kick")
+    if error:
+        await ctx.send(f"❌ {error}", ephemeral=True)
         return
         
     if reason is None:
         reason = "No reason provided."
 
-    # ADDED CHECK: Prevent kicking members with higher/equal roles (hierarchy check)
-    if ctx.author.top_role <= member.top_role:
-        await ctx.send(f"❌ You cannot kick **{member.display_name}** because their role is higher than or equal to yours.", ephemeral=True)
-        return
-
     await member.kick(reason=reason)
+    log_action(ctx, "kick", member.id, reason)
     await ctx.send(f'👢 Kicked **{member.display_name}** (ID: {member.id}). Reason: *{reason}*')
 
 
 @bot.command(name='ban', help='Bans a member from the server.')
 @is_moderator()
 @commands.has_permissions(ban_members=True)
-async def ban(ctx, member: discord.Member, *, reason=None):
-    # ADDED CHECK: Prevent mods from banning themselves or the bot
-    if member == ctx.author:
-        await ctx.send("❌ You cannot ban yourself!", ephemeral=True)
-        return
-    if member == bot.user:
-        await ctx.send("❌ I cannot ban myself!", ephemeral=True)
+async def ban(ctx, member: CachedMember, *, reason=None):
+    # Prevent mods from banning themselves, the bot, or members above them
+    error = check_moderation_target(ctx, member, "ban")
+    if error:
+        await ctx.send(f"❌ {error}", ephemeral=True)
         return
         
     if reason is None:
         reason = "No reason provided."
 
-    # ADDED CHECK: Prevent banning members with higher/equal roles (hierarchy check)
-    if ctx.author.top_role <= member.top_role:
-        await ctx.send(f"❌ You cannot ban **{member.display_name}** because their role is higher than or equal to yours.", ephemeral=True)
-        return
-
     await member.ban(reason=reason)
+    # A permanent ban replaces any temporary one
+    await scheduler.cancel("unban", ctx.guild.id, member.id)
+    log_action(ctx, "ban", member.id, reason)
     await ctx.send(f'🔨 Banned **{member.display_name}** (ID: {member.id}). Reason: *{reason}*')
 
 
+@bot.command(name='tempban', help='Bans a member for a duration (e.g. `7d`), then unbans them automatically.')
+@is_moderator()
+@commands.has_permissions(ban_members=True)
+async def tempban(ctx, member: CachedMember, duration: str, *, reason=None):
+    error = check_moderation_target(ctx, member, "ban")
+    if error:
+        await ctx.send(f"❌ {error}", ephemeral=True)
+        return
+
+    try:
+        delta = parse_duration(duration)
+    except ValueError as e:
+        await ctx.send(str(e), ephemeral=True)
+        return
+    if delta <= datetime.timedelta(0):
+        await ctx.send("Please specify a positive duration.", ephemeral=True)
+        return
+
+    if reason is None:
+        reason = "No reason provided."
+
+    unban_at = discord.utils.utcnow() + delta
+    await member.ban(reason=f"{reason} (temporary, until {unban_at:%Y-%m-%d %H:%M} UTC)")
+    await scheduler.schedule(unban_at, "unban", ctx.guild.id, member.id)
+    log_action(ctx, "tempban", member.id, reason, details=f"until {unban_at.isoformat()}")
+    await ctx.send(f'⏳ Banned **{member.display_name}** (ID: {member.id}) until {discord.utils.format_dt(unban_at, "f")}. Reason: *{reason}*')
+
+
 @bot.command(name='unban', help='Unbans a user by ID or username.')
 @is_moderator()
 @commands.has_permissions(ban_members=True)
@@ -195,76 +2881,62 @@ async def unban(ctx, *, user_input):
     Requires 'Ban Members' permission and MODERATION_ROLES.
     """
     
-    # 1. Get the list of banned users (GuildBan objects)
+    # 1. Resolve the user from the in-memory ban index (loaded once per guild)
     try:
-        banned_users = await ctx.guild.bans()
+        index = await get_ban_index(ctx.guild)
     except discord.Forbidden:
         await ctx.send("❌ I am missing the **Ban Members** permission to view the ban list.", ephemeral=True)
         return
 
-    target_user = None
-
-    # --- Attempt 1: Match by User ID (Most Reliable) ---
-    # Check if the input is a number (a User ID)
-    if user_input.isdigit():
+    # Matches by User ID (most reliable), mention, or exact username/global name
+    target_user = index.find(user_input)
+    user_id = user_input.strip().strip("<@!>")
+    if target_user is None and user_id.isdigit():
+        # The index may have missed a ban (e.g. a dropped gateway event); one lookup settles it
         try:
-            user_id = int(user_input)
-            # Find the ban entry corresponding to the ID
-            ban_entry = discord.utils.get(banned_users, user__id=user_id)
-            if ban_entry:
-                target_user = ban_entry.user
-        except ValueError:
-            # Should not happen if isdigit() is true, but good safeguard
-            pass 
-
-    # --- Attempt 2: Match by Name (Fallback) ---
-    if target_user is None:
-        # Search for the user by name (case-insensitive)
-        user_input_lower = user_input.lower()
-        for ban_entry in banned_users:
-            user = ban_entry.user
-            # Check username or global display name (covers current Discord naming)
-            if user.name.lower() == user_input_lower or (user.global_name and user.global_name.lower() == user_input_lower):
-                target_user = user
-                break
+            entry = await ctx.guild.fetch_ban(discord.Object(id=int(user_id)))
+        except discord.NotFound:
+            pass
+        else:
+            index.add(entry.user)
+            target_user = entry.user
                 
     # --- Execute Unban ---
     if target_user:
-        await ctx.guild.unban(target_user)
+        try:
+            await ctx.guild.unban(target_user)
+        except discord.NotFound:
+            # The index was stale (unbanned while we missed the event)
+            index.remove(target_user.id)
+            await ctx.send(f'❌ **{target_user.display_name}** is not banned anymore.', ephemeral=True)
+            return
+        index.remove(target_user.id)
+        log_action(ctx, "unban", target_user.id)
         # Use target_user.display_name for the name shown on Discord
         await ctx.send(f'🔓 Unbanned **{target_user.display_name}** (ID: {target_user.id}). Welcome back!')
     else:
-        await ctx.send(f'❌ Could not find a banned user matching "{user_input}" in the ban list. Please ensure you are using the correct **User ID**.', ephemeral=True)
+        suggestions = index.suggest(user_input)
+        hint = ""
+        if suggestions:
+            hint = "\nDid you mean: " + ", ".join(f"**{user.name}** (`{user.id}`)" for user in suggestions)
+        await ctx.send(f'❌ Could not find a banned user matching "{user_input}" in the ban list. Please ensure you are using the correct **User ID**.{hint}', ephemeral=True)
 
 
 
 @bot.command(name='timeout', help='Puts a member in timeout for a specified duration.')
 @is_moderator()
 @commands.has_permissions(moderate_members=True)
-async def timeout(ctx, member: discord.Member, duration: str, *, reason="No reason provided"):
-    # ADDED CHECK: Prevent timing out members with higher/equal roles (hierarchy check)
-    if ctx.author.top_role <= member.top_role and ctx.guild.owner != ctx.author:
-        await ctx.send(f"❌ You cannot timeout **{member.display_name}** because their role is higher than or equal to yours.", ephemeral=True)
+async def timeout(ctx, member: CachedMember, duration: str, *, reason="No reason provided"):
+    # Prevent timing out yourself, the bot, or members above you (the owner may bypass hierarchy)
+    error = check_moderation_target(ctx, member, "timeout", owner_bypass=True)
+    if error:
+        await ctx.send(f"❌ {error}", ephemeral=True)
         return
 
-    # ... (Duration parsing logic is largely unchanged, it was already correct) ...
     try:
-        unit = duration[-1].lower()
-        time_value = int(duration[:-1])
-    except ValueError:
-        await ctx.send("Invalid duration format. Use formats like `1h`, `30m`, or `7d`.", ephemeral=True)
-        return
-
-    if unit == 's':
-        delta = datetime.timedelta(seconds=time_value)
-    elif unit == 'm':
-        delta = datetime.timedelta(minutes=time_value)
-    elif unit == 'h':
-        delta = datetime.timedelta(hours=time_value)
-    elif unit == 'd':
-        delta = datetime.timedelta(days=time_value)
-    else:
-        await ctx.send("Invalid duration unit. Use `s`, `m`, `h`, or `d`.", ephemeral=True)
+        delta = parse_duration(duration)
+    except ValueError as e:
+        await ctx.send(str(e), ephemeral=True)
         return
 
     if delta > datetime.timedelta(days=28):
@@ -273,32 +2945,266 @@ async def timeout(ctx, member: discord.Member, duration: str, *, reason="No reas
 
     # Apply the timeout
     timeout_until = discord.utils.utcnow() + delta
-    await member.timeout(timeout_until, reason=reason)
+    await edit_member(member, timed_out_until=timeout_until, reason=reason)
+    log_action(ctx, "timeout", member.id, reason, details=f"until {timeout_until.isoformat()}")
     await ctx.send(f'🔇 Timed out **{member.display_name}** until {discord.utils.format_dt(timeout_until, "f")}. Reason: *{reason}*')
 
 
 @bot.command(name='untimeout', aliases=['remove_timeout'], help='Removes the timeout from a member.')
 @is_moderator()
 @commands.has_permissions(moderate_members=True)
-async def untimeout(ctx, member: discord.Member, *, reason="Timeout removed by moderator"):
+async def untimeout(ctx, member: CachedMember, *, reason="Timeout removed by moderator"):
     # ... (Improved untimeout logic) ...
     if not member.timed_out:
         await ctx.send(f"**{member.display_name}** is not currently in timeout.", ephemeral=True)
         return
         
     # ADDED CHECK: Prevent un-timing out members with higher/equal roles
-    if ctx.author.top_role <= member.top_role and ctx.guild.owner != ctx.author:
+    if ctx.author.top_role <= member.top_role and ctx.guild.owner_id != ctx.author.id:
         await ctx.send(f"❌ You cannot untimeout **{member.display_name}** because their role is higher than or equal to yours.", ephemeral=True)
         return
 
-    await member.edit(timed_out_until=None, reason=reason)
+    await edit_member(member, timed_out_until=None, reason=reason)
+    log_action(ctx, "untimeout", member.id, reason)
     await ctx.send(f'🔊 Removed timeout from **{member.display_name}**.')
 
-@bot.command(name='lock', help='Locks the current channel by denying @everyone permission to send messages.')
+# --- MASSBAN, MASSKICK, MASSTIMEOUT ---
+# Raid tooling: one command, many targets (IDs or mentions). Targets are processed by
+# a small pool of workers and a single status message is edited in place.
+
+MASS_PROGRESS_INTERVAL = 2.0 # Seconds between status message edits
+
+
+async def run_mass_action(ctx, verb, targets, action, *, concurrency=MASS_ACTION_CONCURRENCY, describe="`{}`".format):
+    """
+    Runs `action(target_id)` for every distinct target through `concurrency` workers.
+    `action` returns None on success or a short failure reason; API errors are caught here.
+    `describe(target_id)` formats a target in the failure summary.
+    Returns (succeeded, failed) where failed is a list of (target_id, reason).
+    """
+    target_ids = list(dict.fromkeys(target.id for target in targets))
+    pending = deque(target_ids)
+    succeeded = []
+    failed = []
+
+    async def worker():
+        while pending:
+            target_id = pending.popleft()
+            try:
+                reason = await action(target_id)
+            except discord.NotFound:
+                reason = "not found"
+            except discord.Forbidden:
+                reason = "missing permissions"
+            except discord.HTTPException as e:
+                reason = f"HTTP {e.status}"
+            except discord.DiscordException as e:
+                # E.g. OutboundDropped: one target failing never ends the whole run
+                reason = type(e).__name__
+            if reason is None:
+                succeeded.append(target_id)
+            else:
+                failed.append((target_id, reason))
+
+    status = await ctx.send(f"⏳ {verb} 0/{len(target_ids)}...")
+    workers = asyncio.gather(*(worker() for _ in range(min(concurrency, len(target_ids)))))
+    while not workers.done():
+        await asyncio.wait({workers}, timeout=MASS_PROGRESS_INTERVAL)
+        if not workers.done():
+            await status.edit(content=f"⏳ {verb} {len(succeeded) + len(failed)}/{len(target_ids)}... (✅ {len(succeeded)}, ❌ {len(failed)})")
+    await workers
+
+    summary = f"{verb} complete: ✅ **{len(succeeded)}** succeeded, ❌ **{len(failed)}** failed."
+    if failed:
+        lines = [f"{describe(target_id)}: {reason}" for target_id, reason in failed[:15]]
+        if len(failed) > 15:
+            lines.append(f"...and {len(failed) - 15} more")
+        summary += "\n" + "\n".join(lines)
+    await status.edit(content=summary[:2000])
+    return succeeded, failed
+
+
+async def check_mass_targets(ctx, targets):
+    """Validates the target count for mass commands. Returns False (after replying) if invalid."""
+    if not targets:
+        await ctx.send("Please provide at least one user ID or mention.", ephemeral=True)
+        return False
+    max_targets = guild_config.get(ctx.guild.id).mass_action_max_targets
+    if len(targets) > max_targets:
+        await ctx.send(f"Cannot act on more than {max_targets} users at once.", ephemeral=True)
+        return False
+    return True
+
+
+@bot.command(name='massban', help='Bans many users at once by ID or mention. Users who already left can be banned too.')
+@is_moderator()
+@commands.has_permissions(ban_members=True)
+async def massban(ctx, targets: commands.Greedy[discord.Object], *, reason="No reason provided."):
+    if not await check_mass_targets(ctx, targets):
+        return
+
+    async def ban_target(user_id):
+        # Users who already left can still be banned; members get the usual checks
+        member = await member_cache.get_or_none(ctx.guild, user_id)
+        if member is not None:
+            error = check_moderation_target(ctx, member, "ban")
+            if error:
+                return error
+        await ctx.guild.ban(discord.Object(id=user_id), reason=reason)
+        # A permanent ban replaces any temporary one
+        await scheduler.cancel("unban", ctx.guild.id, user_id)
+        log_action(ctx, "ban", user_id, reason, details="massban")
+
+    await run_mass_action(ctx, "🔨 Mass ban", targets, ban_target)
+
+
+@bot.command(name='masskick', help='Kicks many members at once by ID or mention.')
+@is_moderator()
+@commands.has_permissions(kick_members=True)
+async def masskick(ctx, targets: commands.Greedy[discord.Object], *, reason="No reason provided."):
+    if not await check_mass_targets(ctx, targets):
+        return
+
+    async def kick_target(user_id):
+        member = await member_cache.get(ctx.guild, user_id)
+        error = check_moderation_target(ctx, member, "kick")
+        if error:
+            return error
+        await member.kick(reason=reason)
+        log_action(ctx, "kick", user_id, reason, details="masskick")
+
+    await run_mass_action(ctx, "👢 Mass kick", targets, kick_target)
+
+
+@bot.command(name='masstimeout', help='Times out many members at once, e.g. `!masstimeout 1h @a @b 123...`.')
+@is_moderator()
+@commands.has_permissions(moderate_members=True)
+async def masstimeout(ctx, duration: str, targets: commands.Greedy[discord.Object], *, reason="No reason provided"):
+    if not await check_mass_targets(ctx, targets):
+        return
+
+    try:
+        delta = parse_duration(duration)
+    except ValueError as e:
+        await ctx.send(str(e), ephemeral=True)
+        return
+
+    if delta > datetime.timedelta(days=28):
+        await ctx.send("Cannot timeout for more than 28 days.", ephemeral=True)
+        return
+
+    timeout_until = discord.utils.utcnow() + delta
+
+    async def timeout_target(user_id):
+        member = await member_cache.get(ctx.guild, user_id)
+        error = check_moderation_target(ctx, member, "timeout", owner_bypass=True)
+        if error:
+            return error
+        await edit_member(member, timed_out_until=timeout_until, reason=reason)
+        log_action(ctx, "timeout", user_id, reason, details=f"masstimeout until {timeout_until.isoformat()}")
+
+    await run_mass_action(ctx, "🔇 Mass timeout", targets, timeout_target)
+
+
+class RaidsweepFlags(commands.FlagConverter, prefix='--', delimiter=' '):
+    min_account_age: str = None
+    action: typing.Literal['ban', 'kick'] = 'ban'
+    reason: str = "Raid sweep"
+
+    @classmethod
+    async def convert(cls, ctx, argument):
+        # Flag names cannot contain the '-' of the prefix; accept the dashed spelling too
+        return await super().convert(ctx, argument.replace("--min-account-age", "--min_account_age"))
+
+
+@bot.command(name='raidsweep', help='Bans (or kicks, `--action kick`) everyone who joined within a duration, e.g. `!raidsweep 10m --min-account-age 7d` only sweeps accounts younger than 7 days. Shows a preview and waits for `confirm`.')
+@is_moderator()
+@commands.has_permissions(ban_members=True, kick_members=True)
+async def raidsweep(ctx, since: str, *, flags: RaidsweepFlags):
+    try:
+        window = parse_duration(since)
+        account_age = parse_duration(flags.min_account_age) if flags.min_account_age is not None else None
+    except ValueError as e:
+        await ctx.send(str(e), ephemeral=True)
+        return
+
+    now = time.time()
+    index = get_join_index(ctx.guild.id)
+    matches = index.since(now - window.total_seconds())
+    if account_age is not None:
+        # Snowflakes carry their creation time, so no member objects are needed here
+        created_after = discord.utils.time_snowflake(discord.utils.utcnow() - account_age)
+        matches = [(member_id, joined_at) for member_id, joined_at in matches if member_id >= created_after]
+    excluded = {bot.user.id, ctx.author.id, ctx.guild.owner_id} | index.bots
+    matches = [(member_id, joined_at) for member_id, joined_at in matches if member_id not in excluded]
+
+    note = ""
+    if not index.seeded and now - window.total_seconds() < index.covered_since:
+        note = f"\n⚠️ The member list is not loaded (lazy member mode); only joins since {discord.utils.format_dt(datetime.datetime.fromtimestamp(index.covered_since, datetime.timezone.utc), 'T')} are included."
+    if not matches:
+        await ctx.send(f"No accounts joined in the last {since}{' with accounts younger than ' + flags.min_account_age if account_age else ''}.{note}")
+        return
+    if len(matches) > RAIDSWEEP_MAX_TARGETS:
+        await ctx.send(f"❌ {len(matches)} accounts match; a sweep is limited to {RAIDSWEEP_MAX_TARGETS}. Use a shorter window or `--min-account-age`.", ephemeral=True)
+        return
+
+    verb = "ban" if flags.action == 'ban' else "kick"
+    lines = [
+        f"<@{member_id}> joined <t:{int(joined_at)}:R>, account created <t:{int(discord.utils.snowflake_time(member_id).timestamp())}:R>"
+        for member_id, joined_at in matches[-15:]
+    ]
+    if len(matches) > 15:
+        lines.insert(0, f"...and {len(matches) - 15} earlier joins")
+    await ctx.send(
+        f"🚨 **{len(matches)}** accounts joined in the last {since}{' with accounts younger than ' + flags.min_account_age if account_age else ''}:\n"
+        + "\n".join(lines) + note
+        + f"\nReply `confirm` within {RAIDSWEEP_CONFIRM_TIMEOUT}s to **{verb}** them all.",
+        allowed_mentions=discord.AllowedMentions.none(),
+    )
+    try:
+        await bot.wait_for(
+            'message',
+            check=lambda m: m.author.id == ctx.author.id and m.channel.id == ctx.channel.id and m.content.strip().lower() == "confirm",
+            timeout=RAIDSWEEP_CONFIRM_TIMEOUT,
+        )
+    except asyncio.TimeoutError:
+        await ctx.send("⌛ Raid sweep cancelled (not confirmed).")
+        return
+
+    async def sweep_target(user_id):
+        if flags.action == 'ban':
+            # Accounts that already left can still be banned; members get the usual checks
+            member = await member_cache.get_or_none(ctx.guild, user_id)
+            if member is not None:
+                error = check_moderation_target(ctx, member, "ban")
+                if error:
+                    return error
+            await ctx.guild.ban(discord.Object(id=user_id), reason=flags.reason)
+            await scheduler.cancel("unban", ctx.guild.id, user_id)
+        else:
+            member = await member_cache.get(ctx.guild, user_id)
+            error = check_moderation_target(ctx, member, "kick")
+            if error:
+                return error
+            await member.kick(reason=flags.reason)
+        log_action(ctx, verb, user_id, flags.reason, details=f"raidsweep {since}")
+
+    await run_mass_action(ctx, f"🧹 Raid sweep ({verb})", [discord.Object(id=member_id) for member_id, _ in matches], sweep_target)
+
+
+@bot.command(name='lock', help='Locks the current channel by denying @everyone permission to send messages. Add a duration (e.g. `30m`) to unlock automatically.')
 @is_moderator()
 @commands.has_permissions(manage_channels=True)
-async def lock(ctx, channel: discord.TextChannel = None):
+async def lock(ctx, channel: typing.Optional[discord.TextChannel] = None, duration: str = None):
     channel = channel or ctx.channel
+    unlock_at = None
+    if duration is not None:
+        try:
+            unlock_at = discord.utils.utcnow() + parse_duration(duration)
+        except ValueError as e:
+            await ctx.send(str(e), ephemeral=True)
+            return
+
     # Get the @everyone role for the guild
     overwrite = channel.overwrites_for(ctx.guild.default_role)
     
@@ -308,7 +3214,11 @@ async def lock(ctx, channel: discord.TextChannel = None):
         
     overwrite.send_messages = False
     await channel.set_permissions(ctx.guild.default_role, overwrite=overwrite, reason=f"Channel locked by {ctx.author.name}")
-    await ctx.send(f"🔒 Channel **{channel.mention}** has been locked.")
+    if unlock_at is not None:
+        await scheduler.schedule(unlock_at, "unlock", ctx.guild.id, channel.id)
+        await ctx.send(f"🔒 Channel **{channel.mention}** has been locked until {discord.utils.format_dt(unlock_at, 'f')}.")
+    else:
+        await ctx.send(f"🔒 Channel **{channel.mention}** has been locked.")
 
 @bot.command(name='unlock', help='Unlocks the current channel by allowing @everyone to send messages.')
 @is_moderator()
@@ -323,13 +3233,101 @@ async def unlock(ctx, channel: discord.TextChannel = None):
 
     overwrite.send_messages = None # Removing the explicit deny/allow makes it follow the default channel permissions
     await channel.set_permissions(ctx.guild.default_role, overwrite=overwrite, reason=f"Channel unlocked by {ctx.author.name}")
+    await scheduler.cancel("unlock", ctx.guild.id, channel.id)
     await ctx.send(f"🔓 Channel **{channel.mention}** has been unlocked.")
 
 
+def lockdown_channels(ctx, targets):
+    """Expands lockdown targets (categories and text channels) to text channels; no targets means the whole server."""
+    if not targets:
+        return list(ctx.guild.text_channels)
+    channels = {}
+    for target in targets:
+        for channel in (target.text_channels if isinstance(target, discord.CategoryChannel) else [target]):
+            channels[channel.id] = channel
+    return list(channels.values())
+
+
+@bot.command(name='lockdown', help='Locks the whole server, or the given categories/channels, e.g. `!lockdown #general "Community" raid`. Undo with `!unlockdown`.')
+@is_moderator()
+@commands.has_permissions(manage_channels=True)
+async def lockdown(ctx, targets: commands.Greedy[typing.Union[discord.CategoryChannel, discord.TextChannel]], *, reason="Lockdown"):
+    everyone = ctx.guild.default_role
+    # Channels that are already locked (by !lock or by hand) are left alone and not snapshotted
+    channels = [channel for channel in lockdown_channels(ctx, targets) if channel.overwrites_for(everyone).send_messages is not False]
+    if not channels:
+        await ctx.send("🔒 Every selected channel is already locked.")
+        return
+
+    snapshots = []
+    for channel in channels:
+        allow, deny = channel.overwrites_for(everyone).pair()
+        snapshots.append((channel.id, allow.value, deny.value, everyone in channel.overwrites))
+    await lockdown_store.save(ctx.guild.id, snapshots)
+
+    by_id = {channel.id: channel for channel in channels}
+
+    async def lock_channel(channel_id):
+        channel = by_id[channel_id]
+        overwrite = channel.overwrites_for(everyone)
+        overwrite.send_messages = False
+        await channel.set_permissions(everyone, overwrite=overwrite, reason=f"Lockdown by {ctx.author.name}: {reason}")
+
+    succeeded, failed = await run_mass_action(
+        ctx, "🔒 Lockdown", channels, lock_channel, concurrency=LOCKDOWN_CONCURRENCY, describe="<#{}>".format,
+    )
+    # Channels that could not be locked have nothing to restore
+    await lockdown_store.delete(ctx.guild.id, [channel_id for channel_id, _ in failed])
+    if succeeded:
+        log_action(ctx, "lockdown", None, reason, details=f"{len(succeeded)} channels")
+
+
+@bot.command(name='unlockdown', help='Restores channels locked by `!lockdown` to their previous permissions. Takes the same targets (none means everything).')
+@is_moderator()
+@commands.has_permissions(manage_channels=True)
+async def unlockdown(ctx, targets: commands.Greedy[typing.Union[discord.CategoryChannel, discord.TextChannel]], *, reason="Lockdown lifted"):
+    everyone = ctx.guild.default_role
+    snapshots = await lockdown_store.load(ctx.guild.id)
+    if targets:
+        snapshots = {channel.id: snapshots[channel.id] for channel in lockdown_channels(ctx, targets) if channel.id in snapshots}
+    if not snapshots:
+        await ctx.send("🔓 No locked-down channels to restore.")
+        return
+
+    # Only channels that still exist and are still locked need an API call; the rest
+    # (deleted, or unlocked by hand in the meantime) just drop their snapshot.
+    channels = []
+    stale = []
+    for channel_id in snapshots:
+        channel = ctx.guild.get_channel(channel_id)
+        if channel is not None and channel.overwrites_for(everyone).send_messages is False:
+            channels.append(channel)
+        else:
+            stale.append(channel_id)
+    await lockdown_store.delete(ctx.guild.id, stale)
+    if not channels:
+        await ctx.send("🔓 No locked-down channels to restore.")
+        return
+
+    async def restore_channel(channel_id):
+        allow, deny, had_overwrite = snapshots[channel_id]
+        channel = ctx.guild.get_channel(channel_id)
+        previous = discord.PermissionOverwrite.from_pair(discord.Permissions(allow), discord.Permissions(deny)) if had_overwrite else None
+        await channel.set_permissions(everyone, overwrite=previous, reason=f"Unlockdown by {ctx.author.name}: {reason}")
+
+    succeeded, failed = await run_mass_action(
+        ctx, "🔓 Unlockdown", channels, restore_channel, concurrency=LOCKDOWN_CONCURRENCY, describe="<#{}>".format,
+    )
+    # Failed channels keep their snapshot so the command can simply be run again
+    await lockdown_store.delete(ctx.guild.id, succeeded)
+    if succeeded:
+        log_action(ctx, "unlockdown", None, reason, details=f"{len(succeeded)} channels")
+
+
 
 
 @bot.command(name='whois', aliases=['userinfo'], help='Displays detailed information about a member.')
-async def whois(ctx, member: discord.Member = None):
+async def whois(ctx, member: CachedMember = None):
     # If no member is specified, default to the command author
     member = member or ctx.author 
 
@@ -378,22 +3376,22 @@ async def serverinfo(ctx):
     )
 
     # Basic Info
-    embed.add_field(name="Owner", value=guild.owner.mention, inline=True)
+    embed.add_field(name="Owner", value=f"<@{guild.owner_id}>", inline=True)
     embed.add_field(name="Server ID", value=guild.id, inline=True)
     embed.add_field(name="Creation Date", value=discord.utils.format_dt(guild.created_at, "R"), inline=True)
     
-    # Member Count
-    bot_count = len([member for member in guild.members if member.bot])
+    # Member Count (from the incrementally maintained counters, no member scan)
+    stats = get_guild_stats(guild)
+    bot_count = stats.bots
     member_count = guild.member_count
-    embed.add_field(name="Member Count", value=f"Total: **{member_count}**\nHumans: {member_count - bot_count}\nBots: {bot_count}", inline=True)
+    counting = "" if stats.exact else " (estimated)"
+    embed.add_field(name="Member Count", value=f"Total: **{member_count}**\nHumans: {member_count - bot_count}\nBots: {bot_count}{counting}", inline=True)
 
     # Channel Count
-    text_channels = len(guild.text_channels)
-    voice_channels = len(guild.voice_channels)
-    embed.add_field(name="Channels", value=f"Text: {text_channels}\nVoice: {voice_channels}\nCategories: {len(guild.categories)}", inline=True)
+    embed.add_field(name="Channels", value=f"Text: {stats.text_channels}\nVoice: {stats.voice_channels}\nCategories: {stats.categories}", inline=True)
     
     # Other Stats
-    embed.add_field(name="Roles", value=len(guild.roles), inline=True)
+    embed.add_field(name="Roles", value=stats.roles, inline=True)
     embed.add_field(name="Boost Level", value=f"Level {guild.premium_tier} ({guild.premium_subscription_count} boosts)", inline=True)
 
     # Server Icon
@@ -407,71 +3405,362 @@ async def serverinfo(ctx):
 
 
 
-@bot.command(name='targetpurge', help='Deletes the specified number of messages from a specific member.')
+@bot.command(name='stats', help='Shows member growth over the recorded history (hourly snapshots).')
+@commands.guild_only()
+async def stats(ctx):
+    guild = ctx.guild
+    counters = get_guild_stats(guild)
+
+    embed = discord.Embed(
+        title=f"📈 Stats: {guild.name}",
+        color=discord.Color.gold(),
+        timestamp=datetime.datetime.now(datetime.timezone.utc)
+    )
+    embed.add_field(name="Now", value=f"Humans: {counters.humans}\nBots: {counters.bots}", inline=True)
+
+    # Compare against the snapshots roughly 1 day and 7 days back
+    now = discord.utils.utcnow()
+    for label, age in (("24h", datetime.timedelta(days=1)), ("7d", datetime.timedelta(days=7))):
+        past = next((entry for entry in counters.history if now - entry[0] <= age), None)
+        if past is None:
+            value = "No data yet"
+        else:
+            value = f"Humans: {counters.humans - past[1]:+}\nBots: {counters.bots - past[2]:+}"
+        embed.add_field(name=f"Change ({label})", value=value, inline=True)
+
+    embed.set_footer(text=f"{len(counters.history)} hourly snapshots recorded")
+    await ctx.send(embed=embed)
+
+
+
+
+@bot.command(name='targetpurge', help='Deletes the specified number of messages from a specific member. Optionally limit how far back to look, e.g. `!targetpurge @user 500 6h` (or `--within 6h`). `--archive` saves the deleted messages first.')
 @is_moderator()
 @commands.has_permissions(manage_messages=True)
-async def targetpurge(ctx, member: discord.Member, amount: int):
+async def targetpurge(ctx, member: CachedMember, amount: int, *, flags: TargetPurgeFlags):
     # Standard input validation
     if amount < 1:
         await ctx.send("Please specify a positive number of messages to delete.", ephemeral=True)
         return
     
-    # Discord API limit is 100 messages at a time. This command searches deeper.
-    if amount > 100:
-        await ctx.send("Cannot delete more than 100 messages at once due to Discord's API limits.", ephemeral=True)
+    settings = guild_config.get(ctx.guild.id)
+    if amount > settings.purge_max_amount:
+        await ctx.send(f"Cannot delete more than {settings.purge_max_amount} messages at once.", ephemeral=True)
         return
 
-    # Define a check function to filter messages by the target member
-    def is_target_member(message):
-        # We need to make sure the command message itself (from ctx.author) is not included
-        # unless ctx.author happens to be the 'member' being purged, but it's cleaner
-        # to focus only on the member check here.
-        return message.author == member
+    within = flags.within or settings.targetpurge_default_window
 
     try:
-        # We search a maximum number of messages (amount + 1 for the command message itself).
-        # When using a 'check', the 'limit' specifies how many messages *must pass the check*.
-        # However, since a member's messages are interspersed, we need to SEARCH deeper 
-        # to FIND 'amount' messages.
+        window = parse_duration(within)
+    except ValueError as e:
+        await ctx.send(str(e), ephemeral=True)
+        return
 
-        # The correct way to use 'purge' with a check is to use the `limit` as the 
-        # maximum *messages to delete*. But since the deleted messages are interspersed
-        # with others, we will use fetch to manually get the messages.
+    archive = ArchiveWriter(ctx.channel, block_messages=BULK_DELETE_BATCH_SIZE) if flags.archive else None
 
-        # --- FIX: Use fetch and delete to ensure accurate count ---
-        
-        # 1. Fetch messages manually (search deep enough to find 'amount' messages)
-        # 500 is a safe depth to search for 'amount' messages.
-        messages = []
-        async for message in ctx.channel.history(limit=500):
-            if len(messages) == amount:
-                break
-            if message.author == member:
-                messages.append(message)
-                
-        # 2. Add the command message itself to the delete list (to hide the mod action)
-        messages.append(ctx.message)
+    # Instead of a fixed scan depth, the scan runs until it has found `amount` messages,
+    # crossed the time cutoff or hit targetpurge_max_scan. Matches are bulk-deleted in
+    # batches of 100 while the scan is still paging through history.
+    try:
+        await ctx.message.delete()
+        recent_messages.deleted(ctx.channel.id, (ctx.message.id,))
+        status = await ctx.send(f"🧹 Searching for up to **{amount}** messages from **{member.display_name}** in the last {within}...")
 
-        # 3. Use bulk delete on the found list
-        deleted_count = len(messages) - 1 # Subtract the command message
-        await ctx.channel.delete_messages(messages)
-        # --- END FIX ---
+        async def report(progress):
+            await status.edit(content=f"🧹 Purging **{member.display_name}**... scanned {progress.scanned}, {progress.summary()}")
+
+        try:
+            progress = await stream_purge(
+                ctx.channel, amount,
+                check=PurgeFilter(user_id=member.id),
+                before=status,
+                after=discord.utils.utcnow() - window,
+                scan_limit=settings.targetpurge_max_scan,
+                on_progress=report,
+                archive=archive,
+            )
+        finally:
+            if archive is not None:
+                await archive.close()
+        details = f"#{ctx.channel.name}: {progress.deleted} deleted"
+        if archive is not None and archive.count:
+            details += f" archive={archive.name}"
+        log_action(ctx, "targetpurge", member.id, details=details)
         
-        if deleted_count > 0:
-            confirmation = await ctx.send(f'🧹 Successfully deleted **{deleted_count}** recent messages from **{member.display_name}**.')
+        if progress.deleted > 0:
+            await status.edit(content=f'🧹 Successfully deleted **{progress.deleted}** recent messages from **{member.display_name}** (scanned {progress.scanned}). {progress.summary()}{archive_summary(archive)}')
         else:
-            await ctx.send(f'Could not find **{amount}** recent messages from **{member.display_name}** within the last 500 messages.', ephemeral=True)
+            await status.edit(content=f'Could not find any messages from **{member.display_name}** within the last {within} (scanned {progress.scanned}).')
         
-        await asyncio.sleep(5)
-        await confirmation.delete()
+        deletion_queue.schedule(status)
         
     except discord.Forbidden:
         await ctx.send("❌ I don't have permission to manage messages here (Manage Messages).")
     except discord.HTTPException as e:
-        if e.status == 400:
-            await ctx.send("❌ Cannot delete messages older than 14 days. Please try a lower amount.")
+        await ctx.send(f"❌ An error occurred during purge: HTTP {e.status}")
+    except OSError as e:
+        if archive is None or isinstance(e, aiohttp.ClientError):
+            raise # A network error, not the archive
+        log.error("Archive %s failed: %s", archive.name, e)
+        await ctx.send(f"❌ Could not write the archive, purge stopped: {e.strerror or e}")
+
+
+
+
+
+@bot.command(name='archive', help="Saves a channel's history (newest first, up to `amount` messages) to a compressed archive on the bot's disk, e.g. `!archive #general 5000`.")
+@is_moderator()
+@commands.has_permissions(manage_messages=True)
+async def archive_channel(ctx, channel: typing.Optional[discord.TextChannel] = None, amount: int = ARCHIVE_MAX_MESSAGES):
+    channel = channel or ctx.channel
+    if not 1 <= amount <= ARCHIVE_MAX_MESSAGES:
+        await ctx.send(f"Please specify between 1 and {ARCHIVE_MAX_MESSAGES} messages.", ephemeral=True)
+        return
+    # Manage Messages is only checked where the command is typed; the archived channel may be any other
+    if not can_read_history(ctx.author, channel):
+        await ctx.send(f"❌ You need Read Message History in {channel.mention} to archive it.", ephemeral=True)
+        return
+
+    # History is streamed straight into the writer; only one compressed block is ever
+    # held in memory, whatever the size of the channel.
+    writer = ArchiveWriter(channel)
+    status = await ctx.send(f"🗄️ Archiving up to **{amount}** messages from {channel.mention}...")
+    last_report = time.monotonic()
+    try:
+        try:
+            async for message in channel.history(limit=amount, before=status if channel == ctx.channel else None, oldest_first=False):
+                await writer.write(message)
+                if time.monotonic() - last_report >= PURGE_PROGRESS_INTERVAL:
+                    last_report = time.monotonic()
+                    await status.edit(content=f"🗄️ Archiving {channel.mention}... {writer.count} messages so far")
+        finally:
+            await writer.close()
+    except discord.Forbidden:
+        await status.edit(content=f"❌ I can't read the history of {channel.mention} (Read Message History).")
+        return
+    except discord.HTTPException as e:
+        await status.edit(content=f"❌ Archive stopped after {writer.count} messages: HTTP {e.status}")
+        return
+    except OSError as e:
+        if isinstance(e, aiohttp.ClientError):
+            raise
+        log.error("Archive %s failed: %s", writer.name, e)
+        await status.edit(content=f"❌ Could not write the archive: {e.strerror or e}")
+        return
+
+    if not writer.count:
+        await status.edit(content=f"🗄️ {channel.mention} has no messages to archive.")
+        return
+    log_action(ctx, "archive", details=f"#{channel.name}: {writer.count} messages archive={writer.name}")
+    await status.edit(content=(
+        f"🗄️ Archived **{writer.count}** messages from {channel.mention} as `{writer.name}` ({writer.size / 1024:.0f} KiB). "
+        f"`!archiveuser {writer.name} <user>` pulls out one member's messages."
+    ))
+
+
+@bot.command(name='archiveuser', help="Pulls one member's messages out of an archive made by !archive or a `--archive` purge, e.g. `!archiveuser <archive> @user`. Run outside the archived channel, the file is sent by DM.")
+@is_moderator()
+@commands.has_permissions(manage_messages=True)
+async def archiveuser(ctx, name: str, user: discord.Object):
+    base = archive_path(ctx.guild.id, name)
+    if not ARCHIVE_NAME.match(name) or not os.path.exists(base + ".index.jsonl"):
+        await ctx.send(f"❌ No archive named `{name}` in this server.", ephemeral=True)
+        return
+    if base in active_archives:
+        await ctx.send(f"⏳ `{name}` is still being written; try again once it is complete.", ephemeral=True)
+        return
+    # The archive is only as readable as the channel it came from
+    source = ctx.guild.get_channel_or_thread(read_archive_header(base)["channel_id"])
+    if source is None:
+        if not ctx.author.guild_permissions.administrator:
+            await ctx.send(f"❌ The channel `{name}` was archived from no longer exists; only administrators can read it.", ephemeral=True)
+            return
+    elif not can_read_history(ctx.author, source):
+        await ctx.send(f"❌ You need Read Message History in {source.mention} to read its archives.", ephemeral=True)
+        return
+
+    # Only the blocks whose index entry lists the user are decompressed. Each run writes
+    # its own temporary file, so concurrent extracts of the same user cannot collide.
+    filename = f"{name}.user-{user.id}.jsonl.gz"
+    directory = extracts_dir(ctx.guild.id)
+    os.makedirs(directory, exist_ok=True)
+    fd, out_path = tempfile.mkstemp(prefix=filename + ".", suffix=".tmp", dir=directory)
+    os.close(fd)
+    try:
+        count, blocks_read, blocks = await asyncio.to_thread(extract_archive, base, user.id, out_path)
+        summary = f"**{count}** messages from user `{user.id}` in `{name}` (read {blocks_read} of {blocks} blocks)"
+        if not count:
+            await ctx.send(f"🗄️ No messages from user `{user.id}` in `{name}` (read {blocks_read} of {blocks} blocks).")
+        elif os.path.getsize(out_path) > ARCHIVE_UPLOAD_LIMIT:
+            keep_extract(out_path, directory, filename)
+            await ctx.send(f"🗄️ {summary}. Too large to upload; saved on the bot's disk as `extracts/{filename}` "
+                           f"for {ARCHIVE_EXTRACT_TTL_HOURS}h.")
+        elif ctx.channel == source:
+            await ctx.send(f"🗄️ {summary}.", file=discord.File(out_path, filename=filename))
+        # Elsewhere, other readers of this channel may not be allowed to see the source channel
+        elif await send_extract_privately(ctx, summary, out_path, filename):
+            await ctx.send(f"🗄️ {summary}: sent to you by direct message.")
         else:
-            await ctx.send(f"❌ An error occurred during purge: HTTP {e.status}")
+            keep_extract(out_path, directory, filename)
+            await ctx.send(f"🗄️ {summary}. Your DMs are closed, so it is saved on the bot's disk as `extracts/{filename}` "
+                           f"for {ARCHIVE_EXTRACT_TTL_HOURS}h; run this in the archived channel to upload it there.")
+    finally:
+        if os.path.exists(out_path):
+            os.remove(out_path)
+
+
+def keep_extract(out_path, directory, filename):
+    """Moves an extract to a stable name, where it stays until prune_archive_extracts removes it."""
+    os.replace(out_path, os.path.join(directory, filename))
+
+
+async def send_extract_privately(ctx, summary, out_path, filename):
+    """DMs an extract to the command's author. Returns False if their DMs are closed."""
+    try:
+        await ctx.author.send(f"🗄️ {summary} from **{ctx.guild.name}**.", file=discord.File(out_path, filename=filename))
+    except discord.Forbidden:
+        return False
+    return True
+
+
+@tasks.loop(hours=1)
+async def prune_archive_extracts():
+    """Deletes !archiveuser extracts (and leftover temporary files) older than ARCHIVE_EXTRACT_TTL_HOURS."""
+    cutoff = time.time() - ARCHIVE_EXTRACT_TTL_HOURS * 3600
+
+    def prune():
+        removed = 0
+        for guild_dir in os.scandir(ARCHIVE_DIR) if os.path.isdir(ARCHIVE_DIR) else ():
+            directory = os.path.join(guild_dir.path, "extracts")
+            if not os.path.isdir(directory):
+                continue
+            for entry in os.scandir(directory):
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+                    removed += 1
+        return removed
+
+    removed = await asyncio.to_thread(prune)
+    if removed:
+        log.info("Pruned %d archive extracts", removed)
+
+
+@bot.command(name='perf', help='Shows command latency, error, HTTP/rate-limit and event-loop statistics.')
+@is_moderator()
+async def perf(ctx):
+    embed = discord.Embed(
+        title="⏱️ Performance",
+        color=discord.Color.teal(),
+        timestamp=datetime.datetime.now(datetime.timezone.utc)
+    )
+
+    slowest = sorted(metrics.command_latency.items(), key=lambda item: item[1].quantile(0.99), reverse=True)[:8]
+    latency = "\n".join(
+        f"`{name}` p50 {hist.quantile(0.5) * 1000:.0f}ms · p99 {hist.quantile(0.99) * 1000:.0f}ms · n={hist.count}"
+        for name, hist in slowest
+    )
+    embed.add_field(name="Command Latency", value=latency or "No commands yet", inline=False)
+
+    errors = "\n".join(f"`{command}` {error}: {count}" for (command, error), count in metrics.command_errors.most_common(5))
+    embed.add_field(name="Errors", value=errors or "None", inline=False)
+
+    per_route = Counter()
+    for (method, route, status), count in metrics.http_requests.items():
+        per_route[f"{method} {route}"] += count
+    http = "\n".join(f"`{route}`: {count}" for route, count in per_route.most_common(5))
+    embed.add_field(name=f"HTTP Requests ({sum(per_route.values())})", value=http or "None", inline=False)
+
+    limited = "\n".join(f"`{method} {route}`: {count}" for (method, route), count in metrics.http_rate_limited.most_common(5))
+    embed.add_field(name=f"429s ({sum(metrics.http_rate_limited.values())})", value=limited or "None", inline=False)
+
+    if OUTBOUND_SCHEDULER:
+        waits = " · ".join(
+            f"{name} p99 {metrics.outbound_wait[name].quantile(0.99) * 1000:.0f}ms"
+            for name in PRIORITY_NAMES if metrics.outbound_wait[name].count
+        )
+        embed.add_field(
+            name=f"Outbound Queue ({outbound.queued()} waiting)",
+            value=f"{waits or 'No queueing yet'}\nCoalesced edits: {metrics.outbound_coalesced} · Dropped replies: {metrics.outbound_dropped}",
+            inline=False,
+        )
+
+    lag = metrics.loop_lag
+    embed.add_field(name="Event Loop Lag", value=f"Now {metrics.loop_lag_last * 1000:.1f}ms · p99 {lag.quantile(0.99) * 1000:.1f}ms", inline=False)
+    embed.add_field(name="Gateway Latency", value=f"{bot.latency * 1000:.0f}ms", inline=True)
+    await ctx.send(embed=embed)
+
+
+class ModlogFlags(commands.FlagConverter, prefix='--', delimiter=' '):
+    user: discord.Object = None
+    moderator: discord.Object = None
+    before: int = None
+
+
+@bot.command(name='modlog', help='Shows logged moderation actions, newest first. Filters: `--user`, `--moderator`, `--before <entry id>` for the next page.')
+@is_moderator()
+async def modlog_command(ctx, *, flags: ModlogFlags):
+    rows = await modlog.query(
+        ctx.guild.id,
+        target_id=flags.user.id if flags.user else None,
+        moderator_id=flags.moderator.id if flags.moderator else None,
+        before_id=flags.before,
+    )
+    if not rows:
+        await ctx.send("No matching moderation log entries.", ephemeral=True)
+        return
+
+    embed = discord.Embed(
+        title="📜 Moderation Log",
+        color=discord.Color.dark_grey(),
+        timestamp=datetime.datetime.now(datetime.timezone.utc)
+    )
+    lines = []
+    for entry_id, created_at, action, moderator_id, target_id, reason, details in rows:
+        line = f"`#{entry_id}` <t:{int(created_at)}:R> **{action}**"
+        if target_id:
+            line += f" <@{target_id}>"
+        if moderator_id:
+            line += f" by <@{moderator_id}>"
+        if reason:
+            line += f" — *{reason}*"
+        if details:
+            line += f" ({details})"
+        lines.append(line[:300])
+    embed.description = "\n".join(lines)
+    if len(rows) == MODLOG_PAGE_SIZE:
+        embed.set_footer(text=f"Next page: add --before {rows[-1][0]}")
+    await ctx.send(embed=embed)
+
+
+@bot.command(name='config', help="Shows this server's effective settings (from the config file or the built-in defaults).")
+@is_moderator()
+async def config_command(ctx):
+    snapshot = guild_config.snapshot
+    settings = snapshot.guilds.get(ctx.guild.id, snapshot.defaults)
+    embed = discord.Embed(
+        title="⚙️ Server Configuration",
+        color=discord.Color.blurple(),
+        timestamp=datetime.datetime.now(datetime.timezone.utc)
+    )
+    embed.description = "\n".join(
+        f"**{name}**: {', '.join(map(str, value)) if isinstance(value, tuple) else value}"
+        for name, value in settings._asdict().items()
+    )
+    source = "server overrides" if ctx.guild.id in snapshot.guilds else "defaults"
+    embed.set_footer(text=f"{source} • {guild_config.path if guild_config.mtime else 'built-in constants'}")
+    await ctx.send(embed=embed)
+
+
+@bot.command(name='reloadconfig', help='Reloads the guild configuration file now (it is also picked up automatically when it changes).')
+@commands.has_permissions(administrator=True)
+async def reloadconfig(ctx):
+    try:
+        snapshot = await reload_guild_config()
+    except ValueError as e:
+        await ctx.send(f"❌ Config not reloaded, the current settings stay in effect: {e}", ephemeral=True)
+        return
+    log_action(ctx, "reloadconfig", details=f"{len(snapshot.allowed_servers)} allowed servers, {len(snapshot.guilds)} with overrides")
+    await ctx.send(f"✅ Configuration reloaded: {len(snapshot.allowed_servers)} allowed servers, {len(snapshot.guilds)} with overrides.")
 
 
 
@@ -482,7 +3771,12 @@ async def targetpurge(ctx, member: discord.Member, amount: int):
 
 # --- Run the Bot ---
 if __name__ == "__main__":
+    log_listener = setup_logging()
     if not DISCORD_BOT_TOKEN:
-        print("❌ FATAL ERROR: DISCORD_BOT_TOKEN environment variable is not set. Exiting.")
+        log.critical("FATAL ERROR: DISCORD_BOT_TOKEN environment variable is not set. Exiting.")
     else:
-        bot.run(DISCORD_BOT_TOKEN)
\ No newline at end of file
+        # Logging is already set up (queue-based), so discord.py must not add its own handler
+        bot.run(DISCORD_BOT_TOKEN, log_handler=None)
+        # Write any moderation events still waiting in the write-behind queue
+        modlog.flush_pending()
+    log_listener.stop()
\ No newline at end of file
@@ -0,0 +1,121 @@
+"""
+Channel archive: write cost, memory and single-member extraction.
+
+Streams a synthetic channel history (default 1,000,000 messages from 50,000 members,
+a few very active, most rare; some messages repost the same image) through
+ArchiveWriter, reporting throughput, peak Python memory and file sizes. Then pulls one
+rarely-posting member's messages out through the sparse index and compares that with
+decompressing the whole archive.
+
+Run from the repository root:  python benchmarks/archive.py [--messages 1000000]
+"""
+import argparse
+import asyncio
+import bisect
+import itertools
+import datetime
+import gzip
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import discord
+import Task_Pilot
+
+MEMBERS = 50_000
+GUILD_ID = 900_000_000_000_000_001
+CHANNEL_ID = 910_000_000_000_000_000
+
+
+def make_messages(count, rng):
+    """Yields message-like objects oldest first, as fast as the writer takes them."""
+    authors = [SimpleNamespace(id=920_000_000_000_000_000 + i, name=f"member{i}", bot=False) for i in range(MEMBERS)]
+    weights = [1 / (rank + 1) for rank in range(MEMBERS)] # Zipf-like activity
+    meme = SimpleNamespace(filename="meme.png", size=48213, content_type="image/png", url="https://cdn.example/meme.png")
+    started = discord.utils.utcnow() - datetime.timedelta(days=365)
+    cumulative = list(itertools.accumulate(weights))
+    for i in range(count):
+        author = authors[bisect.bisect_left(cumulative, rng.random() * cumulative[-1])]
+        created_at = started + datetime.timedelta(seconds=i * 30)
+        attachments = []
+        if i % 50 == 0:
+            attachments.append(meme)
+        elif i % 97 == 0:
+            attachments.append(SimpleNamespace(filename=f"photo{i}.jpg", size=100_000 + i, content_type="image/jpeg", url=f"https://cdn.example/{i}.jpg"))
+        yield SimpleNamespace(
+            id=discord.utils.time_snowflake(created_at) + (i & 0xFFF), created_at=created_at, author=author,
+            content=f"message {i} " + rng.choice(("hello", "gm", "anyone around?", "lol", "check this out")) * rng.randint(1, 8),
+            edited_at=None, reference=None, attachments=attachments, embeds=(),
+        )
+
+
+async def write_archive(messages, channel):
+    writer = Task_Pilot.ArchiveWriter(channel)
+    for message in messages:
+        await writer.write(message)
+    await writer.close()
+    return writer
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    Task_Pilot.ARCHIVE_DIR = tempfile.mkdtemp(prefix="task-pilot-archive-")
+    channel = SimpleNamespace(id=CHANNEL_ID, name="general", guild=SimpleNamespace(id=GUILD_ID))
+
+    # Generating the synthetic messages is not free; time it alone and subtract
+    started = time.perf_counter()
+    for _ in make_messages(args.messages, random.Random(3)):
+        pass
+    generation = time.perf_counter() - started
+    started = time.perf_counter()
+    writer = asyncio.run(write_archive(make_messages(args.messages, random.Random(3)), channel))
+    elapsed = time.perf_counter() - started - generation
+
+    # Memory in a separate, smaller run (tracing slows everything down)
+    traced = min(args.messages, 100_000)
+    tracemalloc.start()
+    messages = make_messages(traced, random.Random(4))
+    first = next(messages) # Builds the synthetic member list outside the measurement
+    baseline = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    asyncio.run(write_archive(itertools.chain((first,), messages), SimpleNamespace(id=CHANNEL_ID + 1, name="general", guild=channel.guild)))
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+
+    base = writer.base
+    sizes = {suffix: os.path.getsize(base + suffix) for suffix in (".jsonl.gz", ".index.jsonl", ".attachments.jsonl.gz")}
+    print(f"wrote {writer.count} messages in {elapsed:.1f}s ({writer.count / elapsed:,.0f} msg/s, excluding generation)")
+    print(f"peak traced memory writing {traced} messages: {peak / 2**20:.1f} MB")
+    for suffix, size in sizes.items():
+        print(f"  {suffix:<22}{size / 2**20:9.1f} MB")
+
+    # An occasional poster (activity rank 1,000): some dozens of messages spread over the year
+    target = 920_000_000_000_000_000 + MEMBERS // 50
+    stats = {}
+    started = time.perf_counter()
+    found = [record["id"] for record in Task_Pilot.read_archive(base, author_id=target, stats=stats)]
+    indexed = time.perf_counter() - started
+
+    started = time.perf_counter()
+    with gzip.open(base + ".jsonl.gz", "rt", encoding="utf-8") as data:
+        expected = [record["id"] for record in map(json.loads, data) if record["author_id"] == target]
+    scanned = time.perf_counter() - started
+    assert found == expected, (len(found), len(expected))
+
+    print(f"one member ({len(found)} messages):")
+    print(f"  sparse index     {indexed * 1000:8.1f} ms, decompressed {stats['blocks_read']} of {stats['blocks']} blocks")
+    print(f"  full decompress  {scanned * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,483 @@
+"""
+In-process stand-in for Discord's gateway and REST API, used by the load harness.
+
+The fake builds real discord.py objects (guilds, members, messages) through the bot's
+own ConnectionState, and replaces `bot.http.request` so every REST call the bot makes
+is answered from memory. Each route goes through a simulated rate-limit bucket and a
+fixed network latency, so throttling shows up in the numbers the way it would live.
+Responses are reported to the bot's aiohttp trace hooks with Discord's rate-limit
+headers, as a real request would be. Nothing here opens a socket.
+"""
+import asyncio
+import bisect
+import datetime
+import random
+import re
+from collections import Counter
+from types import SimpleNamespace
+
+import discord
+import yarl
+
+GUILD_ID = 900_000_000_000_000_001
+BOT_ID = 900_000_000_000_000_002
+MODERATOR_ROLE_ID = 900_000_000_000_000_003
+FIRST_CHANNEL_ID = 910_000_000_000_000_000
+MEMBER_BASE = 920_000_000_000_000_000
+BANNED_BASE = 930_000_000_000_000_000
+
+EVERYONE_PERMISSIONS = "104324673" # Default @everyone permissions
+ADMINISTRATOR = "8"
+
+# (limit, seconds) per bucket. Buckets are per route and major parameter (channel or
+# guild), approximating the limits Discord commonly reports for these routes.
+RATE_LIMITS = {
+    ("GET", "/channels/{channel_id}/messages"): (5, 1.0),
+    ("POST", "/channels/{channel_id}/messages"): (5, 5.0),
+    ("PATCH", "/channels/{channel_id}/messages/{message_id}"): (5, 5.0),
+    ("DELETE", "/channels/{channel_id}/messages/{message_id}"): (5, 1.0),
+    ("POST", "/channels/{channel_id}/messages/bulk-delete"): (1, 1.0),
+    ("GET", "/guilds/{guild_id}/bans"): (10, 10.0),
+    ("GET", "/guilds/{guild_id}/bans/{user_id}"): (5, 5.0),
+    ("PUT", "/guilds/{guild_id}/bans/{user_id}"): (5, 5.0),
+    ("DELETE", "/guilds/{guild_id}/bans/{user_id}"): (5, 5.0),
+    ("PATCH", "/guilds/{guild_id}/members/{user_id}"): (5, 5.0),
+    ("DELETE", "/guilds/{guild_id}/members/{user_id}"): (5, 5.0),
+    ("PUT", "/channels/{channel_id}/permissions/{target}"): (5, 5.0),
+    ("DELETE", "/channels/{channel_id}/permissions/{target}"): (5, 5.0),
+}
+DEFAULT_RATE_LIMIT = (50, 1.0)
+GLOBAL_RATE_LIMIT = (50, 1.0) # Requests per second across all routes
+
+
+def isoformat(dt):
+    return dt.isoformat()
+
+
+class FakeResponse:
+    """Just enough of aiohttp.ClientResponse for discord.HTTPException."""
+
+    def __init__(self, status, reason):
+        self.status = status
+        self.reason = reason
+
+
+def http_error(status, message):
+    response = FakeResponse(status, message)
+    if status == 403:
+        return discord.Forbidden(response, message)
+    if status == 404:
+        return discord.NotFound(response, message)
+    return discord.HTTPException(response, message)
+
+
+class Bucket:
+    """Token bucket that resets every `per` seconds, like a Discord rate-limit bucket."""
+
+    def __init__(self, limit, per):
+        self.limit = limit
+        self.per = per
+        self.remaining = limit
+        self.reset_at = 0.0
+
+    async def acquire(self, time_scale):
+        """Takes one token, waiting for the window to reset if needed. Returns True if throttled."""
+        loop = asyncio.get_running_loop()
+        throttled = False
+        while True:
+            now = loop.time()
+            if now >= self.reset_at:
+                self.remaining = self.limit
+                self.reset_at = now + self.per * time_scale
+            if self.remaining > 0:
+                self.remaining -= 1
+                return throttled
+            throttled = True
+            await asyncio.sleep(self.reset_at - now)
+
+
+class FakeChannel:
+    """Message history of one text channel, stored as parallel ascending arrays."""
+
+    def __init__(self, channel_id, name):
+        self.id = channel_id
+        self.name = name
+        self.ids = []
+        self.authors = []
+        self.contents = {} # Only for messages whose content is not synthetic
+        self.deleted = set()
+        self.overwrites = {} # target_id -> permission overwrite payload
+
+    def append(self, message_id, author_id, content=None):
+        self.ids.append(message_id)
+        self.authors.append(author_id)
+        if content is not None:
+            self.contents[message_id] = content
+
+    def __len__(self):
+        return len(self.ids) - len(self.deleted)
+
+    def newest_before(self, before, limit):
+        """Indices of up to `limit` live messages older than `before`, newest first."""
+        index = bisect.bisect_left(self.ids, before) if before else len(self.ids)
+        found = []
+        while index > 0 and len(found) < limit:
+            index -= 1
+            if self.ids[index] not in self.deleted:
+                found.append(index)
+        return found
+
+    def oldest_after(self, after, limit):
+        """Indices of up to `limit` live messages newer than `after`, newest first (like Discord)."""
+        index = bisect.bisect_right(self.ids, after)
+        found = []
+        while index < len(self.ids) and len(found) < limit:
+            if self.ids[index] not in self.deleted:
+                found.append(index)
+            index += 1
+        found.reverse()
+        return found
+
+
+class FakeDiscord:
+    """
+    Synthetic guild plus REST backend. Call `build()` to generate data and `attach(bot)`
+    to load it into the bot's cache and route its HTTP calls here.
+    """
+
+    def __init__(self, *, members=100_000, bans=50_000, channels=4, history=20_000, history_days=21,
+                 latency=0.040, time_scale=1.0, seed=1234):
+        self.member_count = members
+        self.ban_count = bans
+        self.channel_count = channels
+        self.history_per_channel = history
+        self.history_days = history_days
+        self.latency = latency
+        self.time_scale = time_scale
+        self.rng = random.Random(seed)
+
+        self.members = {} # user_id -> member payload
+        self.bans = [] # Ascending banned user IDs
+        self.banned = set()
+        self.channels = {}
+        self.buckets = {}
+        self.global_bucket = Bucket(*GLOBAL_RATE_LIMIT)
+        self.requests = Counter() # "METHOD /route" -> count
+        self.rate_limited = Counter() # "METHOD /route" -> 429 count
+        self.clock_skew = datetime.timedelta(0) # Added to "now" for the 14-day bulk-delete limit
+        self.bot = None
+        self.state = None
+        self._last_id = 0
+        self._routes = []
+
+    # --- Synthetic data ---
+
+    @staticmethod
+    def user_payload(user_id, bot=False):
+        n = user_id % 1_000_000_000
+        return {
+            "id": str(user_id),
+            "username": f"user{n}",
+            "discriminator": "0",
+            "global_name": f"User {n}",
+            "avatar": None,
+            "bot": bot,
+        }
+
+    def next_id(self, when=None):
+        """Monotonic snowflake for a message created at `when` (default: now)."""
+        when = when or discord.utils.utcnow()
+        self._last_id = max(self._last_id + 1, discord.utils.time_snowflake(when))
+        return self._last_id
+
+    def build(self):
+        now = discord.utils.utcnow()
+        member_ids = [MEMBER_BASE + n for n in range(self.member_count)]
+        self.moderator_id = member_ids[0]
+        self.spammer_id = member_ids[1]
+        for n, user_id in enumerate(member_ids):
+            payload = {
+                "user": self.user_payload(user_id, bot=(n % 100 == 99)),
+                "roles": [str(MODERATOR_ROLE_ID)] if user_id == self.moderator_id else [],
+                "joined_at": isoformat(now - datetime.timedelta(seconds=self.rng.randrange(3 * 365 * 86400))),
+                "deaf": False,
+                "mute": False,
+                "flags": 0,
+            }
+            self.members[user_id] = payload
+        self.members[BOT_ID] = {
+            "user": self.user_payload(BOT_ID, bot=True),
+            "roles": [str(MODERATOR_ROLE_ID)],
+            "joined_at": isoformat(now),
+            "deaf": False,
+            "mute": False,
+            "flags": 0,
+        }
+
+        self.bans = [BANNED_BASE + n for n in range(self.ban_count)]
+        self.banned = set(self.bans)
+
+        # History: evenly spread over `history_days`, so the oldest part is past the
+        # 14-day bulk-delete limit. Channel 0 has a spammer posting every 4th message.
+        span = datetime.timedelta(days=self.history_days)
+        for c in range(self.channel_count):
+            channel = FakeChannel(FIRST_CHANNEL_ID + c, f"load-{c}")
+            start = now - span
+            step = span / max(self.history_per_channel, 1)
+            for i in range(self.history_per_channel):
+                message_id = discord.utils.time_snowflake(start + step * i) + i % 4096
+                author = self.spammer_id if c == 0 and i % 4 == 0 else member_ids[self.rng.randrange(2, len(member_ids))]
+                channel.append(message_id, author)
+            self.channels[channel.id] = channel
+        self._last_id = max(channel.ids[-1] for channel in self.channels.values() if channel.ids) if self.history_per_channel else 0
+
+    def guild_payload(self, include_members=True):
+        """GUILD_CREATE data. Without `include_members` only the bot's own member is sent, as for large guilds."""
+        return {
+            "id": str(GUILD_ID),
+            "name": "Load Test Guild",
+            "owner_id": str(self.moderator_id),
+            "member_count": len(self.members),
+            "large": True,
+            "features": [],
+            "emojis": [],
+            "stickers": [],
+            "premium_tier": 0,
+            "premium_subscription_count": 0,
+            "verification_level": 0,
+            "roles": [
+                {"id": str(GUILD_ID), "name": "@everyone", "permissions": EVERYONE_PERMISSIONS, "position": 0,
+                 "color": 0, "hoist": False, "managed": False, "mentionable": False, "flags": 0},
+                {"id": str(MODERATOR_ROLE_ID), "name": "Moderator", "permissions": ADMINISTRATOR, "position": 1,
+                 "color": 0, "hoist": False, "managed": False, "mentionable": False, "flags": 0},
+            ],
+            "channels": [self.channel_payload(channel) for channel in self.channels.values()],
+            "members": list(self.members.values()) if include_members else [self.members[BOT_ID]],
+        }
+
+    def channel_payload(self, channel):
+        return {"id": str(channel.id), "type": 0, "name": channel.name, "position": channel.id - FIRST_CHANNEL_ID,
+                "guild_id": str(GUILD_ID), "permission_overwrites": list(channel.overwrites.values()),
+                "nsfw": False, "parent_id": None}
+
+    def message_payload(self, channel, index):
+        message_id = channel.ids[index]
+        author_id = channel.authors[index]
+        member = self.members.get(author_id)
+        return {
+            "id": str(message_id),
+            "channel_id": str(channel.id),
+            "guild_id": str(GUILD_ID),
+            "author": member["user"] if member else self.user_payload(author_id),
+            "content": channel.contents.get(message_id, f"synthetic message {message_id % 100000}"),
+            "timestamp": isoformat(discord.utils.snowflake_time(message_id)),
+            "edited_timestamp": None,
+            "tts": False,
+            "mention_everyone": False,
+            "mentions": [],
+            "mention_roles": [],
+            "attachments": [],
+            "embeds": [],
+            "pinned": False,
+            "type": 0,
+            "flags": 0,
+        }
+
+    # --- Gateway side ---
+
+    def attach(self, bot, include_members=True):
+        """
+        Loads the guild into the bot's cache and takes over its REST calls. With
+        `include_members` the full member list is delivered, as startup chunking would.
+        """
+        self.bot = bot
+        self.state = bot._connection
+        self.state.user = discord.ClientUser(state=self.state, data=self.user_payload(BOT_ID, bot=True))
+        self.state._add_guild_from_data(self.guild_payload(include_members))
+        bot.http.request = self.request
+        self._routes = [
+            (method, re.compile("^" + re.sub(r"\{(\w+)\}", r"(?P<\1>[^/]+)", path) + "$"), path, handler)
+            for (method, path), handler in self._handlers().items()
+        ]
+        return bot.get_guild(GUILD_ID)
+
+    def deliver(self, channel_id, author_id, content, mentions=()):
+        """Creates a message as if MESSAGE_CREATE arrived, and returns the discord.Message."""
+        channel = self.channels[channel_id]
+        channel.append(self.next_id(), author_id, content)
+        payload = self.message_payload(channel, len(channel.ids) - 1)
+        payload["mentions"] = [self.members[user_id]["user"] for user_id in mentions]
+        member = self.members.get(author_id)
+        if member is not None:
+            # Gateway messages carry the author's member data (without the user object)
+            payload["member"] = {key: value for key, value in member.items() if key != "user"}
+        guild = self.bot.get_guild(GUILD_ID)
+        return self.state.create_message(channel=guild.get_channel(channel_id), data=payload)
+
+    # --- REST side ---
+
+    async def request(self, route, *, files=None, form=None, **kwargs):
+        for method, pattern, path, handler in self._routes:
+            if method != route.method:
+                continue
+            match = pattern.match(route.url[len(discord.http.Route.BASE):])
+            if match is None:
+                continue
+            key = f"{method} {path}"
+            self.requests[key] += 1
+            major = route.channel_id or route.guild_id
+            bucket = self.buckets.get((method, path, major))
+            if bucket is None:
+                bucket = self.buckets[(method, path, major)] = Bucket(*RATE_LIMITS.get((method, path), DEFAULT_RATE_LIMIT))
+            throttled = await self.global_bucket.acquire(self.time_scale)
+            if await bucket.acquire(self.time_scale) or throttled:
+                self.rate_limited[key] += 1
+            await asyncio.sleep(self.latency * self.time_scale)
+            params = {name: int(value) if value.isdigit() else value for name, value in match.groupdict().items()}
+            try:
+                result = handler(params, kwargs.get("json"), kwargs.get("params") or {})
+            except discord.HTTPException as e:
+                await self._trace(route, e.status, bucket)
+                raise
+            await self._trace(route, 200, bucket)
+            return result
+        self.requests[f"{route.method} {route.path} (unhandled)"] += 1
+        raise http_error(404, f"Fake backend does not implement {route.method} {route.path}")
+
+    async def _trace(self, route, status, bucket):
+        """Calls the bot's on_request_end trace hooks the way aiohttp would for this response."""
+        trace = getattr(self.bot.http, "http_trace", None)
+        if trace is None:
+            return
+        reset_after = max(0.0, bucket.reset_at - asyncio.get_running_loop().time())
+        headers = {"X-RateLimit-Limit": str(bucket.limit), "X-RateLimit-Remaining": str(bucket.remaining),
+                   "X-RateLimit-Reset-After": f"{reset_after:.3f}"}
+        params = SimpleNamespace(method=route.method, url=yarl.URL(route.url), headers={},
+                                 response=SimpleNamespace(status=status, headers=headers))
+        for callback in trace.on_request_end:
+            await callback(None, None, params)
+
+    def _handlers(self):
+        return {
+            ("GET", "/channels/{channel_id}/messages"): self._get_messages,
+            ("POST", "/channels/{channel_id}/messages"): self._post_message,
+            ("PATCH", "/channels/{channel_id}/messages/{message_id}"): self._edit_message,
+            ("DELETE", "/channels/{channel_id}/messages/{message_id}"): self._delete_message,
+            ("POST", "/channels/{channel_id}/messages/bulk-delete"): self._bulk_delete,
+            ("PUT", "/channels/{channel_id}/permissions/{target}"): self._edit_overwrite,
+            ("DELETE", "/channels/{channel_id}/permissions/{target}"): self._delete_overwrite,
+            ("GET", "/guilds/{guild_id}/bans"): self._get_bans,
+            ("GET", "/guilds/{guild_id}/bans/{user_id}"): self._get_ban,
+            ("PUT", "/guilds/{guild_id}/bans/{user_id}"): self._ban,
+            ("DELETE", "/guilds/{guild_id}/bans/{user_id}"): self._unban,
+            ("GET", "/guilds/{guild_id}/members/{member_id}"): self._get_member,
+            ("PATCH", "/guilds/{guild_id}/members/{user_id}"): self._edit_member,
+            ("DELETE", "/guilds/{guild_id}/members/{user_id}"): self._kick,
+        }
+
+    def _channel(self, channel_id):
+        channel = self.channels.get(channel_id)
+        if channel is None:
+            raise http_error(404, "Unknown Channel")
+        return channel
+
+    def _find(self, channel, message_id):
+        index = bisect.bisect_left(channel.ids, message_id)
+        if index == len(channel.ids) or channel.ids[index] != message_id or message_id in channel.deleted:
+            raise http_error(404, "Unknown Message")
+        return index
+
+    def _get_messages(self, params, body, query):
+        channel = self._channel(params["channel_id"])
+        limit = int(query.get("limit", 50))
+        if "after" in query and "before" not in query:
+            indices = channel.oldest_after(int(query["after"]), limit)
+        else:
+            indices = channel.newest_before(int(query["before"]) if "before" in query else None, limit)
+        return [self.message_payload(channel, index) for index in indices]
+
+    def _post_message(self, params, body, query):
+        channel = self._channel(params["channel_id"])
+        channel.append(self.next_id(), BOT_ID, (body or {}).get("content") or "")
+        return self.message_payload(channel, len(channel.ids) - 1)
+
+    def _edit_message(self, params, body, query):
+        channel = self._channel(params["channel_id"])
+        index = self._find(channel, params["message_id"])
+        if body and "content" in body:
+            channel.contents[params["message_id"]] = body["content"] or ""
+        return self.message_payload(channel, index)
+
+    def _delete_message(self, params, body, query):
+        channel = self._channel(params["channel_id"])
+        self._find(channel, params["message_id"])
+        channel.deleted.add(params["message_id"])
+        self.state.parse_message_delete({"id": str(params["message_id"]), "channel_id": str(channel.id), "guild_id": str(GUILD_ID)})
+
+    def _bulk_delete(self, params, body, query):
+        channel = self._channel(params["channel_id"])
+        message_ids = [int(message_id) for message_id in body["messages"]]
+        if not 2 <= len(message_ids) <= 100:
+            raise http_error(400, "Bulk delete takes 2 to 100 messages")
+        cutoff = discord.utils.time_snowflake(discord.utils.utcnow() + self.clock_skew - datetime.timedelta(days=14))
+        if any(message_id < cutoff for message_id in message_ids):
+            raise http_error(400, "You can only bulk delete messages that are under 14 days old.")
+        channel.deleted.update(message_ids)
+        self.state.parse_message_delete_bulk({"ids": body["messages"], "channel_id": str(channel.id), "guild_id": str(GUILD_ID)})
+
+    def _edit_overwrite(self, params, body, query):
+        channel = self._channel(params["channel_id"])
+        target = params["target"]
+        channel.overwrites[target] = {"id": str(target), "type": body["type"], "allow": body["allow"], "deny": body["deny"]}
+        self.state.parse_channel_update(self.channel_payload(channel)) # The CHANNEL_UPDATE the gateway would send
+
+    def _delete_overwrite(self, params, body, query):
+        channel = self._channel(params["channel_id"])
+        channel.overwrites.pop(params["target"], None)
+        self.state.parse_channel_update(self.channel_payload(channel))
+
+    def _get_bans(self, params, body, query):
+        limit = int(query.get("limit", 1000))
+        if "before" in query:
+            end = bisect.bisect_left(self.bans, int(query["before"]))
+            ids = self.bans[max(0, end - limit):end]
+        else:
+            start = bisect.bisect_right(self.bans, int(query.get("after", 0)))
+            ids = self.bans[start:start + limit]
+        return [{"reason": "load test", "user": self.user_payload(user_id)} for user_id in ids]
+
+    def _get_ban(self, params, body, query):
+        if params["user_id"] not in self.banned:
+            raise http_error(404, "Unknown Ban")
+        return {"reason": "load test", "user": self.user_payload(params["user_id"])}
+
+    def _ban(self, params, body, query):
+        user_id = params["user_id"]
+        if user_id not in self.banned:
+            bisect.insort(self.bans, user_id)
+            self.banned.add(user_id)
+
+    def _unban(self, params, body, query):
+        user_id = params["user_id"]
+        if user_id not in self.banned:
+            raise http_error(404, "Unknown Ban")
+        self.banned.discard(user_id)
+        del self.bans[bisect.bisect_left(self.bans, user_id)]
+
+    def _get_member(self, params, body, query):
+        member = self.members.get(params["member_id"])
+        if member is None:
+            raise http_error(404, "Unknown Member")
+        return member
+
+    def _edit_member(self, params, body, query):
+        member = self.members.get(params["user_id"])
+        if member is None:
+            raise http_error(404, "Unknown Member")
+        if body and "communication_disabled_until" in body:
+            member["communication_disabled_until"] = body["communication_disabled_until"]
+        return member
+
+    def _kick(self, params, body, query):
+        if self.members.pop(params["user_id"], None) is None:
+            raise http_error(404, "Unknown Member")
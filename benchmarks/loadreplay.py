@@ -0,0 +1,365 @@
+"""
+Offline load and replay harness for Task_Pilot.
+
+Drives the real `bot` object against the in-process fake Discord backend
+(benchmarks/fake_discord.py): a synthetic guild with 100k members, 50k bans and deep
+channel histories, with simulated per-route rate limits and network latency. No
+network access is needed.
+
+Built-in scenarios replay command and message streams through `on_message` (the same
+entry point the gateway uses) and report p50/p99 latency, throughput, REST calls and
+429s for purge, targetpurge, filtered purges of live traffic (served from the
+recent-message buffer), a purge across the 14-day bulk-delete line, unban, serverinfo, lockdown/unlockdown, channel archives (with
+an archiving purge), a massban during a flood of informational commands (compare with
+TASK_PILOT_OUTBOUND_SCHEDULER=0) and the plain on_message path. The member mode follows
+TASK_PILOT_LAZY_MEMBERS like the bot does (eager unless set to 1).
+
+    python benchmarks/loadreplay.py                       # all scenarios, full size
+    python benchmarks/loadreplay.py --quick               # small guild, 10x faster clock
+    python benchmarks/loadreplay.py --scenarios unban,serverinfo
+    python benchmarks/loadreplay.py --script replay.jsonl # scripted replay
+
+A replay script is JSON lines of {"at": seconds, "content": "...", "author": "moderator"
+| "spammer" | <member index>, "channel": <channel index>}; lines run at their offsets.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+# Keep the bot's local storage in a throwaway directory and the metrics port closed.
+os.environ.setdefault("TASK_PILOT_DATA_DIR", tempfile.mkdtemp(prefix="task-pilot-bench-"))
+os.environ["TASK_PILOT_METRICS_PORT"] = "0"
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import discord
+import Task_Pilot
+from fake_discord import FIRST_CHANNEL_ID, GUILD_ID, FakeDiscord
+
+SCENARIOS = ("serverinfo", "unban", "purge", "targetpurge", "agedpurge", "livepurge", "lockdown", "archive", "raid", "on_message")
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Report:
+    def __init__(self, backend):
+        self.backend = backend
+        self.rows = []
+
+    async def measure(self, name, runs, concurrency=1):
+        """Awaits `runs` (coroutine factories), `concurrency` at a time, and records latency and REST usage."""
+        requests_before = sum(self.backend.requests.values())
+        limited_before = sum(self.backend.rate_limited.values())
+        errors_before = sum(Task_Pilot.metrics.command_errors.values())
+        latencies = []
+        pending = list(runs)
+
+        async def worker():
+            while pending:
+                run = pending.pop(0)
+                started = time.perf_counter()
+                await run()
+                latencies.append(time.perf_counter() - started)
+                await asyncio.sleep(0) # The gateway yields between events; so do we
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        await asyncio.sleep(0) # Let error handlers dispatched by the commands run
+        self.rows.append((
+            name, len(latencies), percentile(latencies, 0.5), percentile(latencies, 0.99),
+            len(latencies) / elapsed if elapsed else 0.0,
+            sum(self.backend.requests.values()) - requests_before,
+            sum(self.backend.rate_limited.values()) - limited_before,
+            sum(Task_Pilot.metrics.command_errors.values()) - errors_before,
+        ))
+        return latencies
+
+    def note(self, text):
+        self.rows.append(text)
+
+    def print(self):
+        print(f"\n{'scenario':<24}{'n':>7}{'p50':>11}{'p99':>11}{'ops/s':>10}{'REST':>8}{'429s':>7}{'errors':>8}")
+        for row in self.rows:
+            if isinstance(row, str):
+                print(f"  {row}")
+                continue
+            name, count, p50, p99, rate, rest, limited, errors = row
+            print(f"{name:<24}{count:>7}{p50 * 1000:>9.2f}ms{p99 * 1000:>9.2f}ms{rate:>10.1f}{rest:>8}{limited:>7}{errors:>8}")
+
+
+async def send(backend, channel_index, author_id, content, mentions=()):
+    """Delivers one message through the bot's on_message handler."""
+    message = backend.deliver(FIRST_CHANNEL_ID + channel_index, author_id, content, mentions)
+    await Task_Pilot.bot.on_message(message)
+
+
+async def scenario_serverinfo(backend, report, args):
+    runs = [lambda: send(backend, 1, backend.moderator_id, "!serverinfo") for _ in range(args.repeat)]
+    await report.measure("serverinfo", runs)
+
+
+async def scenario_unban(backend, report, args):
+    targets = backend.rng.sample(backend.bans, args.repeat)
+    runs = [lambda user_id=user_id: send(backend, 1, backend.moderator_id, f"!unban {user_id}") for user_id in targets]
+    latencies = await report.measure("unban", runs)
+    report.note(f"unban: first call (loads ban index) {latencies[0] * 1000:.1f}ms")
+
+    # A ban the index never heard about (missed gateway event) is found with one lookup
+    missed = backend.bans[0] - 1
+    backend._ban({"user_id": missed}, None, {})
+    await send(backend, 1, backend.moderator_id, f"!unban {missed}")
+    report.note(f"unban of a ban missing from the index: {'unbanned' if missed not in backend.banned else 'NOT unbanned'}")
+
+    # A ban during a reconcile walk lands behind its cursor (the list is paged by ascending
+    # ID) and must survive the swap to the freshly walked list
+    guild = Task_Pilot.bot.get_guild(GUILD_ID)
+    late = backend.bans[0] - 2
+    pages_before = backend.requests["GET /guilds/{guild_id}/bans"]
+    reconcile = asyncio.create_task(Task_Pilot.reconcile_ban_indexes())
+    while backend.requests["GET /guilds/{guild_id}/bans"] < pages_before + 2:
+        await asyncio.sleep(0.001) # Until the first page has been served
+    backend._ban({"user_id": late}, None, {})
+    await Task_Pilot.on_member_ban(guild, discord.User(state=Task_Pilot.bot._connection, data=backend.user_payload(late)))
+    started = time.perf_counter()
+    await reconcile
+    index = Task_Pilot.ban_indexes[GUILD_ID]
+    report.note(f"reconcile: {len(index)} bans indexed (backend {len(backend.bans)}), walk finished {time.perf_counter() - started:.2f}s after the ban, "
+                f"ban made during the walk kept: {late in index.by_id}")
+
+
+async def scenario_purge(backend, report, args):
+    # One purge per channel (1..N), running concurrently like separate moderators would.
+    channels = range(1, backend.channel_count)
+    runs = [lambda c=c: send(backend, c, backend.moderator_id, f"!purge {args.purge_amount}") for c in channels]
+    deleted_before = sum(len(backend.channels[FIRST_CHANNEL_ID + c].deleted) for c in channels)
+    latencies = await report.measure(f"purge {args.purge_amount}", runs, concurrency=len(runs))
+    deleted = sum(len(backend.channels[FIRST_CHANNEL_ID + c].deleted) for c in channels) - deleted_before
+    report.note(f"purge: {deleted} messages deleted, {deleted / max(sum(latencies), 1e-9) * len(runs):.0f} msg/s")
+
+
+async def scenario_targetpurge(backend, report, args):
+    channel = backend.channels[FIRST_CHANNEL_ID]
+    deleted_before = len(channel.deleted)
+    runs = [lambda: send(backend, 0, backend.moderator_id, f"!targetpurge <@{backend.spammer_id}> {args.purge_amount} 30d")]
+    latencies = await report.measure(f"targetpurge {args.purge_amount}", runs)
+    report.note(f"targetpurge: {len(channel.deleted) - deleted_before} spammer messages deleted in {latencies[0]:.2f}s")
+
+
+async def scenario_agedpurge(backend, report, args):
+    # A purge across the 14-day line while the backend's clock runs an hour ahead, as if
+    # the batches near the line had waited that long: they are rejected as a whole and
+    # their messages must still be deleted one by one.
+    channel = backend.channels[FIRST_CHANNEL_ID + 2 % backend.channel_count]
+    bulk_age = datetime.timedelta(days=14)
+    young = sum(1 for message_id in channel.ids if message_id not in channel.deleted
+                and discord.utils.snowflake_time(message_id) > discord.utils.utcnow() - bulk_age)
+    amount = young + 100
+    deleted_before = len(channel.deleted)
+    backend.clock_skew = datetime.timedelta(hours=1)
+    try:
+        await report.measure(f"purge {amount} (14-day line)", [lambda: send(backend, 2 % backend.channel_count, backend.moderator_id, f"!purge {amount}")])
+    finally:
+        backend.clock_skew = datetime.timedelta(0)
+    report.note(f"agedpurge: {len(channel.deleted) - deleted_before - 1} of {amount} deleted (plus the command)")
+
+
+async def scenario_livepurge(backend, report, args):
+    # Live chat passes on_message first, so a filtered purge finds it in the recent-message
+    # buffer without paging history. A regex filter needs message content, which the
+    # buffer does not keep, so the same purge by regex pages history for comparison.
+    rng = backend.rng
+    channel_index = 3 % backend.channel_count
+    members = [user_id for user_id in list(backend.members)[2:] if user_id != backend.spammer_id]
+    links = args.purge_amount // 5
+    for command in (f"!purge {links} --only links", f"!purge {links} --regex spam\\.example"):
+        for i in range(links * 10):
+            content = f"see http://spam.example/{i}" if i % 10 == 0 else f"hello there {i}"
+            await send(backend, channel_index, members[rng.randrange(len(members))], content)
+        pages_before = backend.requests["GET /channels/{channel_id}/messages"]
+        await report.measure(command.split(" ", 2)[2].split()[0] + f" ({links})",
+                             [lambda command=command: send(backend, channel_index, backend.moderator_id, command)])
+        report.note(f"{command}: {backend.requests['GET /channels/{channel_id}/messages'] - pages_before} history pages fetched")
+
+
+async def scenario_lockdown(backend, report, args):
+    # One channel starts with a custom @everyone overwrite; unlockdown must put it back as it was.
+    guild = Task_Pilot.bot.get_guild(GUILD_ID)
+    custom = guild.get_channel(FIRST_CHANNEL_ID + 1)
+    await custom.set_permissions(guild.default_role, overwrite=discord.PermissionOverwrite(embed_links=False, add_reactions=True))
+    before = {channel.id: channel.overwrites for channel in guild.text_channels}
+    await report.measure(f"lockdown {len(before)} channels", [lambda: send(backend, 0, backend.moderator_id, "!lockdown")])
+    locked = sum(channel.overwrites_for(guild.default_role).send_messages is False for channel in guild.text_channels)
+    await report.measure("unlockdown", [lambda: send(backend, 0, backend.moderator_id, "!unlockdown")])
+    restored = sum(channel.overwrites == before[channel.id] for channel in guild.text_channels)
+    report.note(f"lockdown: {locked}/{len(before)} channels locked, {restored}/{len(before)} restored exactly")
+    await custom.set_permissions(guild.default_role, overwrite=None)
+
+
+def newest_archive():
+    directory = os.path.join(Task_Pilot.ARCHIVE_DIR, str(GUILD_ID))
+    newest = max((entry for entry in os.scandir(directory) if entry.name.endswith(".index.jsonl")), key=lambda entry: entry.stat().st_mtime_ns)
+    return newest.name[:-len(".index.jsonl")]
+
+
+async def scenario_archive(backend, report, args):
+    # Archive a whole channel, pull one member back out of it, then purge with --archive:
+    # the archive must hold exactly the messages the purge deleted.
+    channel = backend.channels[FIRST_CHANNEL_ID]
+    await report.measure(f"archive {args.history}", [lambda: send(backend, 1, backend.moderator_id, f"!archive <#{channel.id}> {args.history}")])
+    name = newest_archive()
+    base = Task_Pilot.archive_path(GUILD_ID, name)
+    stats = {}
+    spammer_messages = sum(1 for _ in Task_Pilot.read_archive(base, author_id=backend.spammer_id, stats=stats))
+    report.note(f"archive: {name} {os.path.getsize(base + '.jsonl.gz') / 1024:.0f} KiB, "
+                f"{spammer_messages} spammer messages from {stats['blocks_read']}/{stats['blocks']} blocks")
+    # Concurrent extracts of the same member must not trip over each other's files
+    await report.measure("archiveuser x3", [lambda: send(backend, 0, backend.moderator_id, f"!archiveuser {name} {backend.spammer_id}")] * 3, concurrency=3)
+
+    deleted_before = len(channel.deleted)
+    await report.measure(f"purge {args.purge_amount} --archive",
+                         [lambda: send(backend, 0, backend.moderator_id, f"!purge {args.purge_amount} --archive")])
+    archived = {record["id"] for record in Task_Pilot.read_archive(Task_Pilot.archive_path(GUILD_ID, newest_archive()))}
+    deleted = set(channel.deleted)
+    report.note(f"purge --archive: {len(channel.deleted) - deleted_before - 1} deleted (plus the command), {len(archived)} archived, "
+                f"all archived deleted: {archived <= deleted}")
+
+    # A bare --archive where the window would go must archive, not be taken for the window
+    previous = newest_archive()
+    await report.measure("targetpurge 50 --archive", [lambda: send(backend, 0, backend.moderator_id, f"!targetpurge <@{backend.spammer_id}> 50 --archive --within 30d")])
+    name = newest_archive()
+    archived = sum(1 for _ in Task_Pilot.read_archive(Task_Pilot.archive_path(GUILD_ID, name))) if name != previous else 0
+    report.note(f"targetpurge --archive: {archived} archived as {name}")
+
+
+async def scenario_raid(backend, report, args):
+    # Members flood informational commands while a moderator bans a wave of accounts:
+    # the bans should not queue behind hundreds of cosmetic replies.
+    members = [user_id for user_id in list(backend.members)[2:] if user_id != backend.spammer_id]
+    flooders = members[:args.repeat * 10]
+    targets = members[-25:]
+    # Some targets are already temp-banned: the permanent ban must cancel their unban timers
+    unban_at = discord.utils.utcnow() + datetime.timedelta(days=1)
+    for user_id in targets[:5]:
+        await Task_Pilot.scheduler.schedule(unban_at, "unban", GUILD_ID, user_id)
+    timers_before = len(Task_Pilot.scheduler)
+    flood = asyncio.gather(*(
+        send(backend, 2 % backend.channel_count, user_id, "!serverinfo" if i % 2 else f"!whois <@{user_id}>")
+        for i, user_id in enumerate(flooders)
+    ))
+    await asyncio.sleep(0.05 * args.time_scale)
+    latencies = await report.measure("massban 25 (flood)", [lambda: send(backend, 1, backend.moderator_id, "!massban " + " ".join(map(str, targets)))])
+    flood_started = time.perf_counter()
+    await flood
+    report.note(f"raid: {len(flooders)} info commands alongside; massban took {latencies[0]:.2f}s, "
+                f"flood drained {time.perf_counter() - flood_started:.2f}s later, "
+                f"{Task_Pilot.metrics.outbound_dropped} stale replies dropped, scheduler {'on' if Task_Pilot.OUTBOUND_SCHEDULER else 'off'}, "
+                f"unban timers {timers_before} -> {len(Task_Pilot.scheduler)}")
+
+
+async def scenario_on_message(backend, report, args):
+    # Ordinary chat from many members (no commands, no spam): the hot path of the bot.
+    rng = backend.rng
+    members = list(backend.members)[2:]
+    runs = []
+    for _ in range(args.messages):
+        author = members[rng.randrange(len(members))]
+        content = rng.choice(("hello", "gm", "anyone around?", "lol", "nice"))
+        runs.append(lambda author=author, content=content: send(backend, 2 % backend.channel_count, author, content))
+    await report.measure("on_message", runs)
+
+
+async def replay_script(backend, report, path):
+    """Replays a JSON-lines script at its recorded offsets; reports latency per command name."""
+    with open(path) as f:
+        lines = [json.loads(line) for line in f if line.strip()]
+    by_kind = defaultdict(list)
+    members = list(backend.members)
+
+    async def play(entry):
+        await asyncio.sleep(entry.get("at", 0))
+        author = entry.get("author", "moderator")
+        author_id = {"moderator": backend.moderator_id, "spammer": backend.spammer_id}.get(author)
+        if author_id is None:
+            author_id = members[int(author)]
+        content = entry["content"]
+        kind = content.split()[0] if content.startswith("!") else "message"
+        started = time.perf_counter()
+        await send(backend, entry.get("channel", 0), author_id, content)
+        by_kind[kind].append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(play(entry) for entry in lines))
+    report.note(f"script {os.path.basename(path)}: {len(lines)} lines in {time.perf_counter() - started:.2f}s")
+    for kind, latencies in sorted(by_kind.items()):
+        report.note(f"  {kind:<20} n={len(latencies):<6} p50 {percentile(latencies, 0.5) * 1000:.2f}ms  p99 {percentile(latencies, 0.99) * 1000:.2f}ms")
+
+
+async def main(args):
+    backend = FakeDiscord(
+        members=args.members, bans=args.bans, channels=args.channels, history=args.history,
+        latency=args.latency_ms / 1000, time_scale=args.time_scale,
+    )
+    started = time.perf_counter()
+    backend.build()
+    # As startup chunking would in the default mode; TASK_PILOT_LAZY_MEMBERS=1 replays the lazy mode
+    guild = backend.attach(Task_Pilot.bot, include_members=not Task_Pilot.LAZY_MEMBERS)
+    Task_Pilot.bot.loop = asyncio.get_running_loop() # Normally set by bot.start(); needed to dispatch events
+    await Task_Pilot.bot.setup_hook()
+    # The fake's rate limits run on the scaled clock
+    Task_Pilot.outbound.rate = Task_Pilot.OUTBOUND_RATE_LIMIT / args.time_scale
+    Task_Pilot.outbound.stale_after = Task_Pilot.OUTBOUND_STALE_SECONDS * args.time_scale
+    print(f"Built guild: {len(backend.members)} members ({len(guild.members)} cached, {'lazy' if Task_Pilot.LAZY_MEMBERS else 'eager'} mode), {len(backend.bans)} bans, "
+          f"{args.channels}x{args.history} messages in {time.perf_counter() - started:.1f}s "
+          f"(latency {args.latency_ms}ms, time scale {args.time_scale})")
+
+    report = Report(backend)
+    if args.script:
+        await replay_script(backend, report, args.script)
+    else:
+        for name in args.scenarios:
+            await globals()[f"scenario_{name}"](backend, report, args)
+    report.print()
+
+    lag = Task_Pilot.metrics.loop_lag
+    print(f"\nevent loop lag: p99 {lag.quantile(0.99) * 1000:.1f}ms over {lag.count} probes")
+    print("busiest routes: " + ", ".join(f"{route} x{count}" for route, count in backend.requests.most_common(4)))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--members", type=int, default=100_000)
+    parser.add_argument("--bans", type=int, default=50_000)
+    parser.add_argument("--channels", type=int, default=4)
+    parser.add_argument("--history", type=int, default=20_000, help="messages per channel")
+    parser.add_argument("--latency-ms", type=float, default=40.0, help="simulated REST round trip")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="multiplier for latency and rate-limit windows")
+    parser.add_argument("--repeat", type=int, default=100, help="runs of serverinfo/unban")
+    parser.add_argument("--purge-amount", type=int, default=1000)
+    parser.add_argument("--messages", type=int, default=20_000, help="messages for the on_message scenario")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--script", help="JSON-lines replay script (replaces the built-in scenarios)")
+    parser.add_argument("--quick", action="store_true", help="small guild and a 10x faster clock")
+    args = parser.parse_args(argv)
+    if args.quick:
+        args.members, args.bans, args.history, args.time_scale = 10_000, 5_000, 5_000, 0.1
+        args.repeat, args.messages = 30, 5_000
+    args.scenarios = [name for name in args.scenarios.split(",") if name]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    return args
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,59 @@
+"""
+Micro-benchmark for the is_moderator() check with 250 roles per member.
+
+Compares the old name-based scan (build a list of every role name, then look up
+each MODERATION_ROLES entry in it) with the cached role-ID set intersection.
+
+Run from the repository root:  python benchmarks/moderator_check.py
+"""
+import functools
+import os
+import sys
+import timeit
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import discord
+import Task_Pilot
+
+ROLES_PER_MEMBER = 250
+ITERATIONS = 20000
+
+
+def make_guild():
+    roles = [SimpleNamespace(id=10_000 + i, name=f"role-{i}") for i in range(ROLES_PER_MEMBER - 1)]
+    # The moderator role sits at the bottom of the hierarchy: worst case for a linear scan.
+    roles.append(SimpleNamespace(id=99_999, name=Task_Pilot.MODERATION_ROLES[-1]))
+    roles_by_id = {role.id: role for role in roles}
+    return SimpleNamespace(id=1, roles=roles, get_role=roles_by_id.get)
+
+
+def make_member(guild):
+    member = SimpleNamespace(
+        guild=guild,
+        roles=guild.roles,
+        _roles=discord.utils.SnowflakeList(role.id for role in guild.roles),
+    )
+    # The library's own implementation, run against the stand-in member
+    member.get_role = functools.partial(discord.Member.get_role, member)
+    return member
+
+
+def old_check(member):
+    role_names = [role.name for role in member.roles]
+    return any(role_name in role_names for role_name in Task_Pilot.MODERATION_ROLES)
+
+
+def main():
+    guild = make_guild()
+    member = make_member(guild)
+    assert old_check(member) and Task_Pilot.has_moderator_role(member)
+
+    for label, check in (("name scan (old)", old_check), ("role-ID set (new)", Task_Pilot.has_moderator_role)):
+        best = min(timeit.repeat(lambda: check(member), number=ITERATIONS, repeat=5))
+        print(f"{label:<20} {best / ITERATIONS * 1e6:8.2f} µs/check  ({ROLES_PER_MEMBER} roles)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+CPU cost of the join index behind !raidsweep on a 200k-member guild.
+
+Seeds a JoinIndex from 200,000 members who joined over two years, adds a raid of
+500 fresh accounts through the on_member_join path, then times the "joined in the
+last 10 minutes" query (with the account-age filter) against the old approach of
+scanning every member.
+
+Run from the repository root:  python benchmarks/raidsweep.py [--members 200000]
+"""
+import argparse
+import datetime
+import os
+import random
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import discord
+import Task_Pilot
+
+RAIDERS = 500
+QUERIES = 100
+
+
+def make_members(count, now, rng):
+    members = []
+    for _ in range(count):
+        joined_at = now - datetime.timedelta(seconds=rng.uniform(600, 2 * 365 * 86400))
+        created_at = joined_at - datetime.timedelta(days=rng.uniform(1, 2000))
+        member_id = discord.utils.time_snowflake(created_at) + rng.randrange(1 << 22)
+        members.append(SimpleNamespace(id=member_id, joined_at=joined_at, bot=rng.random() < 0.001))
+    return members
+
+
+def make_raid(now, rng):
+    raid = []
+    for _ in range(RAIDERS):
+        joined_at = now - datetime.timedelta(seconds=rng.uniform(0, 540))
+        created_at = now - datetime.timedelta(hours=rng.uniform(1, 48))
+        raid.append(SimpleNamespace(id=discord.utils.time_snowflake(created_at) + rng.randrange(1 << 22), joined_at=joined_at, bot=False))
+    raid.sort(key=lambda member: member.joined_at)
+    return raid
+
+
+def scan_members(members, since, created_after):
+    """The old approach: walk every member."""
+    return [member.id for member in members if member.joined_at.timestamp() >= since and member.id >= created_after]
+
+
+def query_index(index, since, created_after):
+    """What !raidsweep does before previewing."""
+    return [member_id for member_id, _ in index.since(since) if member_id >= created_after and member_id not in index.bots]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--members", type=int, default=200_000)
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    now = discord.utils.utcnow()
+    members = make_members(args.members, now, rng)
+    raid = make_raid(now, rng)
+
+    index = Task_Pilot.JoinIndex()
+    started = time.process_time()
+    index.seed(members)
+    print(f"seed {args.members} members:      {(time.process_time() - started) * 1000:8.1f} ms CPU")
+
+    started = time.process_time()
+    for member in raid:
+        index.add(member.id, member.joined_at, member.bot)
+    print(f"add {RAIDERS} joins:              {(time.process_time() - started) / RAIDERS * 1e6:8.2f} µs CPU per join")
+
+    since = (now - datetime.timedelta(minutes=10)).timestamp()
+    created_after = discord.utils.time_snowflake(now - datetime.timedelta(days=7))
+    everyone = members + raid
+    expected = sorted(scan_members(everyone, since, created_after))
+    assert sorted(query_index(index, since, created_after)) == expected
+
+    for label, run in (("full member scan (old)", lambda: scan_members(everyone, since, created_after)),
+                       ("join index query (new)", lambda: query_index(index, since, created_after))):
+        started = time.process_time()
+        for _ in range(QUERIES):
+            run()
+        print(f"{label:<28}{(time.process_time() - started) / QUERIES * 1000:8.3f} ms CPU per sweep query ({len(expected)} matches)")
+
+    started = time.process_time()
+    for member in raid[: RAIDERS // 2]:
+        index.remove(member.id)
+    print(f"remove {RAIDERS // 2} members:          {(time.process_time() - started) / (RAIDERS // 2) * 1e6:8.2f} µs CPU per leave")
+    assert len(query_index(index, since, created_after)) == len(expected) - RAIDERS // 2
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Startup cost of eager member chunking vs. lazy member mode.
+
+Each mode runs in a fresh process. The eager run delivers the whole member list to the
+bot (what chunking before on_ready amounts to) with the full member cache; the lazy run
+uses TASK_PILOT_LAZY_MEMBERS=1, where GUILD_CREATE only carries the bot itself. Both
+include what on_ready then does per guild (seeding the member counters and, in eager
+mode, the !raidsweep join index; lazy mode downloads nothing). Reported: time to process
+the guild and resident memory afterwards. Gateway transfer time is not simulated; live,
+chunking also waits for one gateway event per 1,000 members.
+
+Run from the repository root:  python benchmarks/startup.py [--members 200000]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def rss_mb():
+    with open("/proc/self/statm") as f:
+        pages = int(f.read().split()[1])
+    return pages * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+def child(members, lazy):
+    sys.path.insert(0, HERE)
+    sys.path.insert(0, os.path.join(HERE, ".."))
+    import Task_Pilot
+    from fake_discord import FakeDiscord
+
+    backend = FakeDiscord(members=members, bans=0, channels=1, history=0)
+    backend.build()
+    baseline = rss_mb()
+    started = time.perf_counter()
+    guild = backend.attach(Task_Pilot.bot, include_members=not lazy)
+    Task_Pilot.seed_guild_stats(guild)
+    elapsed = time.perf_counter() - started
+    del backend # Drop the synthetic payloads; only the bot's cache should remain
+    stats = Task_Pilot.guild_stats[guild.id]
+    index = Task_Pilot.join_indexes[guild.id]
+    # Eager mode must leave !raidsweep a complete join index (the bot is a member too);
+    # lazy mode one that only grows from joins
+    assert index.seeded == (not lazy) and len(index.joined) == (0 if lazy else members + 1), (index.seeded, len(index.joined))
+    assert stats.humans + stats.bots == members + 1, (stats.humans, stats.bots)
+    print(json.dumps({"seconds": elapsed, "rss_mb": rss_mb() - baseline, "cached": len(guild.members),
+                      "indexed": len(index.joined), "exact": stats.exact}))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--members", type=int, default=200_000)
+    parser.add_argument("--child", choices=("eager", "lazy"))
+    args = parser.parse_args()
+    if args.child:
+        child(args.members, args.child == "lazy")
+        return
+
+    print(f"Guild with {args.members} members")
+    for mode in ("eager", "lazy"):
+        env = dict(os.environ, TASK_PILOT_LAZY_MEMBERS="1" if mode == "lazy" else "0",
+                   TASK_PILOT_DATA_DIR=tempfile.mkdtemp(prefix="task-pilot-bench-"), TASK_PILOT_METRICS_PORT="0")
+        output = subprocess.run([sys.executable, __file__, "--child", mode, "--members", str(args.members)],
+                                env=env, capture_output=True, text=True, check=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{mode:<6} startup {result['seconds']:6.2f}s   +RSS {result['rss_mb']:7.1f} MB   cached members {result['cached']}   "
+              f"join index {result['indexed']}   counts {'exact' if result['exact'] else 'estimated'}")
+
+
+if __name__ == "__main__":
+    main()